@@ -7,57 +7,97 @@ funzionalità per la gestione di clienti, ticket, riparazioni e magazzino.
 
 import json
 import os
+import random
+import re
+import shutil
 import sqlite3
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Iterable, List, Mapping, Optional, Tuple
+from types import MappingProxyType
+from typing import Any, BinaryIO, Dict, Iterable, List, Mapping, Optional, Tuple
 
+import orjson
 import requests
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import (
     Flask,
+    Response,
     abort,
     flash,
+    get_flashed_messages,
     jsonify,
     redirect,
     render_template,
     request,
-    send_file,
+    send_from_directory,
+    session,
+    stream_template,
+    stream_with_context,
     url_for,
 )
 
-from database import get_db, init_db, close_db
+from database import INVENTORY_FTS_SUPPORTED, get_db, init_db, close_db
 from flask_login import current_user, login_required
 
 from auth import admin_required, bp as auth_bp, login_manager
 from auth.google_calendar import GoogleCalendarOAuth
 from werkzeug.datastructures import FileStorage
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import send_from_directory as _send_from_directory_raw
 
+from services.ai_concurrency import AIProviderBusyError, SingleFlight
+from services.ai_suggestion_cache import SQLiteSuggestionCache, SuggestionCache
 from services.customer_codes import generate_next_customer_code
 from services.calendar_sync import resolve_calendar_settings, run_calendar_sync
-from services.calendar_sync_scheduler import CalendarSyncScheduler
+from services.calendar_sync_scheduler import CalendarSyncScheduler, is_reloader_watcher
 
 
-TICKET_STATUSES = [
+TICKET_STATUSES = (
     ("open", "Aperto"),
     ("in_progress", "In lavorazione"),
     ("closed", "Chiuso"),
-]
-TICKET_STATUS_LABELS = {value: label for value, label in TICKET_STATUSES}
-TICKET_STATUS_VALUES = set(TICKET_STATUS_LABELS)
+)
+TICKET_STATUS_LABELS = MappingProxyType(dict(TICKET_STATUSES))
+TICKET_STATUS_VALUES = frozenset(TICKET_STATUS_LABELS)
 DEFAULT_TICKET_STATUS = TICKET_STATUSES[0][0]
 
-REPAIR_STATUSES = [
+REPAIR_STATUSES = (
     ("accettazione", "Accettazione"),
     ("diagnosticato", "Diagnosticato"),
     ("preventivo_pronto", "Preventivo pronto"),
     ("preventivo_accettato", "Preventivo accettato"),
     ("intervento_completato", "Intervento completato"),
-]
-REPAIR_STATUS_LABELS = {value: label for value, label in REPAIR_STATUSES}
-REPAIR_STATUS_VALUES = set(REPAIR_STATUS_LABELS)
+)
+REPAIR_STATUS_LABELS = MappingProxyType(dict(REPAIR_STATUSES))
+REPAIR_STATUS_VALUES = frozenset(REPAIR_STATUS_LABELS)
 DEFAULT_REPAIR_STATUS = REPAIR_STATUSES[0][0]
 
+# Filtri degli elenchi ticket e riparazioni conservati dopo l'eliminazione di una riga.
+TICKETS_FILTER_KEYS = frozenset({'status'})
+REPAIRS_FILTER_KEYS = frozenset({'status', 'from_date', 'to_date'})
+
+DEFAULT_AI_SYSTEM_PROMPT = (
+    'Sei un tecnico di elettrodomestici esperto. '
+    'Fornisci diagnosi sintetiche e professionali in italiano '
+    'sulla base delle informazioni del ticket.'
+)
+
+_AI_USER_PROMPT_HEADER = 'Fornisci una diagnosi sintetica e professionale per il seguente ticket.\n'
+_AI_PROMPT_LABELS = ('Oggetto', 'Prodotto', 'Problema segnalato', 'Dettagli aggiuntivi')
+
+_ATTACHMENT_EXTENSION_RE = re.compile(r'^\.[A-Za-z0-9]+$')
+# Blocchi da 1 MiB: un allegato da 16 MiB richiede 16 letture/scritture.
+_ATTACHMENT_COPY_BUFFER_SIZE = 1024 * 1024
+# Scritture su disco contemporanee durante un caricamento di più allegati.
+_ATTACHMENT_WRITE_WORKERS = 4
+
 NAV_LINK_SPECS = [
     {'endpoint': 'index', 'label': 'Dashboard'},
     {'endpoint': 'customers', 'label': 'Clienti'},
@@ -78,17 +118,45 @@ NAV_LINK_SPECS = [
     {'endpoint': 'admin_users', 'label': 'Utenti', 'admin_only': True},
 ]
 
+# Voci di navigazione principali: sono statiche, quindi il contesto passato ai
+# template è costruito una sola volta.
+_MAIN_NAVIGATION_CONTEXT = MappingProxyType(
+    {
+        'main_navigation': (
+            MappingProxyType({'endpoint': 'index', 'label': 'Dashboard', 'requires_login': True}),
+            MappingProxyType({'endpoint': 'customers', 'label': 'Clienti', 'requires_login': True}),
+            MappingProxyType({'endpoint': 'tickets', 'label': 'Ticket', 'requires_login': True}),
+            MappingProxyType(
+                {'endpoint': 'repairs', 'label': 'Storico riparazioni', 'requires_login': True}
+            ),
+            MappingProxyType({'endpoint': 'magazzino', 'label': 'Magazzino', 'requires_login': True}),
+            MappingProxyType(
+                {
+                    'endpoint': 'calendar_sync',
+                    'label': 'Sync Google Calendar',
+                    'requires_login': True,
+                    'requires_admin': True,
+                }
+            ),
+        )
+    }
+)
+
+
+_TEXT_BLOCK_TYPES = frozenset({'output_text', 'text'})
+
 
 def _extract_openai_responses_text(data: dict) -> str:
     """Estrae il testo utile dalla risposta dell'endpoint /responses di OpenAI."""
 
     fragments: List[str] = []
+    append_fragment = fragments.append
 
     def _push(value: Optional[str]) -> None:
         if isinstance(value, str):
             stripped = value.strip()
             if stripped:
-                fragments.append(stripped)
+                append_fragment(stripped)
 
     output = data.get('output')
     if isinstance(output, list):
@@ -104,7 +172,7 @@ def _extract_openai_responses_text(data: dict) -> str:
                 for block in content:
                     if isinstance(block, dict):
                         block_type = (block.get('type') or '').lower()
-                        if block_type in {'output_text', 'text'}:
+                        if block_type in _TEXT_BLOCK_TYPES:
                             _push(block.get('text'))
                         elif block_type == 'message':
                             _push(block.get('content'))
@@ -130,6 +198,144 @@ def _extract_openai_responses_text(data: dict) -> str:
     return '\n'.join(fragments).strip()
 
 
+class _JitteredRetry(Retry):
+    """Retry con backoff esponenziale e jitter completo.
+
+    L'attesa è scelta a caso fra zero e il backoff esponenziale calcolato da
+    urllib3, così più worker che falliscono insieme non ripetono la chiamata
+    nello stesso istante. L'header ``Retry-After`` del provider ha comunque
+    la precedenza.
+    """
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0.0
+
+
+def _build_ai_session() -> requests.Session:
+    """Crea la sessione HTTP condivisa per le chiamate ai servizi AI.
+
+    La sessione mantiene aperte le connessioni verso i provider (evitando un
+    nuovo handshake TLS a ogni suggerimento) e ripete fino a tre volte le
+    richieste fallite per limiti di frequenza o errori temporanei del servizio.
+    """
+
+    retry = _JitteredRetry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'POST'}),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry)
+    session = requests.Session()
+    # Compressione e keep-alive esplicite anche se un proxy riscrive gli header
+    # predefiniti; "br" viene aggiunto da requests solo se brotli è installato.
+    session.headers.update(
+        {
+            'Accept-Encoding': requests.utils.DEFAULT_ACCEPT_ENCODING,
+            'Connection': 'keep-alive',
+        }
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class AISuggestionError(RuntimeError):
+    """Errore restituito al client quando non è possibile ottenere un suggerimento."""
+
+    def __init__(self, message: str, status_code: int = 502) -> None:
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class ChatProviderSpec:
+    """Parametri di un provider compatibile con l'API chat completions."""
+
+    display_name: str
+    default_endpoint: str
+    model_key: str
+    default_model: str
+    api_key_env: str
+    endpoint_key: Optional[str] = None
+
+
+CHAT_PROVIDERS: Mapping[str, ChatProviderSpec] = MappingProxyType({
+    'openai': ChatProviderSpec(
+        display_name='OpenAI',
+        default_endpoint='https://api.openai.com/v1/chat/completions',
+        model_key='AI_SUGGESTION_OPENAI_MODEL',
+        default_model='gpt-3.5-turbo',
+        api_key_env='OPENAI_API_KEY',
+    ),
+    'deepseek': ChatProviderSpec(
+        display_name='DeepSeek',
+        default_endpoint='https://api.deepseek.com/v1/chat/completions',
+        model_key='AI_SUGGESTION_DEEPSEEK_MODEL',
+        default_model='deepseek-chat',
+        api_key_env='DEEPSEEK_API_KEY',
+        endpoint_key='AI_SUGGESTION_DEEPSEEK_ENDPOINT',
+    ),
+})
+
+
+def _extract_ai_fields(data: Mapping[str, Any]) -> Tuple[str, str, str, str]:
+    """Estrae oggetto, prodotto, problema e descrizione da un payload JSON."""
+
+    return (
+        str(data.get('subject') or '').strip(),
+        str(data.get('product') or '').strip(),
+        str(data.get('issue_description') or '').strip(),
+        str(data.get('description') or '').strip(),
+    )
+
+
+def _write_attachment_file(stream: BinaryIO, folder: Path, stored_filename: str) -> int:
+    """Copia l'allegato in ``folder`` restituendone la dimensione in byte.
+
+    Il file viene scritto con un nome temporaneo e rinominato solo a
+    scrittura completata: un errore non lascia mai file parziali.
+    """
+
+    partial = folder / f'.{stored_filename}.part'
+    try:
+        with open(partial, 'wb') as output:
+            shutil.copyfileobj(stream, output, _ATTACHMENT_COPY_BUFFER_SIZE)
+            file_size = output.tell()
+        os.replace(partial, folder / stored_filename)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    return file_size
+
+
+def _table_version(db, name: str) -> Optional[int]:
+    """Contatore delle modifiche di ``name`` mantenuto dai trigger dello schema."""
+
+    row = db.execute('SELECT version FROM table_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+_KNOWN_DIRECTORIES: set = set()
+
+
+def _ensure_directory(path: Path) -> None:
+    """Crea la cartella indicata una sola volta per processo.
+
+    Non serve un lock: ``mkdir(exist_ok=True)`` è idempotente, quindi due
+    thread che creano insieme la stessa cartella non si ostacolano.
+    """
+
+    key = str(path)
+    if key in _KNOWN_DIRECTORIES:
+        return
+    path.mkdir(parents=True, exist_ok=True)
+    _KNOWN_DIRECTORIES.add(key)
+
+
 def _coerce_int(value: Optional[str], default: int = 0) -> int:
     """Converte una stringa in intero restituendo ``default`` in caso di errore."""
 
@@ -139,6 +345,71 @@ def _coerce_int(value: Optional[str], default: int = 0) -> int:
         return default
 
 
+def _inventory_fts_query(search_query: str) -> Optional[str]:
+    """Traduce il testo cercato in una query FTS5 sull'indice a trigrammi.
+
+    Ogni parola diventa una stringa tra virgolette (così gli operatori FTS5
+    digitati dall'utente non vengono interpretati) e deve comparire come
+    sottostringa. Restituisce ``None`` se una parola è più corta di tre
+    caratteri, lunghezza minima ricercabile con i trigrammi, o se l'indice non
+    esiste perché SQLite è troppo vecchio.
+    """
+
+    if not INVENTORY_FTS_SUPPORTED:
+        return None
+    terms = search_query.split()
+    if not terms or any(len(term) < 3 for term in terms):
+        return None
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _env_flag(value: str) -> bool:
+    """Interpreta una variabile d'ambiente booleana (``1``, ``true``, ``yes``)."""
+
+    return value.strip().lower() in {'1', 'true', 'yes'}
+
+
+# Variabili d'ambiente che sovrascrivono l'omonima chiave di configurazione,
+# con la conversione da applicare; i valori non validi vengono ignorati.
+_ENV_OVERRIDES = (
+    ('AI_SUGGESTION_ENDPOINT', str),
+    ('AI_SUGGESTION_TOKEN', str),
+    ('AI_SUGGESTION_TIMEOUT', int),
+    ('AI_SUGGESTION_CONNECT_TIMEOUT', int),
+    ('AI_SUGGESTION_MIN_INPUT_LENGTH', int),
+    ('AI_SUGGESTION_MAX_CONCURRENCY', int),
+    ('AI_SUGGESTION_CACHE_TTL', int),
+    ('AI_SUGGESTION_CACHE_BACKEND', str),
+    ('AI_SUGGESTION_PROVIDER', str),
+    ('AI_SUGGESTION_SYSTEM_PROMPT', str),
+    ('AI_SUGGESTION_OPENAI_MODEL', str),
+    ('AI_SUGGESTION_DEEPSEEK_MODEL', str),
+    ('AI_SUGGESTION_DEEPSEEK_ENDPOINT', str),
+    ('GOOGLE_CALENDAR_CREDENTIALS_FILE', str),
+    ('GOOGLE_CALENDAR_TOKEN_FILE', str),
+    ('GOOGLE_CALENDAR_SCOPES', str),
+    ('GOOGLE_CALENDAR_ID', str),
+    ('USE_X_SENDFILE', _env_flag),
+    ('ATTACHMENT_X_ACCEL_PREFIX', str),
+    ('JINJA_BYTECODE_CACHE_DIR', str),
+)
+
+
+def _parse_iso_date(value: Optional[str]) -> Optional[date]:
+    """Interpreta una data ``AAAA-MM-GG`` restituendo ``None`` se non valida."""
+
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _resolve_ai_system_prompt(system_prompt: Optional[str]) -> str:
+    """Restituisce il prompt di sistema configurato o quello predefinito."""
+
+    return system_prompt or DEFAULT_AI_SYSTEM_PROMPT
+
+
 def _build_ai_prompts(
     system_prompt: Optional[str],
     subject: str,
@@ -146,31 +417,24 @@ def _build_ai_prompts(
     issue_description: str,
     description: str,
 ) -> Tuple[str, str]:
-    """Costruisce il prompt di sistema e dell'utente per i suggerimenti AI."""
+    """Costruisce il prompt di sistema e dell'utente per i suggerimenti AI.
 
-    effective_system_prompt = (
-        system_prompt
-        or 'Sei un tecnico di elettrodomestici esperto. '
-        'Fornisci diagnosi sintetiche e professionali in italiano '
-        'sulla base delle informazioni del ticket.'
-    )
+    Il prompt di sistema non contiene mai dati del ticket: restando identico
+    tra le richieste permette ai provider di riutilizzare la cache del
+    prefisso. Tutte le informazioni variabili finiscono nel prompt utente.
+    """
 
-    details: List[str] = []
-    if subject:
-        details.append(f"Oggetto: {subject}")
-    if product:
-        details.append(f"Prodotto: {product}")
-    if issue_description:
-        details.append(f"Problema segnalato: {issue_description}")
-    if description:
-        details.append(f"Dettagli aggiuntivi: {description}")
-    if not details:
-        details.append('Non sono disponibili informazioni aggiuntive.')
-
-    user_prompt = (
-        'Fornisci una diagnosi sintetica e professionale per il seguente ticket.'
-        '\n' + '\n'.join(details)
-    )
+    effective_system_prompt = _resolve_ai_system_prompt(system_prompt)
+
+    details = [
+        f'{label}: {value}'
+        for label, value in zip(
+            _AI_PROMPT_LABELS, (subject, product, issue_description, description)
+        )
+        if value
+    ] or ['Non sono disponibili informazioni aggiuntive.']
+
+    user_prompt = _AI_USER_PROMPT_HEADER + '\n'.join(details)
 
     return effective_system_prompt, user_prompt
 
@@ -188,44 +452,132 @@ TICKET_HISTORY_FIELD_LABELS = {
 }
 
 
-def _fetch_latest_ticket_history_entries(
-    db,
-    ticket_ids: Iterable[int],
-    fields: Iterable[str],
-):
-    """Recupera l'ultima modifica registrata per i campi richiesti."""
+def _sql_latest_change_join(field: str, alias: str) -> str:
+    """JOIN con l'ultima riga di storico di ``field`` e con il suo autore.
 
-    unique_ids = [int(ticket_id) for ticket_id in dict.fromkeys(ticket_ids) if ticket_id]
-    unique_fields = [field for field in dict.fromkeys(fields) if field]
+    La sottoquery correlata percorre ``idx_ticket_history_lookup`` e legge una
+    sola voce per ticket, così l'elenco arriva già con l'ultimo cambio di stato.
+    """
 
-    latest = {field: {} for field in unique_fields}
+    return (
+        f'LEFT JOIN ticket_history {alias} ON {alias}.id = ('
+        'SELECT h.id FROM ticket_history h '
+        f"WHERE h.ticket_id = t.id AND h.field = '{field}' "
+        'ORDER BY h.changed_at DESC, h.id DESC LIMIT 1) '
+        f'LEFT JOIN users {alias}_user ON {alias}.changed_by = {alias}_user.id '
+    )
 
-    if not unique_ids or not unique_fields:
-        return latest
 
-    placeholders_ids = ','.join('?' for _ in unique_ids)
-    placeholders_fields = ','.join('?' for _ in unique_fields)
+# Query dell'elenco ticket: testi SQL fissi per sfruttare la cache delle
+# istruzioni preparate di sqlite3 invece di ricomporre la stringa a ogni richiesta.
+# Sono lette solo le colonne mostrate in ``tickets.html``.
+_SQL_TICKETS_SELECT = (
+    'SELECT t.id, t.subject, t.status, t.created_at, '
+    'c.name AS customer_name, c.code AS customer_code, '
+    'creator.username AS created_by_username, '
+    'status_change.changed_at AS status_changed_at, '
+    'status_change_user.username AS status_changed_by_username '
+    'FROM tickets t '
+    'JOIN customers c ON t.customer_id = c.id '
+    'LEFT JOIN users creator ON t.created_by = creator.id '
+    + _sql_latest_change_join('status', 'status_change')
+)
+# Il totale è contato a parte sull'indice: una funzione finestra obbligherebbe
+# SQLite a risolvere i JOIN di tutti i ticket e non solo di quelli della pagina.
+_SQL_TICKETS_PAGE = 'ORDER BY t.created_at DESC, t.id DESC LIMIT ? OFFSET ?'
+SQL_TICKETS_ALL = _SQL_TICKETS_SELECT + _SQL_TICKETS_PAGE
+SQL_TICKETS_BY_STATUS = _SQL_TICKETS_SELECT + 'WHERE t.status = ? ' + _SQL_TICKETS_PAGE
+SQL_TICKETS_COUNT_ALL = 'SELECT COUNT(*) FROM tickets'
+SQL_TICKETS_COUNT_BY_STATUS = 'SELECT COUNT(*) FROM tickets WHERE status = ?'
+
+# Ultimo cambio di stato e di stato riparazione mostrati nel dettaglio ticket.
+SQL_TICKET_LATEST_CHANGES = (
+    'SELECT status_change.changed_at AS status_changed_at, '
+    'status_change_user.username AS status_changed_by_username, '
+    'repair_change.changed_at AS repair_status_changed_at, '
+    'repair_change_user.username AS repair_status_changed_by_username '
+    'FROM tickets t '
+    + _sql_latest_change_join('status', 'status_change')
+    + _sql_latest_change_join('repair_status', 'repair_change')
+    + 'WHERE t.id = ?'
+)
 
-    rows = db.execute(
-        f'''\
-        SELECT h.ticket_id, h.field, h.old_value, h.new_value, h.changed_at, u.username AS changed_by_username
-        FROM ticket_history h
-        LEFT JOIN users u ON h.changed_by = u.id
-        WHERE h.ticket_id IN ({placeholders_ids})
-          AND h.field IN ({placeholders_fields})
-        ORDER BY h.changed_at DESC, h.id DESC
-        ''',
-        (*unique_ids, *unique_fields),
-    ).fetchall()
+# Elenco riparazioni con forma costante: i filtri opzionali usano
+# ``? IS NULL OR ...`` così la stessa istruzione compilata viene riutilizzata
+# dalla cache della connessione qualunque sia la combinazione di filtri.
+SQL_REPAIRS_PAGE = (
+    'SELECT t.id, t.subject, t.product, t.issue_description, t.payment_info, '
+    't.repair_status, t.date_received, t.date_repaired, t.date_returned, t.created_at, '
+    'c.name AS customer_name, c.code AS customer_code, '
+    'creator.username AS created_by_username, '
+    'repair_change.changed_at AS repair_status_changed_at, '
+    'repair_change_user.username AS repair_status_changed_by_username, '
+    'COALESCE(t.date_returned, t.updated_at) AS sort_key '
+    'FROM tickets t '
+    'JOIN customers c ON t.customer_id = c.id '
+    'LEFT JOIN users creator ON t.created_by = creator.id '
+    + _sql_latest_change_join('repair_status', 'repair_change')
+    + 'WHERE (t.product IS NOT NULL OR t.issue_description IS NOT NULL) '
+    'AND (:status IS NULL OR t.repair_status = :status) '
+    'AND (:from_date IS NULL OR DATE(COALESCE(t.date_returned, t.date_repaired, t.date_received, t.updated_at)) >= :from_date) '
+    'AND (:to_date IS NULL OR DATE(COALESCE(t.date_returned, t.date_repaired, t.date_received, t.updated_at)) <= :to_date) '
+    'AND (:cursor_id IS NULL OR (COALESCE(t.date_returned, t.updated_at), t.id) < (:cursor_value, :cursor_id)) '
+    'ORDER BY COALESCE(t.date_returned, t.updated_at) DESC, t.id DESC '
+    'LIMIT :limit'
+)
+
+# Campi del ticket confrontati e storicizzati a ogni aggiornamento.
+TICKET_TRACKED_FIELDS = (
+    'status',
+    'product',
+    'issue_description',
+    'payment_info',
+    'repair_status',
+    'date_received',
+    'date_repaired',
+    'date_returned',
+)
 
-    for row in rows:
-        field = row['field']
-        ticket_id = row['ticket_id']
-        field_map = latest.setdefault(field, {})
-        if ticket_id not in field_map:
-            field_map[ticket_id] = row
 
-    return latest
+@lru_cache(maxsize=64)
+def _ticket_update_sql(fields: Tuple[str, ...]) -> str:
+    """UPDATE dei soli campi modificati, con testo stabile per ogni combinazione.
+
+    ``fields`` contiene solo nomi presi da ``TICKET_TRACKED_FIELDS``, nello
+    stesso ordine: ogni insieme di campi produce sempre la stessa istruzione e
+    riusa quella già compilata nella cache della connessione.
+    """
+
+    assignments = ''.join(f'{field} = ?, ' for field in fields)
+    return (
+        f'UPDATE tickets SET {assignments}'
+        'last_modified_by = ?, updated_at = CURRENT_TIMESTAMP '
+        'WHERE id = ?'
+    )
+
+
+# Etichette leggibili con cui i valori di stato vengono salvati nello storico.
+_HISTORY_VALUE_LABELS = MappingProxyType(
+    {'status': TICKET_STATUS_LABELS, 'repair_status': REPAIR_STATUS_LABELS}
+)
+
+
+def _format_history_value(field: str, value: Any) -> Optional[str]:
+    """Valore di ``field`` come viene registrato in ``ticket_history``."""
+
+    if value is None:
+        return None
+    labels = _HISTORY_VALUE_LABELS.get(field)
+    if labels is None:
+        return str(value)
+    return labels.get(value, value)
+
+
+# Pagine dell'elenco ticket conservate già renderizzate per ogni filtro.
+_TICKETS_CACHED_PAGES = 5
+
+# Modifiche più recenti mostrate nello storico del dettaglio ticket.
+TICKET_HISTORY_DISPLAY_LIMIT = 200
 
 
 def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
@@ -245,16 +597,25 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
         SECRET_KEY='change-me-please',
         DATABASE=str(Path(app.root_path) / 'database.db'),
         UPLOAD_FOLDER=str(Path(app.instance_path) / 'uploads'),
+        JINJA_BYTECODE_CACHE_DIR=str(Path(app.instance_path) / 'jinja_cache'),
         MAX_CONTENT_LENGTH=16 * 1024 * 1024,
+        REPAIRS_PAGE_SIZE=50,
+        INVENTORY_PAGE_SIZE=100,
+        TICKETS_PAGE_SIZE=50,
+        USE_X_SENDFILE=False,
+        ATTACHMENT_X_ACCEL_PREFIX=None,
         AI_SUGGESTION_ENDPOINT=None,
         AI_SUGGESTION_TOKEN=None,
         AI_SUGGESTION_TIMEOUT=15,
+        AI_SUGGESTION_CONNECT_TIMEOUT=5,
+        AI_SUGGESTION_BATCH_LIMIT=20,
+        AI_SUGGESTION_MIN_INPUT_LENGTH=20,
+        AI_SUGGESTION_MAX_CONCURRENCY=4,
+        AI_SUGGESTION_CACHE_TTL=3600,
+        AI_SUGGESTION_CACHE_SIZE=1024,
+        AI_SUGGESTION_CACHE_BACKEND='sqlite',
         AI_SUGGESTION_PROVIDER='generic',
-        AI_SUGGESTION_SYSTEM_PROMPT=(
-            'Sei un tecnico di elettrodomestici esperto. '
-            'Fornisci diagnosi sintetiche e professionali in italiano '
-            'sulla base delle informazioni del ticket.'
-        ),
+        AI_SUGGESTION_SYSTEM_PROMPT=DEFAULT_AI_SYSTEM_PROMPT,
         AI_SUGGESTION_OPENAI_MODEL='gpt-3.5-turbo',
         AI_SUGGESTION_DEEPSEEK_MODEL='deepseek-chat',
         AI_SUGGESTION_DEEPSEEK_ENDPOINT='https://api.deepseek.com/v1/chat/completions',
@@ -276,43 +637,47 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
     app.config.from_pyfile('config.py', silent=True)
 
     # Le variabili d'ambiente hanno la precedenza finale
-    if 'AI_SUGGESTION_ENDPOINT' in os.environ:
-        app.config['AI_SUGGESTION_ENDPOINT'] = os.environ['AI_SUGGESTION_ENDPOINT']
-    if 'AI_SUGGESTION_TOKEN' in os.environ:
-        app.config['AI_SUGGESTION_TOKEN'] = os.environ['AI_SUGGESTION_TOKEN']
-    if 'AI_SUGGESTION_TIMEOUT' in os.environ:
+    for env_name, cast in _ENV_OVERRIDES:
+        raw_value = os.environ.get(env_name)
+        if raw_value is None:
+            continue
         try:
-            app.config['AI_SUGGESTION_TIMEOUT'] = int(os.environ['AI_SUGGESTION_TIMEOUT'])
+            app.config[env_name] = cast(raw_value)
         except (TypeError, ValueError):
             pass
-    if 'AI_SUGGESTION_PROVIDER' in os.environ:
-        app.config['AI_SUGGESTION_PROVIDER'] = os.environ['AI_SUGGESTION_PROVIDER']
-    if 'AI_SUGGESTION_SYSTEM_PROMPT' in os.environ:
-        app.config['AI_SUGGESTION_SYSTEM_PROMPT'] = os.environ['AI_SUGGESTION_SYSTEM_PROMPT']
-    if 'AI_SUGGESTION_OPENAI_MODEL' in os.environ:
-        app.config['AI_SUGGESTION_OPENAI_MODEL'] = os.environ['AI_SUGGESTION_OPENAI_MODEL']
-    if 'AI_SUGGESTION_DEEPSEEK_MODEL' in os.environ:
-        app.config['AI_SUGGESTION_DEEPSEEK_MODEL'] = os.environ['AI_SUGGESTION_DEEPSEEK_MODEL']
-    if 'AI_SUGGESTION_DEEPSEEK_ENDPOINT' in os.environ:
-        app.config['AI_SUGGESTION_DEEPSEEK_ENDPOINT'] = os.environ['AI_SUGGESTION_DEEPSEEK_ENDPOINT']
-    if 'GOOGLE_CALENDAR_CREDENTIALS_FILE' in os.environ:
-        app.config['GOOGLE_CALENDAR_CREDENTIALS_FILE'] = os.environ['GOOGLE_CALENDAR_CREDENTIALS_FILE']
-    if 'GOOGLE_CALENDAR_TOKEN_FILE' in os.environ:
-        app.config['GOOGLE_CALENDAR_TOKEN_FILE'] = os.environ['GOOGLE_CALENDAR_TOKEN_FILE']
-    if 'GOOGLE_CALENDAR_SCOPES' in os.environ:
-        app.config['GOOGLE_CALENDAR_SCOPES'] = os.environ['GOOGLE_CALENDAR_SCOPES']
-    if 'GOOGLE_CALENDAR_ID' in os.environ:
-        app.config['GOOGLE_CALENDAR_ID'] = os.environ['GOOGLE_CALENDAR_ID']
 
     if test_config:
         app.config.update(test_config)
 
     # Garantisce che le directory per i file di istanza e gli upload esistano.
-    Path(app.instance_path).mkdir(parents=True, exist_ok=True)
-    Path(app.config['UPLOAD_FOLDER']).mkdir(parents=True, exist_ok=True)
+    _ensure_directory(Path(app.instance_path))
+    _ensure_directory(Path(app.config['UPLOAD_FOLDER']))
+
+    # I template compilati sono salvati su disco e condivisi fra worker e
+    # riavvii: solo il primo processo paga la compilazione di ogni template.
+    bytecode_cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+    if bytecode_cache_dir:
+        _ensure_directory(Path(bytecode_cache_dir))
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
 
     login_manager.init_app(app)
 
+    # Sessione HTTP condivisa fra le richieste di suggerimento AI dell'istanza.
+    app.extensions['ai_http'] = _build_ai_session()
+    # Tabelle dell'elenco ticket già renderizzate, per filtro e ruolo utente.
+    app.extensions['tickets_table_cache'] = {}
+    app.extensions['ai_inflight'] = SingleFlight(
+        _coerce_int(app.config.get('AI_SUGGESTION_MAX_CONCURRENCY'), 4)
+    )
+    cache_ttl = _coerce_int(app.config.get('AI_SUGGESTION_CACHE_TTL'), 3600)
+    if (app.config.get('AI_SUGGESTION_CACHE_BACKEND') or 'sqlite').lower() == 'memory':
+        app.extensions['ai_cache'] = SuggestionCache(
+            maxsize=_coerce_int(app.config.get('AI_SUGGESTION_CACHE_SIZE'), 1024),
+            ttl=cache_ttl,
+        )
+    else:
+        app.extensions['ai_cache'] = SQLiteSuggestionCache(ttl=cache_ttl)
+
     def _build_navigation_links() -> List[dict]:
         """Crea la struttura delle voci di menu principali."""
 
@@ -362,7 +727,7 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
     with app.app_context():
         init_db()
 
-    if app.config.get('GOOGLE_CALENDAR_AUTO_SYNC_ENABLED'):
+    if app.config.get('GOOGLE_CALENDAR_AUTO_SYNC_ENABLED') and not is_reloader_watcher(app):
         interval = _coerce_int(app.config.get('GOOGLE_CALENDAR_AUTO_SYNC_INTERVAL'), 3600)
         past_days = _coerce_int(app.config.get('GOOGLE_CALENDAR_AUTO_SYNC_PAST_DAYS'), 30)
         future_days = _coerce_int(app.config.get('GOOGLE_CALENDAR_AUTO_SYNC_FUTURE_DAYS'), 7)
@@ -384,21 +749,7 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
     def inject_main_navigation():
         """Rende disponibile l'elenco delle voci di navigazione principali."""
 
-        items = [
-            {"endpoint": "index", "label": "Dashboard", "requires_login": True},
-            {"endpoint": "customers", "label": "Clienti", "requires_login": True},
-            {"endpoint": "tickets", "label": "Ticket", "requires_login": True},
-            {"endpoint": "repairs", "label": "Storico riparazioni", "requires_login": True},
-            {"endpoint": "magazzino", "label": "Magazzino", "requires_login": True},
-            {
-                "endpoint": "calendar_sync",
-                "label": "Sync Google Calendar",
-                "requires_login": True,
-                "requires_admin": True,
-            },
-        ]
-
-        return {"main_navigation": items}
+        return _MAIN_NAVIGATION_CONTEXT
 
 
     def _store_ticket_attachments(
@@ -408,15 +759,11 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
     ) -> Tuple[int, List[str]]:
         """Salva gli allegati ricevuti per un ticket restituendo numero e errori."""
 
-        saved = 0
         errors: List[str] = []
-        upload_root = Path(app.config['UPLOAD_FOLDER'])
-        upload_root.mkdir(parents=True, exist_ok=True)
-        ticket_folder = upload_root / str(ticket_id)
-        ticket_folder.mkdir(parents=True, exist_ok=True)
-
-        db = get_db()
+        ticket_folder = Path(app.config['UPLOAD_FOLDER']) / str(ticket_id)
+        _ensure_directory(ticket_folder)
 
+        planned: List[Tuple[FileStorage, str, str]] = []
         for storage in files:
             if storage is None:
                 continue
@@ -424,32 +771,38 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             if not original_filename:
                 continue
 
-            safe_name = secure_filename(original_filename)
-            if not safe_name:
-                errors.append(
-                    f'Impossibile caricare il file "{original_filename}": nome non valido.'
-                )
-                continue
-
-            extension = Path(safe_name).suffix
-            stored_filename = f"{uuid.uuid4().hex}{extension}"
-            destination = ticket_folder / stored_filename
+            # Il nome originale resta solo nel database: su disco usiamo un UUID
+            # e conserviamo l'estensione soltanto se composta da caratteri sicuri.
+            extension = os.path.splitext(original_filename)[1][:16].lower()
+            if not _ATTACHMENT_EXTENSION_RE.match(extension):
+                extension = ''
+            planned.append((storage, original_filename, f"{uuid.uuid4().hex}{extension}"))
 
+        def _save(item: Tuple[FileStorage, str, str]) -> Optional[int]:
+            storage, _, stored_filename = item
             try:
-                storage.save(destination)
+                return _write_attachment_file(storage.stream, ticket_folder, stored_filename)
             except Exception:
+                return None
+
+        # Con più file le scritture procedono in parallelo: il tempo del
+        # caricamento è quello del file più lento invece della somma.
+        if len(planned) > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(_ATTACHMENT_WRITE_WORKERS, len(planned))
+            ) as pool:
+                sizes = list(pool.map(_save, planned))
+        else:
+            sizes = [_save(item) for item in planned]
+
+        rows: List[Tuple[Any, ...]] = []
+        for (storage, original_filename, stored_filename), file_size in zip(planned, sizes):
+            if file_size is None:
                 errors.append(
                     f'Errore durante il salvataggio del file "{original_filename}".'
                 )
-                if destination.exists():
-                    destination.unlink()
                 continue
-
-            file_size = destination.stat().st_size
-            db.execute(
-                'INSERT INTO ticket_attachments ('
-                'ticket_id, original_filename, stored_filename, content_type, file_size, uploaded_by'
-                ') VALUES (?, ?, ?, ?, ?, ?)',
+            rows.append(
                 (
                     ticket_id,
                     original_filename,
@@ -457,24 +810,59 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
                     storage.mimetype or None,
                     file_size,
                     uploaded_by,
-                ),
+                )
+            )
+
+        # Un solo INSERT per tutti i file; il commit resta al chiamante, che
+        # lo esegue insieme alle altre modifiche del ticket.
+        if rows:
+            get_db().executemany(
+                'INSERT INTO ticket_attachments ('
+                'ticket_id, original_filename, stored_filename, content_type, file_size, uploaded_by'
+                ') VALUES (?, ?, ?, ?, ?, ?)',
+                rows,
             )
-            saved += 1
+        saved = len(rows)
 
         return saved, errors
 
 
+    def _customer_choices(db) -> Tuple[sqlite3.Row, ...]:
+        """Elenco clienti per le select, riletto solo se la tabella è cambiata.
+
+        I trigger su ``customers`` incrementano ``table_versions``: la lettura
+        della versione è una ricerca per chiave primaria e vede anche le
+        modifiche fatte da altri processi.
+        """
+
+        version = _table_version(db, 'customers')
+        cached = app.extensions.get('customer_choices')
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+        customers = tuple(
+            db.execute('SELECT id, name, code FROM customers ORDER BY name').fetchall()
+        )
+        if version is not None:
+            app.extensions['customer_choices'] = (version, customers)
+        return customers
+
     def _delete_ticket_record(ticket_id: int) -> Tuple[bool, Optional[str]]:
-        """Elimina il ticket specificato restituendo l'esito e l'oggetto."""
+        """Elimina il ticket specificato restituendo l'esito e l'oggetto.
+
+        Storico e allegati vengono rimossi dal vincolo ``ON DELETE CASCADE``;
+        i file su disco solo dopo il commit.
+        """
         db = get_db()
         ticket = db.execute(
-            'SELECT subject FROM tickets WHERE id = ?',
+            'DELETE FROM tickets WHERE id = ? RETURNING subject',
             (ticket_id,),
         ).fetchone()
         if ticket is None:
             return False, None
-        db.execute('DELETE FROM tickets WHERE id = ?', (ticket_id,))
         db.commit()
+        ticket_folder = Path(app.config['UPLOAD_FOLDER']) / str(ticket_id)
+        _KNOWN_DIRECTORIES.discard(str(ticket_folder))
+        shutil.rmtree(ticket_folder, ignore_errors=True)
         return True, ticket['subject']
 
 
@@ -483,12 +871,12 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
     @login_required
     def index():
         db = get_db()
-        ticket_count = db.execute('SELECT COUNT(*) AS count FROM tickets').fetchone()['count']
-        customer_count = db.execute('SELECT COUNT(*) AS count FROM customers').fetchone()['count']
-        repair_count = db.execute(
-            'SELECT COUNT(*) AS count FROM tickets '
-            'WHERE product IS NOT NULL OR issue_description IS NOT NULL'
-        ).fetchone()['count']
+        ticket_count, customer_count, repair_count = db.execute(
+            'SELECT (SELECT COUNT(*) FROM tickets), '
+            '(SELECT COUNT(*) FROM customers), '
+            '(SELECT COUNT(*) FROM tickets '
+            'WHERE product IS NOT NULL OR issue_description IS NOT NULL)'
+        ).fetchone()
         return render_template('index.html', ticket_count=ticket_count,
                                customer_count=customer_count, repair_count=repair_count)
 
@@ -565,16 +953,8 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
                     redirect_kwargs['edit'] = item_id_int
                     return redirect(url_for('magazzino', **redirect_kwargs))
 
-                existing = db.execute(
-                    'SELECT id FROM inventory_items WHERE id = ?',
-                    (item_id_int,),
-                ).fetchone()
-                if existing is None:
-                    flash('Articolo di magazzino non trovato.', 'error')
-                    return redirect(url_for('magazzino', **redirect_kwargs))
-
                 try:
-                    db.execute(
+                    cursor = db.execute(
                         'UPDATE inventory_items SET '
                         'code = ?, name = ?, description = ?, quantity = ?, '
                         'minimum_quantity = ?, location = ?, category = ?, notes = ?, '
@@ -593,7 +973,10 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
                         ),
                     )
                     db.commit()
-                    flash('Articolo di magazzino aggiornato correttamente.', 'success')
+                    if cursor.rowcount:
+                        flash('Articolo di magazzino aggiornato correttamente.', 'success')
+                    else:
+                        flash('Articolo di magazzino non trovato.', 'error')
                 except sqlite3.IntegrityError:
                     flash('Esiste già un articolo con questo codice.', 'error')
                     redirect_kwargs['edit'] = item_id_int
@@ -634,37 +1017,58 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             if edit_item is None:
                 flash('Impossibile trovare l\'articolo richiesto per la modifica.', 'error')
 
+        # Quantità complessiva e articoli sotto scorta sono calcolati da SQLite
+        # sulle stesse righe filtrate, con funzioni finestra.
         params: List[str] = []
         query = (
-            'SELECT id, code, name, description, quantity, minimum_quantity, '
-            'location, category, notes, created_at, updated_at '
-            'FROM inventory_items'
+            'SELECT i.id, i.code, i.name, i.description, i.quantity, i.minimum_quantity, '
+            'i.location, i.category, i.notes, i.created_at, i.updated_at, '
+            '(i.minimum_quantity > 0 AND i.quantity <= i.minimum_quantity) AS is_low_stock, '
+            'SUM(i.quantity) OVER () AS total_quantity, '
+            'SUM(i.minimum_quantity > 0 AND i.quantity <= i.minimum_quantity) OVER () AS low_stock_count, '
+            'COUNT(*) OVER () AS item_count '
+            'FROM inventory_items i'
         )
-        if search_query:
+        fts_query = _inventory_fts_query(search_query)
+        if fts_query:
+            query += (
+                ' JOIN inventory_fts ON inventory_fts.rowid = i.id'
+                ' WHERE inventory_fts MATCH ?'
+            )
+            params.append(fts_query)
+        elif search_query:
+            # Parole troppo corte per l'indice: scansione completa con LIKE.
             like = f'%{search_query}%'
             query += (
-                ' WHERE code LIKE ? OR name LIKE ? OR '
-                'IFNULL(description, "") LIKE ? OR IFNULL(location, "") LIKE ? OR '
-                'IFNULL(category, "") LIKE ? OR IFNULL(notes, "") LIKE ?'
+                ' WHERE i.code LIKE ? OR i.name LIKE ? OR '
+                'IFNULL(i.description, "") LIKE ? OR IFNULL(i.location, "") LIKE ? OR '
+                'IFNULL(i.category, "") LIKE ? OR IFNULL(i.notes, "") LIKE ?'
             )
             params.extend([like, like, like, like, like, like])
-        query += ' ORDER BY LOWER(name), LOWER(code)'
+        # Le funzioni finestra sono calcolate prima di LIMIT/OFFSET: i totali
+        # riguardano tutti gli articoli filtrati, non solo la pagina mostrata.
+        page_size = max(_coerce_int(app.config.get('INVENTORY_PAGE_SIZE'), 100), 1)
+        page = max(request.args.get('page', 1, type=int) or 1, 1)
+        query += ' ORDER BY LOWER(i.name), LOWER(i.code), i.id LIMIT ? OFFSET ?'
+        params.extend([page_size, (page - 1) * page_size])
 
         items = db.execute(query, params).fetchall()
-        total_quantity = sum((row['quantity'] or 0) for row in items)
-        low_stock_ids = {
-            row['id']
-            for row in items
-            if row['minimum_quantity'] and row['quantity'] <= row['minimum_quantity']
-        }
+        if not items and page > 1:
+            return redirect(url_for('magazzino', q=search_query or None))
+        total_quantity = items[0]['total_quantity'] if items else 0
+        low_stock_count = items[0]['low_stock_count'] if items else 0
+        item_count = items[0]['item_count'] if items else 0
 
         return render_template(
             'magazzino.html',
             items=items,
             search_query=search_query,
             edit_item=edit_item,
-            low_stock_ids=low_stock_ids,
+            low_stock_count=low_stock_count,
             total_quantity=total_quantity,
+            item_count=item_count,
+            page=page,
+            page_count=max((item_count + page_size - 1) // page_size, 1),
         )
 
     @app.route('/admin/users')
@@ -841,7 +1245,11 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
         elif user['role'] == 'admin':
             flash(f"L'utente \"{user['username']}\" è già un amministratore.", 'info')
         else:
-            db.execute("UPDATE users SET role = 'admin' WHERE id = ?", (user_id,))
+            # Il cambio di ruolo chiude anche le sessioni aperte dell'utente.
+            db.execute(
+                "UPDATE users SET role = 'admin', token_version = token_version + 1 WHERE id = ?",
+                (user_id,),
+            )
             db.commit()
             flash(
                 f"L'utente \"{user['username']}\" è stato promosso ad amministratore.",
@@ -850,6 +1258,23 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
 
         return redirect(url_for('admin_users'))
 
+    @app.route('/admin/users/<int:user_id>/revoke-sessions', methods=['POST'])
+    @admin_required
+    def revoke_user_sessions(user_id: int):
+        db = get_db()
+        # Con la nuova versione nessuna sessione già emessa viene più accettata.
+        user = db.execute(
+            'UPDATE users SET token_version = token_version + 1 WHERE id = ? RETURNING username',
+            (user_id,),
+        ).fetchone()
+        db.commit()
+
+        if user is None:
+            flash('Utente non trovato.', 'error')
+        else:
+            flash(f"Sessioni dell'utente \"{user['username']}\" revocate.", 'success')
+        return redirect(url_for('admin_users'))
+
     # Lista clienti
     @app.route('/customers')
     @login_required
@@ -944,40 +1369,51 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
     def tickets():
         db = get_db()
         selected_status = request.args.get('status', '').strip()
-        query = (
-            'SELECT t.*, c.name AS customer_name, '
-            'creator.username AS created_by_username, '
-            'modifier.username AS last_modified_by_username '
-            'FROM tickets t '
-            'JOIN customers c ON t.customer_id = c.id '
-            'LEFT JOIN users creator ON t.created_by = creator.id '
-            'LEFT JOIN users modifier ON t.last_modified_by = modifier.id '
-        )
-        params = ()
-        if selected_status:
-            if selected_status in TICKET_STATUS_VALUES:
-                query += 'WHERE t.status = ? '
-                params = (selected_status,)
+        if selected_status and selected_status not in TICKET_STATUS_VALUES:
+            selected_status = None
+        current_filters = {'status': selected_status} if selected_status else {}
+
+        page_size = max(_coerce_int(app.config.get('TICKETS_PAGE_SIZE'), 50), 1)
+        page = max(request.args.get('page', 1, type=int) or 1, 1)
+
+        # La tabella renderizzata resta valida finché ticket, storico e clienti
+        # non cambiano: le versioni sono mantenute dai trigger di table_versions.
+        # Si conservano solo le prime pagine, le più consultate.
+        versions = (_table_version(db, 'tickets'), _table_version(db, 'customers'))
+        cache_key = (selected_status or None, bool(getattr(current_user, 'is_admin', False)), page)
+        table_cache = app.extensions['tickets_table_cache']
+        cached = table_cache.get(cache_key)
+        if cached is not None and None not in versions and cached[0] == versions:
+            _, tickets_table, ticket_count = cached
+        else:
+            page_params = (page_size, (page - 1) * page_size)
+            if selected_status:
+                tickets = db.execute(SQL_TICKETS_BY_STATUS, (selected_status, *page_params)).fetchall()
+                ticket_count = db.execute(SQL_TICKETS_COUNT_BY_STATUS, (selected_status,)).fetchone()[0]
             else:
-                selected_status = None
-        query += 'ORDER BY t.created_at DESC'
-        tickets = db.execute(query, params).fetchall()
-
-        latest_history_entries = _fetch_latest_ticket_history_entries(
-            db,
-            (ticket['id'] for ticket in tickets),
-            ('status',),
-        )
+                tickets = db.execute(SQL_TICKETS_ALL, page_params).fetchall()
+                ticket_count = db.execute(SQL_TICKETS_COUNT_ALL).fetchone()[0]
+            if not tickets and page > 1:
+                return redirect(url_for('tickets', **current_filters))
+            tickets_table = Markup(
+                render_template(
+                    '_tickets_table.html',
+                    tickets=tickets,
+                    ticket_status_labels=TICKET_STATUS_LABELS,
+                    current_filters=current_filters,
+                )
+            )
+            if page <= _TICKETS_CACHED_PAGES:
+                table_cache[cache_key] = (versions, tickets_table, ticket_count)
 
-        current_filters = {'status': selected_status} if selected_status else {}
         return render_template(
             'tickets.html',
-            tickets=tickets,
+            tickets_table=tickets_table,
             statuses=TICKET_STATUSES,
-            ticket_status_labels=TICKET_STATUS_LABELS,
             selected_status=selected_status,
             current_filters=current_filters,
-            latest_history_entries=latest_history_entries,
+            page=page,
+            page_count=max((ticket_count + page_size - 1) // page_size, 1),
         )
 
     @app.route('/tickets/<int:ticket_id>/delete', methods=['POST'])
@@ -992,15 +1428,12 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             else:
                 flash('Ticket eliminato con successo.', 'success')
 
-        allowed_filters = {'status'}
         filters = {
             key[len('filter_'):]: value
             for key, value in request.form.items()
-            if key.startswith('filter_') and value
+            if value and key.startswith('filter_') and key[len('filter_'):] in TICKETS_FILTER_KEYS
         }
-        filters = {key: value for key, value in filters.items() if key in allowed_filters}
-        redirect_url = url_for('tickets', **filters) if filters else url_for('tickets')
-        return redirect(redirect_url)
+        return redirect(url_for('tickets', **filters))
 
     # Inserimento nuovo ticket
     @app.route('/tickets/new', methods=['GET', 'POST'])
@@ -1078,7 +1511,7 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
                 flash(success_message, 'success')
                 return redirect(url_for('tickets'))
         # Per GET (o se form incompleto), recupera elenco clienti per la select
-        customers = db.execute('SELECT id, name, code FROM customers ORDER BY name').fetchall()
+        customers = _customer_choices(db)
         return render_template(
             'add_ticket.html',
             customers=customers,
@@ -1147,88 +1580,57 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             date_repaired = request.form.get('date_repaired') or None
             date_returned = request.form.get('date_returned') or None
 
-            tracked_fields = (
-                'status',
-                'product',
-                'issue_description',
-                'payment_info',
-                'repair_status',
-                'date_received',
-                'date_repaired',
-                'date_returned',
-            )
-            new_values = {
-                'status': new_status,
-                'product': product,
-                'issue_description': issue_description,
-                'payment_info': payment_info,
-                'repair_status': repair_status,
-                'date_received': date_received,
-                'date_repaired': date_repaired,
-                'date_returned': date_returned,
-            }
-            has_changes = any(
-                (ticket[field] or '') != (new_values[field] or '') for field in tracked_fields
+            new_values = dict(
+                zip(
+                    TICKET_TRACKED_FIELDS,
+                    (
+                        new_status,
+                        product,
+                        issue_description,
+                        payment_info,
+                        repair_status,
+                        date_received,
+                        date_repaired,
+                        date_returned,
+                    ),
+                )
             )
-            if not has_changes:
+            # Ogni campo della riga è letto una sola volta: la coppia (vecchio,
+            # nuovo) serve sia al confronto sia allo storico.
+            changed = {}
+            for field, value in new_values.items():
+                old_value = ticket[field]
+                if (old_value or '') != (value or ''):
+                    changed[field] = (old_value, value)
+            if not changed:
                 flash('Nessuna modifica rilevata.', 'info')
                 return redirect(url_for('ticket_detail', ticket_id=ticket_id))
 
             db.execute(
-                'UPDATE tickets SET '
-                'status = ?, product = ?, issue_description = ?, payment_info = ?, repair_status = ?, '
-                'date_received = ?, date_repaired = ?, date_returned = ?, '
-                'last_modified_by = ?, updated_at = CURRENT_TIMESTAMP '
-                'WHERE id = ?',
-                (
-                    new_status,
-                    product,
-                    issue_description,
-                    payment_info,
-                    repair_status,
-                    date_received,
-                    date_repaired,
-                    date_returned,
-                    current_user_id,
-                    ticket_id,
-                ),
+                _ticket_update_sql(tuple(changed)),
+                (*(value for _, value in changed.values()), current_user_id, ticket_id),
             )
 
-            def _format_value(key: str, value):
-                if value is None:
-                    return None
-                if key == 'status':
-                    return TICKET_STATUS_LABELS.get(value, value)
-                if key == 'repair_status':
-                    return REPAIR_STATUS_LABELS.get(value, value)
-                return str(value)
-
-            for field in tracked_fields:
-                old_raw = ticket[field]
-                new_raw = new_values[field]
-                if (old_raw or '') == (new_raw or ''):
-                    continue
-
-                db.execute(
-                    'INSERT INTO ticket_history (ticket_id, field, old_value, new_value, changed_by) '
-                    'VALUES (?, ?, ?, ?, ?)',
-                    (
-                        ticket_id,
-                        field,
-                        _format_value(field, old_raw),
-                        _format_value(field, new_raw),
-                        current_user_id,
-                    ),
+            history_rows = [
+                (
+                    ticket_id,
+                    field,
+                    _format_history_value(field, old_value),
+                    _format_history_value(field, value),
+                    current_user_id,
                 )
+                for field, (old_value, value) in changed.items()
+            ]
+            db.executemany(
+                'INSERT INTO ticket_history (ticket_id, field, old_value, new_value, changed_by) '
+                'VALUES (?, ?, ?, ?, ?)',
+                history_rows,
+            )
             db.commit()
             flash('Ticket aggiornato con successo.', 'success')
             return redirect(url_for('ticket_detail', ticket_id=ticket_id))
 
-        latest_history_entries = _fetch_latest_ticket_history_entries(
-            db,
-            (ticket_id,),
-            ('status', 'repair_status'),
-        )
+        latest_changes = db.execute(SQL_TICKET_LATEST_CHANGES, (ticket_id,)).fetchone()
 
         attachments = db.execute(
             'SELECT a.id, a.original_filename, a.stored_filename, a.content_type, a.file_size, '
@@ -1246,9 +1648,10 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             'FROM ticket_history h '
             'LEFT JOIN users u ON h.changed_by = u.id '
             'WHERE h.ticket_id = ? '
-            'ORDER BY h.changed_at DESC, h.id DESC',
-            (ticket_id,),
-        ).fetchall()
+            'ORDER BY h.changed_at DESC, h.id DESC '
+            'LIMIT ?',
+            (ticket_id, TICKET_HISTORY_DISPLAY_LIMIT),
+        )
         return render_template(
             'ticket_detail.html',
             ticket=ticket,
@@ -1259,8 +1662,7 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             history_entries=history_entries,
             attachments=attachments,
             ticket_history_field_labels=TICKET_HISTORY_FIELD_LABELS,
-            last_status_change=latest_history_entries.get('status', {}).get(ticket_id),
-            last_repair_status_change=latest_history_entries.get('repair_status', {}).get(ticket_id),
+            latest_changes=latest_changes,
         )
 
     @app.route('/tickets/<int:ticket_id>/attachments/<int:attachment_id>/download')
@@ -1276,196 +1678,425 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             flash('Allegato non trovato.', 'error')
             return redirect(url_for('ticket_detail', ticket_id=ticket_id))
 
-        file_path = Path(app.config['UPLOAD_FOLDER']) / str(ticket_id) / attachment['stored_filename']
-        if not file_path.exists():
-            flash('File allegato non trovato sul server.', 'error')
-            return redirect(url_for('ticket_detail', ticket_id=ticket_id))
-
-        return send_file(
-            file_path,
+        # Risposta condizionale (ETag/Last-Modified e Range); con USE_X_SENDFILE
+        # il trasferimento dei byte viene delegato al server web frontale.
+        stored_filename = attachment['stored_filename']
+        send_kwargs = dict(
             as_attachment=True,
             download_name=attachment['original_filename'],
             mimetype=attachment['content_type'] or 'application/octet-stream',
+            conditional=True,
+        )
+        directory = Path(app.config['UPLOAD_FOLDER']) / str(ticket_id)
+        accel_prefix = app.config.get('ATTACHMENT_X_ACCEL_PREFIX')
+        try:
+            if not accel_prefix:
+                return send_from_directory(directory, stored_filename, **send_kwargs)
+            # Nginx: la risposta porta solo le intestazioni e X-Accel-Redirect
+            # indica la location interna da cui il proxy legge il file.
+            response = _send_from_directory_raw(
+                directory,
+                stored_filename,
+                request.environ,
+                use_x_sendfile=True,
+                response_class=app.response_class,
+                **send_kwargs,
+            )
+        except NotFound:
+            flash('File allegato non trovato sul server.', 'error')
+            return redirect(url_for('ticket_detail', ticket_id=ticket_id))
+        if response.headers.pop('X-Sendfile', None) is not None:
+            response.headers['X-Accel-Redirect'] = (
+                f"{accel_prefix.rstrip('/')}/{ticket_id}/{stored_filename}"
+            )
+        return response
+
+    def _ai_request_timeout() -> Tuple[int, int]:
+        # Timeout separati: un provider irraggiungibile libera subito il worker,
+        # mentre la generazione della risposta può richiedere più tempo.
+        read_timeout = app.config.get('AI_SUGGESTION_TIMEOUT', 15)
+        return (
+            min(app.config.get('AI_SUGGESTION_CONNECT_TIMEOUT') or read_timeout, read_timeout),
+            read_timeout,
         )
 
-    @app.route('/ai/suggest', methods=['POST'])
-    @login_required
-    def ai_suggest():
-        if not request.is_json:
-            return jsonify({'error': 'Richiesta non valida.'}), 400
+    def _ai_wait_timeout() -> float:
+        """Attesa massima del risultato di una richiesta identica già in corso.
 
-        payload = request.get_json(silent=True) or {}
-        target = (payload.get('target') or '').strip()
-        if target != 'issue_description':
-            return jsonify({'error': 'Campo non supportato.'}), 400
+        Il leader può ripetere la chiamata fino a ``retry.total`` volte, ognuna
+        con i propri timeout di connessione e lettura, più il backoff massimo
+        fra un tentativo e l'altro.
+        """
 
-        subject = (payload.get('subject') or '').strip()
-        product = (payload.get('product') or '').strip()
-        issue_description = (payload.get('issue_description') or '').strip()
-        description = (payload.get('description') or '').strip()
+        retry = app.extensions['ai_http'].get_adapter('https://').max_retries
+        attempts = int(retry.total or 0) + 1
+        backoff_max = getattr(retry, 'backoff_max', Retry.DEFAULT_BACKOFF_MAX)
+        backoff = sum(
+            min(retry.backoff_factor * 2 ** (attempt - 1), backoff_max)
+            for attempt in range(1, attempts)
+        )
+        return attempts * sum(_ai_request_timeout()) + backoff
+
+    def _chat_provider_target(spec: ChatProviderSpec) -> Tuple[str, str]:
+        """Restituisce endpoint e modello configurati per il provider."""
+
+        endpoint = (app.config.get(spec.endpoint_key) if spec.endpoint_key else None) or spec.default_endpoint
+        return endpoint, app.config.get(spec.model_key) or spec.default_model
+
+    def _build_chat_completion_request(
+        provider: str,
+        fields: Tuple[str, str, str, str],
+        *,
+        stream: bool = False,
+    ) -> Tuple[str, dict, dict]:
+        """Prepara endpoint, header e payload per i provider in ``CHAT_PROVIDERS``."""
+
+        spec = CHAT_PROVIDERS[provider]
+        api_key = app.config.get('AI_SUGGESTION_TOKEN') or os.environ.get(spec.api_key_env)
+        if not api_key:
+            raise AISuggestionError(f'API key {spec.display_name} non configurata.', 503)
+        endpoint, model = _chat_provider_target(spec)
+
+        system_prompt, user_prompt = _build_ai_prompts(
+            app.config.get('AI_SUGGESTION_SYSTEM_PROMPT'),
+            *fields,
+        )
 
-        if not any([subject, product, issue_description, description]):
-            return jsonify({'error': 'Fornire almeno un dettaglio per generare un suggerimento.'}), 400
+        payload = {
+            'model': model,
+            'messages': [
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': user_prompt},
+            ],
+            'temperature': 0.2,
+        }
+        if stream:
+            payload['stream'] = True
 
-        provider = (app.config.get('AI_SUGGESTION_PROVIDER') or 'generic').lower()
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}',
+        }
+        return endpoint, headers, payload
+
+    def _post_ai_request(endpoint: str, *, stream: bool = False, **kwargs) -> requests.Response:
+        """Invia la richiesta al provider traducendo gli errori di rete.
 
-        if provider == 'openai':
-            api_key = (
-                app.config.get('AI_SUGGESTION_TOKEN')
-                or os.environ.get('OPENAI_API_KEY')
+        La connessione al database della richiesta (presa ad esempio per
+        caricare l'utente o leggere la cache) torna al pool prima della chiamata
+        di rete, così non resta occupata per tutta l'attesa del provider;
+        ``get_db()`` ne prende un'altra se serve dopo la risposta.
+        """
+
+        close_db()
+        try:
+            response = app.extensions['ai_http'].post(
+                endpoint,
+                timeout=_ai_request_timeout(),
+                stream=stream,
+                **kwargs,
             )
-            if not api_key:
-                return jsonify({'error': 'API key OpenAI non configurata.'}), 503
-
-            system_prompt, user_prompt = _build_ai_prompts(
-                app.config.get('AI_SUGGESTION_SYSTEM_PROMPT'),
-                subject,
-                product,
-                issue_description,
-                description,
+            response.raise_for_status()
+        except requests.exceptions.Timeout:
+            raise AISuggestionError('Il servizio AI non ha risposto in tempo.', 504)
+        except requests.exceptions.RequestException:
+            raise AISuggestionError('Errore nella comunicazione con il servizio AI.', 502)
+        return response
+
+    def _decode_ai_response(response: requests.Response) -> Dict[str, Any]:
+        """Decodifica il corpo JSON della risposta del provider."""
+
+        try:
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            raise AISuggestionError('Risposta non valida dal servizio AI.', 502)
+
+    def _request_chat_suggestion(provider: str, fields: Tuple[str, str, str, str]) -> str:
+        """Interroga un provider compatibile con le chat completions."""
+
+        endpoint, headers, payload = _build_chat_completion_request(provider, fields)
+        data = _decode_ai_response(_post_ai_request(endpoint, json=payload, headers=headers))
+
+        if data.get('error'):
+            message = data['error'].get('message') if isinstance(data['error'], dict) else str(data['error'])
+            raise AISuggestionError(
+                message or f'Errore dal servizio {CHAT_PROVIDERS[provider].display_name}.', 502
             )
 
-            payload = {
-                'model': app.config.get('AI_SUGGESTION_OPENAI_MODEL', 'gpt-3.5-turbo'),
-                'messages': [
-                    {'role': 'system', 'content': system_prompt},
-                    {'role': 'user', 'content': user_prompt},
-                ],
-                'temperature': 0.2,
-            }
+        choices = data.get('choices') or []
+        if not choices:
+            return ''
+        return choices[0].get('message', {}).get('content') or ''
+
+    def _request_generic_suggestion(target: str, fields: Tuple[str, str, str, str]) -> str:
+        """Interroga l'endpoint generico configurato in ``AI_SUGGESTION_ENDPOINT``."""
+
+        endpoint = app.config.get('AI_SUGGESTION_ENDPOINT')
+        if not endpoint:
+            raise AISuggestionError('Servizio AI non configurato.', 503)
+
+        headers = {'Content-Type': 'application/json'}
+        token = app.config.get('AI_SUGGESTION_TOKEN')
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+
+        subject, product, issue_description, description = fields
+        external_payload = {
+            'target': target,
+            'subject': subject,
+            'product': product,
+            'issue_description': issue_description,
+            'description': description,
+            'requested_by': getattr(current_user, 'username', None),
+        }
 
-            try:
-                response = requests.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    json=payload,
-                    headers={
-                        'Content-Type': 'application/json',
-                        'Authorization': f'Bearer {api_key}',
-                    },
-                    timeout=app.config.get('AI_SUGGESTION_TIMEOUT', 15),
-                )
-                response.raise_for_status()
-            except requests.exceptions.Timeout:
-                return jsonify({'error': 'Il servizio AI non ha risposto in tempo.'}), 504
-            except requests.exceptions.RequestException:
-                return jsonify({'error': 'Errore nella comunicazione con il servizio AI.'}), 502
+        data = _decode_ai_response(_post_ai_request(endpoint, json=external_payload, headers=headers))
+        return data.get('suggestion') or data.get('content') or ''
 
-            try:
-                data = response.json()
-            except ValueError:
-                return jsonify({'error': 'Risposta non valida dal servizio AI.'}), 502
+    def _request_ai_suggestion(
+        target: str,
+        subject: str,
+        product: str,
+        issue_description: str,
+        description: str,
+    ) -> str:
+        """Interroga il provider AI configurato e restituisce il suggerimento.
 
-            if data.get('error'):
-                message = data['error'].get('message') if isinstance(data['error'], dict) else str(data['error'])
-                return jsonify({'error': message or 'Errore dal servizio OpenAI.'}), 502
+        Solleva ``AISuggestionError`` con il codice HTTP da restituire al
+        client quando il servizio non è configurato o risponde con un errore.
+        """
 
-            choices = data.get('choices') or []
-            if not choices:
-                return jsonify({'error': 'Nessun suggerimento disponibile dal servizio AI.'}), 502
+        provider = (app.config.get('AI_SUGGESTION_PROVIDER') or 'generic').lower()
+        fields = (subject, product, issue_description, description)
+        if provider in CHAT_PROVIDERS:
+            suggestion = _request_chat_suggestion(provider, fields)
+        else:
+            suggestion = _request_generic_suggestion(target, fields)
 
-            suggestion = (choices[0].get('message', {}).get('content') or '').strip()
-        elif provider == 'deepseek':
-            api_key = (
-                app.config.get('AI_SUGGESTION_TOKEN')
-                or os.environ.get('DEEPSEEK_API_KEY')
-            )
-            if not api_key:
-                return jsonify({'error': 'API key DeepSeek non configurata.'}), 503
-
-            system_prompt, user_prompt = _build_ai_prompts(
-                app.config.get('AI_SUGGESTION_SYSTEM_PROMPT'),
-                subject,
-                product,
-                issue_description,
-                description,
-            )
+        suggestion = suggestion.strip()
+        if not suggestion:
+            raise AISuggestionError('Nessun suggerimento disponibile dal servizio AI.', 502)
 
-            payload = {
-                'model': app.config.get('AI_SUGGESTION_DEEPSEEK_MODEL', 'deepseek-chat'),
-                'messages': [
-                    {'role': 'system', 'content': system_prompt},
-                    {'role': 'user', 'content': user_prompt},
-                ],
-                'temperature': 0.2,
-            }
+        return suggestion
+
+    def _ai_fields_error(fields: Tuple[str, str, str, str]) -> Optional[str]:
+        """Verifica che ci siano abbastanza dettagli per interrogare il provider.
+
+        Le richieste quasi vuote ricevono subito un errore, senza chiamata di
+        rete verso il servizio AI.
+        """
 
-            endpoint = (
-                app.config.get('AI_SUGGESTION_DEEPSEEK_ENDPOINT')
-                or 'https://api.deepseek.com/v1/chat/completions'
+        if not any(fields):
+            return 'Fornire almeno un dettaglio per generare un suggerimento.'
+        min_length = _coerce_int(app.config.get('AI_SUGGESTION_MIN_INPUT_LENGTH'), 0)
+        if sum(len(field) for field in fields) < min_length:
+            return 'Fornire più dettagli prima di richiedere un suggerimento.'
+        return None
+
+    def _ai_cache_key(provider: str, target: str, fields: Tuple[str, str, str, str]) -> str:
+        if provider in CHAT_PROVIDERS:
+            model = '#'.join(_chat_provider_target(CHAT_PROVIDERS[provider]))
+        else:
+            model = app.config.get('AI_SUGGESTION_ENDPOINT')
+        return SuggestionCache.build_key(
+            provider,
+            model,
+            _resolve_ai_system_prompt(app.config.get('AI_SUGGESTION_SYSTEM_PROMPT')),
+            target,
+            *fields,
+        )
+
+    def _cached_ai_suggestion(
+        target: str,
+        fields: Tuple[str, str, str, str],
+        *,
+        bypass_cache: bool = False,
+    ) -> Tuple[str, bool]:
+        """Restituisce il suggerimento e se proviene dalla cache locale."""
+
+        provider = (app.config.get('AI_SUGGESTION_PROVIDER') or 'generic').lower()
+        cache = app.extensions['ai_cache']
+        key = _ai_cache_key(provider, target, fields)
+        if not bypass_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached, True
+
+        # Richieste identiche concorrenti condividono un'unica chiamata al provider.
+        try:
+            suggestion, shared = app.extensions['ai_inflight'].run(
+                key,
+                lambda: _request_ai_suggestion(target, *fields),
+                timeout=_ai_wait_timeout(),
             )
+        except AIProviderBusyError:
+            raise AISuggestionError('Troppe richieste al servizio AI in corso, riprova tra poco.', 429)
+        if not shared:
+            cache.set(key, suggestion)
+        return suggestion, False
+
+    def _stream_ai_suggestion(
+        provider: str,
+        target: str,
+        fields: Tuple[str, str, str, str],
+    ) -> Response:
+        """Inoltra al browser come Server-Sent Events la risposta in streaming.
+
+        Come le risposte JSON, l'inoltro occupa uno slot del provider fino alla
+        fine dello stream; le richieste identiche che arrivano nel frattempo
+        attendono il leader e ricevono il suggerimento completo in JSON.
+        """
+
+        endpoint, headers, payload = _build_chat_completion_request(provider, fields, stream=True)
+        cache_key = _ai_cache_key(provider, target, fields)
+        inflight = app.extensions['ai_inflight']
+        wait_timeout = _ai_wait_timeout()
+        try:
+            future, leader = inflight.start(cache_key, timeout=wait_timeout)
+            if not leader:
+                suggestion = inflight.wait(future, timeout=wait_timeout)
+                return jsonify({'suggestion': suggestion, 'from_cache': False})
+        except AIProviderBusyError:
+            raise AISuggestionError('Troppe richieste al servizio AI in corso, riprova tra poco.', 429)
 
-            try:
-                response = requests.post(
-                    endpoint,
-                    json=payload,
-                    headers={
-                        'Content-Type': 'application/json',
-                        'Authorization': f'Bearer {api_key}',
-                    },
-                    timeout=app.config.get('AI_SUGGESTION_TIMEOUT', 15),
-                )
-                response.raise_for_status()
-            except requests.exceptions.Timeout:
-                return jsonify({'error': 'Il servizio AI non ha risposto in tempo.'}), 504
-            except requests.exceptions.RequestException:
-                return jsonify({'error': 'Errore nella comunicazione con il servizio AI.'}), 502
+        try:
+            response = _post_ai_request(endpoint, json=payload, headers=headers, stream=True)
+        except BaseException as exc:
+            inflight.finish(cache_key, future, error=exc)
+            raise
+
+        released = False
+
+        def _release(
+            suggestion: Optional[str] = None,
+            message: str = 'Errore nella comunicazione con il servizio AI.',
+        ) -> None:
+            # Chiamata sia alla fine dello stream sia alla chiusura della
+            # risposta, nel caso in cui il generatore non sia mai partito.
+            nonlocal released
+            if released:
+                return
+            released = True
+            if suggestion:
+                inflight.finish(cache_key, future, suggestion)
+            else:
+                inflight.finish(cache_key, future, error=AISuggestionError(message, 502))
 
+        def _events():
+            pieces: List[str] = []
+            suggestion = None
+            message = 'Errore nella comunicazione con il servizio AI.'
             try:
-                data = response.json()
-            except ValueError:
-                return jsonify({'error': 'Risposta non valida dal servizio AI.'}), 502
+                try:
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith('data:'):
+                            continue
+                        data = line[len('data:'):].strip()
+                        if data == '[DONE]':
+                            break
+                        try:
+                            chunk = orjson.loads(data)
+                        except orjson.JSONDecodeError:
+                            continue
+                        choices = chunk.get('choices') or []
+                        piece = (choices[0].get('delta') or {}).get('content') if choices else None
+                        if piece:
+                            pieces.append(piece)
+                            yield f"data: {json.dumps({'delta': piece})}\n\n"
+                except requests.exceptions.RequestException:
+                    yield f"event: error\ndata: {json.dumps({'error': message})}\n\n"
+                    return
+                finally:
+                    response.close()
+
+                suggestion = ''.join(pieces).strip()
+                if not suggestion:
+                    message = 'Nessun suggerimento disponibile dal servizio AI.'
+                    yield f"event: error\ndata: {json.dumps({'error': message})}\n\n"
+                    return
+                app.extensions['ai_cache'].set(cache_key, suggestion)
+            finally:
+                _release(suggestion, message)
+            yield f"event: done\ndata: {json.dumps({'suggestion': suggestion})}\n\n"
+
+        sse_response = Response(
+            stream_with_context(_events()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+        sse_response.call_on_close(_release)
+        return sse_response
 
-            if data.get('error'):
-                message = data['error'].get('message') if isinstance(data['error'], dict) else str(data['error'])
-                return jsonify({'error': message or 'Errore dal servizio DeepSeek.'}), 502
+    @app.route('/ai/suggest', methods=['POST'])
+    @login_required
+    def ai_suggest():
+        if not request.is_json:
+            return jsonify({'error': 'Richiesta non valida.'}), 400
 
-            choices = data.get('choices') or []
-            if not choices:
-                return jsonify({'error': 'Nessun suggerimento disponibile dal servizio AI.'}), 502
+        payload = request.get_json(silent=True) or {}
+        target = (payload.get('target') or '').strip()
+        if target != 'issue_description':
+            return jsonify({'error': 'Campo non supportato.'}), 400
 
-            suggestion = (choices[0].get('message', {}).get('content') or '').strip()
-        else:
-            endpoint = app.config.get('AI_SUGGESTION_ENDPOINT')
-            if not endpoint:
-                return jsonify({'error': 'Servizio AI non configurato.'}), 503
-
-            headers = {'Content-Type': 'application/json'}
-            token = app.config.get('AI_SUGGESTION_TOKEN')
-            if token:
-                headers['Authorization'] = f'Bearer {token}'
-
-            external_payload = {
-                'target': target,
-                'subject': subject,
-                'product': product,
-                'issue_description': issue_description,
-                'description': description,
-                'requested_by': getattr(current_user, 'username', None),
-            }
+        bypass_cache = request.args.get('no_cache') == '1'
+
+        batch = payload.get('batch')
+        if batch is not None:
+            if not isinstance(batch, list) or not batch:
+                return jsonify({'error': 'Il campo batch deve essere un elenco non vuoto.'}), 400
+            batch_limit = max(_coerce_int(app.config.get('AI_SUGGESTION_BATCH_LIMIT'), 20), 1)
+            if len(batch) > batch_limit:
+                return jsonify(
+                    {'error': f'È possibile richiedere al massimo {batch_limit} suggerimenti per volta.'}
+                ), 400
+
+            # Le richieste condividono la sessione HTTP (e quindi la connessione
+            # già aperta verso il provider) e il prompt di sistema.
+            results = []
+            for index, item in enumerate(batch):
+                fields = _extract_ai_fields(item if isinstance(item, dict) else {})
+                fields_error = _ai_fields_error(fields)
+                if fields_error:
+                    results.append({'index': index, 'error': fields_error})
+                    continue
+                try:
+                    suggestion, from_cache = _cached_ai_suggestion(
+                        target, fields, bypass_cache=bypass_cache
+                    )
+                except AISuggestionError as exc:
+                    if exc.status_code == 503:
+                        return jsonify({'error': exc.message}), exc.status_code
+                    results.append({'index': index, 'error': exc.message})
+                else:
+                    results.append({'index': index, 'text': suggestion, 'from_cache': from_cache})
+            return jsonify({'results': results})
 
-            try:
-                response = requests.post(
-                    endpoint,
-                    json=external_payload,
-                    headers=headers,
-                    timeout=app.config.get('AI_SUGGESTION_TIMEOUT', 15),
-                )
-                response.raise_for_status()
-            except requests.exceptions.Timeout:
-                return jsonify({'error': 'Il servizio AI non ha risposto in tempo.'}), 504
-            except requests.exceptions.RequestException:
-                return jsonify({'error': 'Errore nella comunicazione con il servizio AI.'}), 502
+        fields = _extract_ai_fields(payload)
+        fields_error = _ai_fields_error(fields)
+        if fields_error:
+            return jsonify({'error': fields_error}), 400
 
-            try:
-                data = response.json()
-            except ValueError:
-                return jsonify({'error': 'Risposta non valida dal servizio AI.'}), 502
+        # Streaming SSE solo per i provider che lo supportano e se non c'è
+        # già una risposta in cache: negli altri casi si risponde in JSON.
+        provider = (app.config.get('AI_SUGGESTION_PROVIDER') or 'generic').lower()
+        wants_stream = 'text/event-stream' in request.headers.get('Accept', '')
+        if wants_stream and provider in CHAT_PROVIDERS:
+            cached = None if bypass_cache else app.extensions['ai_cache'].get(
+                _ai_cache_key(provider, target, fields)
+            )
+            if cached is None:
+                try:
+                    return _stream_ai_suggestion(provider, target, fields)
+                except AISuggestionError as exc:
+                    return jsonify({'error': exc.message}), exc.status_code
+            return jsonify({'suggestion': cached, 'from_cache': True})
 
-            suggestion = (data.get('suggestion') or data.get('content') or '').strip()
-        if not suggestion:
-            return jsonify({'error': 'Nessun suggerimento disponibile dal servizio AI.'}), 502
+        try:
+            suggestion, from_cache = _cached_ai_suggestion(target, fields, bypass_cache=bypass_cache)
+        except AISuggestionError as exc:
+            return jsonify({'error': exc.message}), exc.status_code
 
-        return jsonify({'suggestion': suggestion})
+        return jsonify({'suggestion': suggestion, 'from_cache': from_cache})
 
     # Lista delle riparazioni
     @app.route('/repairs')
@@ -1477,46 +2108,45 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
         from_date = request.args.get('from_date', '').strip() or None
         to_date = request.args.get('to_date', '').strip() or None
 
-        filters = ['(t.product IS NOT NULL OR t.issue_description IS NOT NULL)']
-        params = []
-
         if selected_status and selected_status not in REPAIR_STATUS_VALUES:
             selected_status = None
 
-        if selected_status:
-            filters.append('t.repair_status = ?')
-            params.append(selected_status)
-
-        date_expression = 'DATE(COALESCE(t.date_returned, t.date_repaired, t.date_received, t.updated_at))'
-
-        if from_date:
-            filters.append(f"{date_expression} >= DATE(?)")
-            params.append(from_date)
-
-        if to_date:
-            filters.append(f"{date_expression} <= DATE(?)")
-            params.append(to_date)
-
-        where_clause = ' WHERE ' + ' AND '.join(filters) if filters else ''
+        # Le date sono validate e normalizzate qui, così la query le confronta
+        # direttamente con l'espressione indicizzata senza richiamare DATE(?).
+        from_day = _parse_iso_date(from_date)
+        from_date = from_day.isoformat() if from_day else None
+        to_day = _parse_iso_date(to_date)
+        to_date = to_day.isoformat() if to_day else None
+
+        # Paginazione a cursore (keyset): il cursore è la chiave di ordinamento
+        # dell'ultima riga mostrata, nel formato "<data>_<id>".
+        cursor = request.args.get('cursor', '').strip() or None
+        cursor_value = cursor_id = None
+        if cursor:
+            cursor_value, _, cursor_id_raw = cursor.rpartition('_')
+            try:
+                cursor_id = int(cursor_id_raw)
+            except ValueError:
+                cursor = cursor_value = None
 
-        query = (
-            'SELECT t.*, c.name AS customer_name, '
-            'creator.username AS created_by_username, '
-            'modifier.username AS last_modified_by_username '
-            'FROM tickets t '
-            'JOIN customers c ON t.customer_id = c.id '
-            'LEFT JOIN users creator ON t.created_by = creator.id '
-            'LEFT JOIN users modifier ON t.last_modified_by = modifier.id '
-            f'{where_clause} '
-            'ORDER BY COALESCE(t.date_returned, t.updated_at) DESC, t.id DESC'
-        )
-        repairs = db.execute(query, params).fetchall()
+        page_size = max(_coerce_int(app.config.get('REPAIRS_PAGE_SIZE'), 50), 1)
 
-        latest_history_entries = _fetch_latest_ticket_history_entries(
-            db,
-            (repair['id'] for repair in repairs),
-            ('repair_status',),
-        )
+        repairs = db.execute(
+            SQL_REPAIRS_PAGE,
+            {
+                'status': selected_status,
+                'from_date': from_date,
+                'to_date': to_date,
+                'cursor_value': cursor_value,
+                'cursor_id': cursor_id,
+                'limit': page_size + 1,
+            },
+        ).fetchall()
+        next_cursor = None
+        if len(repairs) > page_size:
+            repairs = repairs[:page_size]
+            last = repairs[-1]
+            next_cursor = f"{last['sort_key']}_{last['id']}"
 
         current_filters = {
             'status': selected_status,
@@ -1524,14 +2154,20 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             'to_date': to_date,
         }
 
-        return render_template(
+        # La pagina viene inviata man mano che Jinja la genera. I messaggi flash
+        # vanno letti ora: durante lo streaming la sessione è già stata salvata
+        # e la loro rimozione non verrebbe più registrata nel cookie.
+        get_flashed_messages(with_categories=True)
+        return app.response_class(stream_template(
             'repairs.html',
             repairs=repairs,
             repair_status_labels=REPAIR_STATUS_LABELS,
             repair_statuses=REPAIR_STATUSES,
             current_filters=current_filters,
-            latest_history_entries=latest_history_entries,
-        )
+            page_filters={key: value for key, value in current_filters.items() if value},
+            cursor=cursor,
+            next_cursor=next_cursor,
+        ))
 
     @app.route('/repairs/<int:ticket_id>/delete', methods=['POST'])
     @admin_required
@@ -1545,24 +2181,41 @@ def create_app(test_config: Optional[Mapping[str, Any]] = None) -> Flask:
             else:
                 flash('Ticket eliminato con successo.', 'success')
 
-        allowed_filters = {'status', 'from_date', 'to_date'}
         filters = {
             key[len('filter_'):]: value
             for key, value in request.form.items()
-            if key.startswith('filter_') and value
+            if value and key.startswith('filter_') and key[len('filter_'):] in REPAIRS_FILTER_KEYS
         }
-        filters = {key: value for key, value in filters.items() if key in allowed_filters}
-        redirect_url = url_for('repairs', **filters) if filters else url_for('repairs')
-        return redirect(redirect_url)
+        return redirect(url_for('repairs', **filters))
+
+    # Pagine di errore già renderizzate per i visitatori anonimi. Il layout
+    # dipende dall'utente, dai messaggi flash e dalla rotta corrente, quindi
+    # la versione in cache si usa solo quando nessuno di questi è presente
+    # (il caso tipico delle scansioni automatiche di URL inesistenti).
+    error_page_cache: dict = {}
+
+    def _render_error_page(template_name: str, status_code: int) -> Response:
+        cacheable = (
+            not current_user.is_authenticated
+            and request.endpoint is None
+            and '_flashes' not in session
+        )
+        cache_key = (template_name, request.script_root)
+        body = error_page_cache.get(cache_key) if cacheable else None
+        if body is None:
+            body = render_template(template_name).encode('utf-8')
+            if cacheable:
+                error_page_cache[cache_key] = body
+        return Response(body, status=status_code, mimetype='text/html')
 
     # Gestione errori HTTP comuni con template dedicati.
     @app.errorhandler(404)
     def not_found(error):
-        return render_template('errors/404.html'), 404
+        return _render_error_page('errors/404.html', 404)
 
     @app.errorhandler(500)
     def internal_server_error(error):
-        return render_template('errors/500.html'), 500
+        return _render_error_page('errors/500.html', 500)
 
     return app
 
@@ -1571,9 +2224,10 @@ app = create_app()
 
 
 if __name__ == '__main__':
-    # Avvia il server di sviluppo
+    # Avvia il server integrato; debugger e reloader solo con FLASK_DEBUG=1.
     app.run(
         host='0.0.0.0',
         port=int(os.environ.get('PORT', 5000)),
-        debug=True,
+        debug=os.environ.get('FLASK_DEBUG', '0') == '1',
+        threaded=True,
     )
@@ -2,10 +2,12 @@
 
 from __future__ import annotations
 
-from functools import wraps
+import hmac
+import secrets
+from functools import lru_cache, wraps
 from typing import Optional
 
-from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for
 from flask_login import (AnonymousUserMixin, LoginManager, UserMixin,
                          current_user, login_required, login_user, logout_user)
 from werkzeug.security import check_password_hash, generate_password_hash
@@ -38,26 +40,47 @@ def _normalize_role(role: Optional[str]) -> str:
 class User(UserMixin):
     """Semplice rappresentazione dell'utente per Flask-Login."""
 
-    def __init__(self, user_id: int, username: str, role: Optional[str]) -> None:
+    def __init__(
+        self, user_id: int, username: str, role: Optional[str], token_version: int = 0
+    ) -> None:
         self.id = str(user_id)
         self.username = username
         self.role = _normalize_role(role)
+        self.token_version = token_version
+        # La versione nella sessione permette di invalidare tutte le sessioni
+        # dell'utente incrementando ``users.token_version``. L'identificativo
+        # è composto una sola volta: Flask-Login lo richiede più volte.
+        self._session_id = f'{self.id}:{token_version}'
+
+    def get_id(self) -> str:
+        return self._session_id
 
     @property
     def is_admin(self) -> bool:
         return self.role == 'admin'
 
 
+@lru_cache(maxsize=1)
+def _dummy_password_hash() -> str:
+    """Hash verificato quando l'utente non esiste.
+
+    Il login esegue così lo stesso calcolo dell'hash in entrambi i casi e il
+    tempo di risposta non rivela quali nomi utente sono registrati.
+    """
+
+    return generate_password_hash(secrets.token_urlsafe(16))
+
+
 def _row_to_user(row: Optional[dict]) -> Optional[User]:
     if row is None:
         return None
-    return User(row['id'], row['username'], row['role'])
+    return User(row['id'], row['username'], row['role'], row['token_version'])
 
 
 def get_user_by_id(user_id: str) -> Optional[User]:
     db = get_db()
     row = db.execute(
-        'SELECT id, username, role FROM users WHERE id = ?',
+        'SELECT id, username, role, token_version FROM users WHERE id = ?',
         (user_id,),
     ).fetchone()
     return _row_to_user(row)
@@ -66,24 +89,34 @@ def get_user_by_id(user_id: str) -> Optional[User]:
 def get_user_by_username(username: str) -> Optional[User]:
     db = get_db()
     row = db.execute(
-        'SELECT id, username, role FROM users WHERE username = ?',
+        'SELECT id, username, role, token_version FROM users WHERE username = ?',
         (username,),
     ).fetchone()
     return _row_to_user(row)
 
 
 @login_manager.user_loader
-def load_user(user_id: str) -> Optional[User]:
-    return get_user_by_id(user_id)
+def load_user(session_id: str) -> Optional[User]:
+    # Le sessioni create prima del versionamento non hanno ``:<versione>`` e
+    # restano valide finché le sessioni dell'utente non vengono revocate.
+    user_id, _, version = session_id.partition(':')
+    version = version or '0'
+    user = get_user_by_id(user_id)
+    if user is None or not hmac.compare_digest(str(user.token_version), version):
+        return None
+    return user
 
 
 def admin_required(view):
     """Decoratore per consentire l'accesso solo agli amministratori."""
 
+    # Il controllo di autenticazione è fatto qui invece di impilare
+    # ``login_required``: una sola funzione intermedia per ogni azione admin.
     @wraps(view)
-    @login_required
     def wrapped(*args, **kwargs):  # type: ignore[misc]
-        if not current_user.is_authenticated or not getattr(current_user, 'is_admin', False):
+        if not current_user.is_authenticated:
+            return login_manager.unauthorized()
+        if not current_user.is_admin:
             flash('Non hai i permessi necessari per completare l\'operazione.', 'error')
             return redirect(url_for('index'))
         return view(*args, **kwargs)
@@ -91,6 +124,23 @@ def admin_required(view):
     return wrapped
 
 
+def _admin_exists(db) -> bool:
+    """Indica se esiste almeno un amministratore.
+
+    Gli amministratori non vengono mai rimossi né declassati, quindi una
+    risposta positiva resta valida ed è memorizzata per il processo; finché è
+    negativa si interroga il database, dato che un altro worker può aver
+    appena registrato il primo amministratore.
+    """
+
+    if current_app.extensions.get('admin_exists'):
+        return True
+    row = db.execute("SELECT 1 FROM users WHERE LOWER(role) = 'admin' LIMIT 1").fetchone()
+    if row is not None:
+        current_app.extensions['admin_exists'] = True
+    return row is not None
+
+
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
 
@@ -105,13 +155,14 @@ def login():
         password = request.form.get('password', '')
         db = get_db()
         row = db.execute(
-            'SELECT id, username, password_hash, role FROM users WHERE username = ?',
+            'SELECT id, username, password_hash, role, token_version FROM users WHERE username = ?',
             (username,),
         ).fetchone()
 
-        if row and check_password_hash(row['password_hash'], password):
-            user = User(row['id'], row['username'], row['role'])
-            login_user(user)
+        password_hash = row['password_hash'] if row is not None else _dummy_password_hash()
+        password_ok = check_password_hash(password_hash, password)
+        if row is not None and password_ok:
+            login_user(_row_to_user(row))
             flash('Accesso effettuato correttamente.', 'success')
             next_page = request.args.get('next')
             return redirect(next_page or url_for('index'))
@@ -132,16 +183,7 @@ def logout():
 @bp.route('/register', methods=['GET', 'POST'])
 def register():
     db = get_db()
-    # verifica se esiste almeno un amministratore
-    admin_exists = bool(
-        db.execute(
-            "SELECT 1 FROM users WHERE LOWER(role) = 'admin' LIMIT 1"
-        ).fetchone()
-    )
-
-    # calcola il numero totale di utenti (utile per il template/altre logiche)
-    user_count_row = db.execute("SELECT COUNT(*) AS count FROM users").fetchone()
-    user_count = int(user_count_row['count']) if user_count_row else 0
+    admin_exists = _admin_exists(db)
 
     # la selezione del ruolo è consentita solo agli amministratori autenticati
     allow_role_selection = (
@@ -164,30 +206,28 @@ def register():
         elif not allow_role_selection or role not in {'admin', 'user'}:
             role = 'user'
 
-        existing = db.execute(
-            'SELECT 1 FROM users WHERE username = ?',
-            (username,),
-        ).fetchone()
-        if existing:
-            errors.append('Il nome utente è già in uso.')
-
         if errors:
             for error in errors:
                 flash(error, 'error')
         else:
-            password_hash = generate_password_hash(password)
-            db.execute(
-                'INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
-                (username, password_hash, role),
+            # Il vincolo UNIQUE su username sostituisce la verifica preventiva:
+            # nessuna riga inserita significa nome già in uso.
+            cursor = db.execute(
+                'INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?) '
+                'ON CONFLICT(username) DO NOTHING',
+                (username, generate_password_hash(password), role),
             )
             db.commit()
-            flash('Utente registrato con successo.', 'success')
-            return redirect(url_for('auth.login'))
+            if cursor.rowcount:
+                if role == 'admin':
+                    current_app.extensions['admin_exists'] = True
+                flash('Utente registrato con successo.', 'success')
+                return redirect(url_for('auth.login'))
+            flash('Il nome utente è già in uso.', 'error')
 
     return render_template(
         'register.html',
         allow_role_selection=allow_role_selection,
         admin_exists=admin_exists,
-        user_count=user_count,
     )
 
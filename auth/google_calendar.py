@@ -4,8 +4,9 @@ from __future__ import annotations
 
 import json
 import logging
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, Optional, Sequence
+from typing import Any, Dict, Iterable, Optional, Sequence
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -15,6 +16,14 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 LOGGER = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=4)
+def _read_token_info(token_file: str, mtime_ns: int) -> Dict[str, Any]:
+    """Legge il file del token; la data di modifica invalida la cache."""
+
+    with open(token_file, 'r', encoding='utf-8') as handle:
+        return json.load(handle)
+
+
 class GoogleCalendarOAuth:
     """Wrapper per gestire autenticazione, salvataggio e refresh dei token OAuth2."""
 
@@ -36,10 +45,15 @@ class GoogleCalendarOAuth:
         self.allow_interactive = allow_interactive
 
     def _load_credentials_from_disk(self) -> Optional[Credentials]:
-        if not self.token_file.exists():
+        try:
+            mtime_ns = self.token_file.stat().st_mtime_ns
+        except FileNotFoundError:
             return None
         try:
-            creds = Credentials.from_authorized_user_file(str(self.token_file), scopes=self.scopes)
+            # Il JSON è riletto solo quando il file cambia; le credenziali sono
+            # invece sempre un oggetto nuovo, perché il refresh le modifica.
+            info = _read_token_info(str(self.token_file), mtime_ns)
+            creds = Credentials.from_authorized_user_info(info, scopes=self.scopes)
             return creds
         except Exception as exc:  # pragma: no cover - error path
             LOGGER.warning('Impossibile caricare le credenziali OAuth salvate: %s', exc)
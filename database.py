@@ -2,67 +2,177 @@
 Utility per la gestione della connessione al database SQLite.
 
 Queste funzioni permettono di ottenere una connessione condivisa all'interno
-della richiesta Flask (usando `g`), di inizializzare lo schema e di chiudere
-automaticamente la connessione al termine della richiesta.
+della richiesta Flask (usando `g`), di inizializzare lo schema e di restituire
+automaticamente la connessione al pool al termine della richiesta.
 """
 
+import queue
 import sqlite3
+import threading
+from functools import lru_cache
 from flask import current_app, g
 from pathlib import Path
+from typing import Optional
+
+# Versione dello schema registrata in ``PRAGMA user_version``. Va incrementata
+# a ogni modifica di ``schema.sql`` o delle migrazioni in ``init_db`` affinché
+# vengano applicate anche ai database già inizializzati.
+SCHEMA_VERSION = 13
+
+_SCHEMA_PATH = Path(__file__).with_name('schema.sql')
+_INVENTORY_FTS_SCHEMA_PATH = Path(__file__).with_name('schema_inventory_fts.sql')
+
+# Il tokenizer ``trigram`` di FTS5 è disponibile da SQLite 3.34: con versioni
+# precedenti l'indice del magazzino non viene creato e la ricerca usa LIKE.
+INVENTORY_FTS_SUPPORTED = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def connect(database: str) -> sqlite3.Connection:
+    """Apre una connessione SQLite con le impostazioni usate dall'applicazione.
+
+    È usata dal pool e dai job da riga di comando, che non avviano Flask.
+    """
+    # La cache delle istruzioni compilate è per connessione: con query dalla
+    # forma costante il parsing SQL avviene una sola volta per connessione.
+    conn = sqlite3.connect(database, cached_statements=256, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # WAL consente letture concorrenti mentre è in corso una scrittura (ad
+    # esempio il caricamento di allegati); le altre impostazioni, compreso
+    # il rispetto dei vincoli ON DELETE CASCADE, valgono solo per la
+    # connessione e vengono quindi applicate alla sua apertura.
+    conn.executescript(
+        """
+        PRAGMA journal_mode=WAL;
+        PRAGMA foreign_keys=ON;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+        """
+    )
+    return conn
+
+
+class ConnectionPool:
+    """Pool di connessioni SQLite riutilizzate tra le richieste.
+
+    Ogni connessione è usata da un solo thread alla volta, ma può passare da
+    un thread all'altro tra una richiesta e la successiva: per questo viene
+    aperta con ``check_same_thread=False``. Le connessioni restituite al pool
+    mantengono pragma e cache delle istruzioni compilate.
+    """
+
+    def __init__(self, database: str, *, maxsize: int = 8) -> None:
+        self.database = database
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=maxsize)
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect(self.database)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        # Una transazione lasciata aperta da una richiesta non deve passare
+        # alla successiva.
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    db_path = current_app.config.get('DATABASE', 'database.db')
+    pool = current_app.extensions.get('db_pool')
+    if pool is None or pool.database != db_path:
+        with _POOL_LOCK:
+            pool = current_app.extensions.get('db_pool')
+            if pool is None or pool.database != db_path:
+                if pool is not None:
+                    pool.close()
+                pool = ConnectionPool(db_path)
+                current_app.extensions['db_pool'] = pool
+    return pool
 
 
 def get_db():
     """Restituisce una connessione al database, creandola se necessario.
 
-    La connessione è memorizzata nell'oggetto `g` (contesto di Flask) per
-    evitare di aprire più connessioni nella stessa richiesta. Le righe
-    risultanti verranno restituite come oggetti tipo dizionario per un
-    accesso più comodo ai campi.
+    La connessione è presa dal pool dell'applicazione e memorizzata
+    nell'oggetto `g` (contesto di Flask) per evitare di usarne più d'una nella
+    stessa richiesta. Le righe risultanti verranno restituite come oggetti
+    tipo dizionario per un accesso più comodo ai campi.
     """
     if 'db' not in g:
-        # Ottiene il percorso del database dal contesto dell'app o usa il default
-        db_path = current_app.config.get('DATABASE', 'database.db')
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        g.db = conn
+        g.db_pool = _get_pool()
+        g.db = g.db_pool.acquire()
     return g.db
 
 
 def close_db(e=None):
-    """Chiude la connessione al database se presente nel contesto g."""
+    """Restituisce al pool la connessione presente nel contesto g."""
     db = g.pop('db', None)
+    pool = g.pop('db_pool', None)
     if db is not None:
-        db.close()
+        pool.release(db)
 
 
-def init_db():
+@lru_cache(maxsize=2)
+def _read_schema(schema_path: str) -> str:
+    """Legge ``schema.sql`` una sola volta per processo."""
+
+    with open(schema_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def init_db(db: Optional[sqlite3.Connection] = None):
     """Inizializza il database eseguendo lo script SQL contenuto in `schema.sql`.
 
     Se il database non esiste, viene creato automaticamente.  Questa funzione
     può essere richiamata all'avvio dell'applicazione per assicurarsi che
-    esistano le tabelle necessarie.
+    esistano le tabelle necessarie; fuori da Flask si passa la connessione.
     """
-    db = get_db()
-    schema_path = Path(current_app.root_path) / 'schema.sql'
-    # Usa open_resource per aprire file relativi al package Flask, ma in questo
-    # caso usiamo schema_path per maggiore chiarezza.
-    with open(schema_path, 'r', encoding='utf-8') as f:
-        sql_script = f.read()
-    db.executescript(sql_script)
+    if db is None:
+        db = get_db()
+    if db.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        return
+    db.executescript(_read_schema(str(_SCHEMA_PATH)))
 
     # Migrazioni leggere per colonne aggiunte dopo il rilascio iniziale.
-    def _column_exists(table: str, column: str) -> bool:
-        rows = db.execute(f"PRAGMA table_info({table})").fetchall()
-        return any(row[1] == column for row in rows)
+    # Le colonne di ogni tabella sono lette una sola volta.
+    def _columns(table: str) -> set:
+        return {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
 
-    if not _column_exists('tickets', 'created_by'):
+    ticket_columns = _columns('tickets')
+    if 'created_by' not in ticket_columns:
         db.execute('ALTER TABLE tickets ADD COLUMN created_by INTEGER')
-    if not _column_exists('tickets', 'last_modified_by'):
+    if 'last_modified_by' not in ticket_columns:
         db.execute('ALTER TABLE tickets ADD COLUMN last_modified_by INTEGER')
-    if not _column_exists('tickets', 'payment_info'):
+    if 'payment_info' not in ticket_columns:
         db.execute('ALTER TABLE tickets ADD COLUMN payment_info TEXT')
 
-    if not _column_exists('customers', 'code'):
+    if 'token_version' not in _columns('users'):
+        db.execute('ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0')
+
+    if 'full_sync_at' not in _columns('calendar_sync_state'):
+        db.execute('ALTER TABLE calendar_sync_state ADD COLUMN full_sync_at TIMESTAMP')
+
+    if 'code' not in _columns('customers'):
         db.execute('ALTER TABLE customers ADD COLUMN code TEXT')
         db.execute(
             """
@@ -120,9 +230,12 @@ def init_db():
         'FOREIGN KEY (uploaded_by) REFERENCES users(id) ON DELETE SET NULL'
         ')'
     )
+    # L'indice composto sostituisce quello sul solo ticket_id e restituisce
+    # gli allegati già ordinati come nella pagina di dettaglio.
+    db.execute('DROP INDEX IF EXISTS idx_ticket_attachments_ticket_id')
     db.execute(
-        'CREATE INDEX IF NOT EXISTS idx_ticket_attachments_ticket_id '
-        'ON ticket_attachments(ticket_id)'
+        'CREATE INDEX IF NOT EXISTS idx_ticket_attachments_ticket_time '
+        'ON ticket_attachments(ticket_id, uploaded_at DESC, id DESC)'
     )
 
     # Tabella per la gestione del magazzino.
@@ -145,5 +258,10 @@ def init_db():
         'CREATE INDEX IF NOT EXISTS idx_inventory_items_name '
         'ON inventory_items(name)'
     )
+    if INVENTORY_FTS_SUPPORTED:
+        db.executescript(_read_schema(str(_INVENTORY_FTS_SCHEMA_PATH)))
+        # Riallinea l'indice full-text con gli articoli già presenti.
+        db.execute("INSERT INTO inventory_fts (inventory_fts) VALUES ('rebuild')")
 
+    db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     db.commit()
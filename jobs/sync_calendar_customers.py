@@ -4,14 +4,10 @@ from __future__ import annotations
 
 import argparse
 import logging
-import os
-from pathlib import Path
 
 from auth.google_calendar import GoogleCalendarOAuth
-from services.calendar_sync import parse_calendar_scopes, run_calendar_sync
-
-from app import create_app
-from database import get_db
+from database import connect, init_db
+from services.calendar_sync import load_calendar_settings_from_env, run_calendar_sync
 
 LOGGER = logging.getLogger(__name__)
 
@@ -41,42 +37,25 @@ def main() -> int:
 
     logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
 
-    app = create_app()
-    with app.app_context():
-        credentials_file = Path(
-            os.environ.get('GOOGLE_CALENDAR_CREDENTIALS_FILE')
-            or app.config.get('GOOGLE_CALENDAR_CREDENTIALS_FILE')
-            or (Path(app.instance_path) / 'google_calendar_credentials.json')
-        )
-        token_file = Path(
-            os.environ.get('GOOGLE_CALENDAR_TOKEN_FILE')
-            or app.config.get('GOOGLE_CALENDAR_TOKEN_FILE')
-            or (Path(app.instance_path) / 'google_calendar_token.json')
-        )
-        scopes = parse_calendar_scopes(
-            os.environ.get('GOOGLE_CALENDAR_SCOPES')
-            or app.config.get('GOOGLE_CALENDAR_SCOPES')
-        )
-
-        if not credentials_file.exists():
-            LOGGER.error('File di credenziali Google Calendar non trovato: %s', credentials_file)
-            return 1
-
-        oauth = GoogleCalendarOAuth(
-            credentials_file,
-            token_file,
-            scopes,
-            run_console=not args.local_server,
-        )
-
-        calendar_id = (
-            args.calendar_id
-            or os.environ.get('GOOGLE_CALENDAR_ID')
-            or app.config.get('GOOGLE_CALENDAR_ID')
-            or 'primary'
-        )
+    # Il job non crea l'applicazione Flask: legge le stesse impostazioni e apre
+    # direttamente il database, senza avviare lo scheduler automatico.
+    settings = load_calendar_settings_from_env()
+    credentials_file = settings['credentials_path']
+    if not credentials_file.exists():
+        LOGGER.error('File di credenziali Google Calendar non trovato: %s', credentials_file)
+        return 1
+
+    oauth = GoogleCalendarOAuth(
+        credentials_file,
+        settings['token_path'],
+        settings['scopes'],
+        run_console=not args.local_server,
+    )
+    calendar_id = args.calendar_id or settings['calendar_id']
 
-        db = get_db()
+    db = connect(settings['database'])
+    try:
+        init_db(db)
         stats, details = run_calendar_sync(
             db=db,
             oauth=oauth,
@@ -86,19 +65,22 @@ def main() -> int:
             max_results=args.max_results,
             logger=LOGGER,
         )
-        LOGGER.info(
-            'Sincronizzazione completata: %s creati, %s aggiornati, %s invariati (totale %s).',
-            stats['created'],
-            stats['updated'],
-            stats['skipped'],
-            stats['total'],
-        )
-        LOGGER.info(
-            'Calendario %s: %s eventi elaborati, %s candidati estratti.',
-            details['calendar_id'],
-            details['events_count'],
-            details['candidates_count'],
-        )
+    finally:
+        db.close()
+
+    LOGGER.info(
+        'Sincronizzazione completata: %s creati, %s aggiornati, %s invariati (totale %s).',
+        stats['created'],
+        stats['updated'],
+        stats['skipped'],
+        stats['total'],
+    )
+    LOGGER.info(
+        'Calendario %s: %s eventi elaborati, %s candidati estratti.',
+        details['calendar_id'],
+        details['events_count'],
+        details['candidates_count'],
+    )
     return 0
 
 
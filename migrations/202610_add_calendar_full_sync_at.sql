@@ -0,0 +1,3 @@
+-- Ultima lettura completa da cui discende il syncToken salvato: oltre una
+-- certa età il token viene ignorato e la finestra di date riletta per intero.
+ALTER TABLE calendar_sync_state ADD COLUMN full_sync_at TIMESTAMP;
@@ -0,0 +1,7 @@
+-- Ultimo syncToken restituito da Google Calendar per ogni calendario: la
+-- sincronizzazione automatica successiva scarica solo gli eventi modificati.
+CREATE TABLE IF NOT EXISTS calendar_sync_state (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
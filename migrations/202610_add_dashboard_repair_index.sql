@@ -0,0 +1,4 @@
+-- Indice minimo per il conteggio delle riparazioni nella dashboard.
+CREATE INDEX IF NOT EXISTS idx_tickets_repair
+    ON tickets(id)
+    WHERE product IS NOT NULL OR issue_description IS NOT NULL;
@@ -0,0 +1,10 @@
+-- Indici per filtro e ordinamento dell'elenco riparazioni.
+CREATE INDEX IF NOT EXISTS idx_tickets_repair_status
+    ON tickets(repair_status);
+
+CREATE INDEX IF NOT EXISTS idx_tickets_repair_effective_date
+    ON tickets(DATE(COALESCE(date_returned, date_repaired, date_received, updated_at)));
+
+CREATE INDEX IF NOT EXISTS idx_tickets_repair_sort
+    ON tickets(COALESCE(date_returned, updated_at) DESC, id DESC)
+    WHERE product IS NOT NULL OR issue_description IS NOT NULL;
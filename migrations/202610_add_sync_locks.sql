@@ -0,0 +1,6 @@
+-- Turni dei lavori periodici condivisi tra più processi (es. più worker
+-- gunicorn): acquired_at indica quando un processo ha preso il turno.
+CREATE TABLE IF NOT EXISTS sync_locks (
+    name TEXT PRIMARY KEY,
+    acquired_at INTEGER NOT NULL
+);
@@ -0,0 +1,19 @@
+-- Contatore delle modifiche ai clienti per la cache dell'elenco clienti.
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO table_versions (name, version) VALUES ('customers', 0);
+
+CREATE TRIGGER IF NOT EXISTS customers_version_insert AFTER INSERT ON customers BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'customers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_version_update AFTER UPDATE ON customers BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'customers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_version_delete AFTER DELETE ON customers BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'customers';
+END;
@@ -0,0 +1,3 @@
+-- Ricerca dell'ultima modifica per ticket e campo.
+CREATE INDEX IF NOT EXISTS idx_ticket_history_lookup
+    ON ticket_history(ticket_id, field, changed_at DESC, id DESC);
@@ -0,0 +1,10 @@
+-- Indici per l'elenco ticket, lo storico e gli allegati del dettaglio.
+CREATE INDEX IF NOT EXISTS idx_tickets_status_created
+    ON tickets(status, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_ticket_history_ticket_time
+    ON ticket_history(ticket_id, changed_at DESC, id DESC);
+
+DROP INDEX IF EXISTS idx_ticket_attachments_ticket_id;
+CREATE INDEX IF NOT EXISTS idx_ticket_attachments_ticket_time
+    ON ticket_attachments(ticket_id, uploaded_at DESC, id DESC);
@@ -0,0 +1,7 @@
+-- Ordinamento stabile dell'elenco ticket paginato (data di creazione e id).
+DROP INDEX IF EXISTS idx_tickets_status_created;
+CREATE INDEX IF NOT EXISTS idx_tickets_status_created_id
+    ON tickets(status, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_tickets_created_id
+    ON tickets(created_at DESC, id DESC);
@@ -0,0 +1,19 @@
+-- Contatore delle modifiche ai ticket per la cache dell'elenco ticket.
+INSERT OR IGNORE INTO table_versions (name, version) VALUES ('tickets', 0);
+
+CREATE TRIGGER IF NOT EXISTS tickets_version_insert AFTER INSERT ON tickets BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'tickets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_version_update AFTER UPDATE ON tickets BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'tickets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_version_delete AFTER DELETE ON tickets BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'tickets';
+END;
+
+-- L'elenco ticket mostra anche l'ultimo cambio di stato registrato.
+CREATE TRIGGER IF NOT EXISTS ticket_history_version_insert AFTER INSERT ON ticket_history BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'tickets';
+END;
@@ -0,0 +1,3 @@
+-- Versione delle sessioni di ogni utente: incrementandola si invalidano
+-- tutte le sessioni già emesse per quell'utente.
+ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0;
@@ -5,6 +5,7 @@ CREATE TABLE IF NOT EXISTS users (
     username TEXT NOT NULL UNIQUE,
     password_hash TEXT NOT NULL,
     role TEXT NOT NULL DEFAULT 'user',
+    token_version INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -18,6 +19,11 @@ CREATE TABLE IF NOT EXISTS customers (
     address TEXT
 );
 
+-- Ricerca dei clienti esistenti durante la sincronizzazione dal calendario.
+CREATE INDEX IF NOT EXISTS idx_customers_email_nocase ON customers(email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers(phone);
+CREATE INDEX IF NOT EXISTS idx_customers_name_nocase ON customers(name COLLATE NOCASE);
+
 -- Tabella ticket.  Un ticket è associato a un cliente e contiene
 -- informazioni sul problema, lo stato e le date di creazione/aggiornamento.
 CREATE TABLE IF NOT EXISTS tickets (
@@ -42,6 +48,32 @@ CREATE TABLE IF NOT EXISTS tickets (
     FOREIGN KEY (last_modified_by) REFERENCES users(id) ON DELETE SET NULL
 );
 
+-- Indici per l'elenco delle riparazioni: filtro per stato, filtro per data
+-- effettiva (stessa espressione usata nella query) e ordinamento limitato ai
+-- ticket che contengono dati di riparazione.
+CREATE INDEX IF NOT EXISTS idx_tickets_repair_status
+    ON tickets(repair_status);
+
+CREATE INDEX IF NOT EXISTS idx_tickets_repair_effective_date
+    ON tickets(DATE(COALESCE(date_returned, date_repaired, date_received, updated_at)));
+
+CREATE INDEX IF NOT EXISTS idx_tickets_repair_sort
+    ON tickets(COALESCE(date_returned, updated_at) DESC, id DESC)
+    WHERE product IS NOT NULL OR issue_description IS NOT NULL;
+
+-- Elenco ticket, con o senza filtro per stato, ordinato per data di creazione.
+DROP INDEX IF EXISTS idx_tickets_status_created;
+CREATE INDEX IF NOT EXISTS idx_tickets_status_created_id
+    ON tickets(status, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_tickets_created_id
+    ON tickets(created_at DESC, id DESC);
+
+-- Indice minimo per il conteggio delle riparazioni nella dashboard.
+CREATE INDEX IF NOT EXISTS idx_tickets_repair
+    ON tickets(id)
+    WHERE product IS NOT NULL OR issue_description IS NOT NULL;
+
 -- Storico delle modifiche ai ticket per garantire la tracciabilità completa.
 CREATE TABLE IF NOT EXISTS ticket_history (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -55,6 +87,14 @@ CREATE TABLE IF NOT EXISTS ticket_history (
     FOREIGN KEY (changed_by) REFERENCES users(id) ON DELETE SET NULL
 );
 
+-- Ricerca dell'ultima modifica per ticket e campo.
+CREATE INDEX IF NOT EXISTS idx_ticket_history_lookup
+    ON ticket_history(ticket_id, field, changed_at DESC, id DESC);
+
+-- Storico completo di un ticket, dal cambio più recente.
+CREATE INDEX IF NOT EXISTS idx_ticket_history_ticket_time
+    ON ticket_history(ticket_id, changed_at DESC, id DESC);
+
 -- Allegati associati ai ticket. Conserva i metadati dei file caricati
 -- (nome originale, nome su disco, tipo MIME, dimensione e autore).
 CREATE TABLE IF NOT EXISTS ticket_attachments (
@@ -70,8 +110,78 @@ CREATE TABLE IF NOT EXISTS ticket_attachments (
     FOREIGN KEY (uploaded_by) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX IF NOT EXISTS idx_ticket_attachments_ticket_id
-    ON ticket_attachments(ticket_id);
+-- Allegati di un ticket già nell'ordine della pagina di dettaglio.
+DROP INDEX IF EXISTS idx_ticket_attachments_ticket_id;
+CREATE INDEX IF NOT EXISTS idx_ticket_attachments_ticket_time
+    ON ticket_attachments(ticket_id, uploaded_at DESC, id DESC);
+
+-- Cache dei suggerimenti AI condivisa fra i processi dell'applicazione.
+-- La chiave è l'hash di provider, modello e prompt; created_at è in secondi
+-- Unix e serve per la scadenza delle voci.
+CREATE TABLE IF NOT EXISTS ai_suggestion_cache (
+    key TEXT PRIMARY KEY,
+    suggestion TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_suggestion_cache_created_at
+    ON ai_suggestion_cache(created_at);
+
+-- Turni dei lavori periodici condivisi tra più processi (es. più worker
+-- gunicorn): acquired_at indica quando un processo ha preso il turno.
+CREATE TABLE IF NOT EXISTS sync_locks (
+    name TEXT PRIMARY KEY,
+    acquired_at INTEGER NOT NULL
+);
+
+-- Ultimo syncToken restituito da Google Calendar per ogni calendario: la
+-- sincronizzazione automatica successiva scarica solo gli eventi modificati.
+-- ``full_sync_at`` è l'ultima lettura completa da cui discende il token.
+CREATE TABLE IF NOT EXISTS calendar_sync_state (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    full_sync_at TIMESTAMP
+);
+
+-- Contatore delle modifiche per tabella, aggiornato dai trigger: permette
+-- ai processi di riutilizzare elenchi in cache finché la versione non cambia.
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO table_versions (name, version) VALUES ('customers', 0);
+INSERT OR IGNORE INTO table_versions (name, version) VALUES ('tickets', 0);
+
+CREATE TRIGGER IF NOT EXISTS customers_version_insert AFTER INSERT ON customers BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'customers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_version_update AFTER UPDATE ON customers BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'customers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_version_delete AFTER DELETE ON customers BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'customers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_version_insert AFTER INSERT ON tickets BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'tickets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_version_update AFTER UPDATE ON tickets BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'tickets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_version_delete AFTER DELETE ON tickets BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'tickets';
+END;
+
+-- L'elenco ticket mostra anche l'ultimo cambio di stato registrato.
+CREATE TRIGGER IF NOT EXISTS ticket_history_version_insert AFTER INSERT ON ticket_history BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'tickets';
+END;
 
 -- Gestione del magazzino. Ogni articolo ha un codice univoco, un nome,
 -- una descrizione facoltativa e informazioni di inventario.
@@ -0,0 +1,34 @@
+-- Eseguito da ``init_db`` solo se SQLite supporta il tokenizer ``trigram``
+-- (3.34 o successiva); altrimenti la ricerca in magazzino usa LIKE.
+
+-- Indice full-text (trigrammi, quindi anche per sottostringhe come parti di
+-- codice) per la ricerca in magazzino, mantenuto allineato alla tabella
+-- inventory_items dai trigger seguenti.
+CREATE VIRTUAL TABLE IF NOT EXISTS inventory_fts USING fts5(
+    code,
+    name,
+    description,
+    location,
+    category,
+    notes,
+    content='inventory_items',
+    content_rowid='id',
+    tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS inventory_items_fts_insert AFTER INSERT ON inventory_items BEGIN
+    INSERT INTO inventory_fts (rowid, code, name, description, location, category, notes)
+    VALUES (new.id, new.code, new.name, new.description, new.location, new.category, new.notes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_items_fts_delete AFTER DELETE ON inventory_items BEGIN
+    INSERT INTO inventory_fts (inventory_fts, rowid, code, name, description, location, category, notes)
+    VALUES ('delete', old.id, old.code, old.name, old.description, old.location, old.category, old.notes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_items_fts_update AFTER UPDATE ON inventory_items BEGIN
+    INSERT INTO inventory_fts (inventory_fts, rowid, code, name, description, location, category, notes)
+    VALUES ('delete', old.id, old.code, old.name, old.description, old.location, old.category, old.notes);
+    INSERT INTO inventory_fts (rowid, code, name, description, location, category, notes)
+    VALUES (new.id, new.code, new.name, new.description, new.location, new.category, new.notes);
+END;
@@ -0,0 +1,100 @@
+"""Coordinamento delle chiamate concorrenti verso i provider AI."""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class AIProviderBusyError(RuntimeError):
+    """Nessuno slot libero per una nuova chiamata al provider entro il timeout."""
+
+
+class SingleFlight:
+    """Deduplica le chiamate identiche in corso e ne limita il numero.
+
+    Le richieste con la stessa chiave che arrivano mentre una chiamata è già
+    in corso attendono il risultato di quest'ultima invece di interrogare di
+    nuovo il provider. Le chiamate effettive sono limitate da un semaforo
+    per non superare i limiti di frequenza del servizio.
+    """
+
+    def __init__(self, max_concurrency: int = 4) -> None:
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def run(self, key: str, func: Callable[[], T], *, timeout: Optional[float] = None) -> Tuple[T, bool]:
+        """Esegue ``func`` restituendo il risultato e se è stato condiviso."""
+
+        future, leader = self.start(key, timeout=timeout)
+        if not leader:
+            return self.wait(future, timeout=timeout), True
+
+        try:
+            result = func()
+        except BaseException as exc:
+            self.finish(key, future, error=exc)
+            raise
+        self.finish(key, future, result)
+        return result, False
+
+    def start(self, key: str, *, timeout: Optional[float] = None) -> Tuple[Future, bool]:
+        """Registra una chiamata per ``key`` restituendo il future e se si è il leader.
+
+        Il leader ottiene anche uno slot del semaforo e deve chiamare
+        :meth:`finish` al termine; gli altri attendono il future con
+        :meth:`wait`. Serve alle chiamate che non si esauriscono in una sola
+        funzione, come le risposte inoltrate in streaming.
+        """
+
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+
+        if not self._semaphore.acquire(timeout=timeout):
+            error = AIProviderBusyError('Troppe richieste al servizio AI in corso.')
+            with self._lock:
+                self._calls.pop(key, None)
+            future.set_exception(error)
+            raise error
+        return future, True
+
+    def finish(
+        self,
+        key: str,
+        future: Future,
+        result: Any = None,
+        *,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Libera lo slot del leader e consegna risultato o errore a chi attende."""
+
+        self._semaphore.release()
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    @staticmethod
+    def wait(future: Future, *, timeout: Optional[float] = None) -> Any:
+        """Attende il risultato della chiamata identica già in corso."""
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise AIProviderBusyError('Timeout in attesa di una richiesta identica già in corso.')
+
+
+__all__ = ['AIProviderBusyError', 'SingleFlight']
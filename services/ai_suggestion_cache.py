@@ -0,0 +1,98 @@
+"""Cache dei suggerimenti restituiti dai provider AI."""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from database import get_db
+
+
+class SuggestionCache:
+    """Cache LRU con scadenza (TTL) condivisa dai thread dello stesso processo."""
+
+    def __init__(self, *, maxsize: int = 1024, ttl: int = 3600) -> None:
+        self.maxsize = max(int(maxsize), 1)
+        self.ttl = max(int(ttl), 0)
+        self._entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_key(*parts: Optional[str]) -> str:
+        """Calcola la chiave SHA-256 a partire da provider, modello e prompt."""
+
+        raw = '|'.join(part or '' for part in parts)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.ttl:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, suggestion = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return suggestion
+
+    def set(self, key: str, suggestion: str) -> None:
+        if not self.ttl:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, suggestion)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteSuggestionCache:
+    """Cache persistente nella tabella ``ai_suggestion_cache``.
+
+    A differenza di :class:`SuggestionCache` è condivisa da tutti i worker che
+    usano lo stesso database e sopravvive ai riavvii dell'applicazione. Le
+    voci scadute vengono eliminate a ogni nuova scrittura.
+    """
+
+    build_key = staticmethod(SuggestionCache.build_key)
+
+    def __init__(self, *, ttl: int = 3600) -> None:
+        self.ttl = max(int(ttl), 0)
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.ttl:
+            return None
+        row = get_db().execute(
+            'SELECT suggestion FROM ai_suggestion_cache WHERE key = ? AND created_at > ?',
+            (key, int(time.time()) - self.ttl),
+        ).fetchone()
+        return row['suggestion'] if row else None
+
+    def set(self, key: str, suggestion: str) -> None:
+        if not self.ttl:
+            return
+        now = int(time.time())
+        db = get_db()
+        db.execute('DELETE FROM ai_suggestion_cache WHERE created_at <= ?', (now - self.ttl,))
+        db.execute(
+            'INSERT OR REPLACE INTO ai_suggestion_cache (key, suggestion, created_at) VALUES (?, ?, ?)',
+            (key, suggestion, now),
+        )
+        db.commit()
+
+    def clear(self) -> None:
+        db = get_db()
+        db.execute('DELETE FROM ai_suggestion_cache')
+        db.commit()
+
+
+__all__ = ['SQLiteSuggestionCache', 'SuggestionCache']
@@ -3,27 +3,37 @@
 from __future__ import annotations
 
 import logging
+import os
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional, Sequence, Tuple
+from typing import List, Mapping, Optional, Sequence, Tuple
 
-from flask import Flask
+from flask import Config, Flask
 
 from auth.google_calendar import GoogleCalendarOAuth
 from services.customer_sync import CustomerSyncService
 from services.google_calendar_client import GoogleCalendarClient
 
+LOGGER = logging.getLogger(__name__)
+
 DEFAULT_CALENDAR_SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+# Clienti passati a ``CustomerSyncService`` per ogni transazione.
+SYNC_BATCH_SIZE = 200
+# Età massima dell'ultima lettura completa da cui discende il syncToken: oltre
+# questo limite la finestra di date viene riletta, così entrano anche gli
+# eventi non modificati che nel frattempo vi sono rientrati.
+SYNC_TOKEN_MAX_AGE_HOURS = 24
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
 
 def to_rfc3339(dt: datetime) -> str:
     """Converte un ``datetime`` nel formato RFC3339 richiesto da Google."""
 
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    else:
+    if dt.tzinfo is not None:
         dt = dt.astimezone(timezone.utc)
-    return dt.isoformat().replace('+00:00', 'Z')
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
 
 
 def parse_calendar_scopes(raw: Optional[Sequence[str] | str]) -> List[str]:
@@ -38,27 +48,74 @@ def parse_calendar_scopes(raw: Optional[Sequence[str] | str]) -> List[str]:
     return scopes or list(DEFAULT_CALENDAR_SCOPES)
 
 
+_SETTINGS_CONFIG_KEYS = (
+    'GOOGLE_CALENDAR_CREDENTIALS_FILE',
+    'GOOGLE_CALENDAR_TOKEN_FILE',
+    'GOOGLE_CALENDAR_SCOPES',
+    'GOOGLE_CALENDAR_ID',
+)
+
+
 def resolve_calendar_settings(app: Flask) -> dict:
-    """Restituisce percorsi e impostazioni per l'integrazione Google Calendar."""
+    """Restituisce percorsi e impostazioni per l'integrazione Google Calendar.
+
+    Il risultato è memorizzato in ``app.extensions`` e ricalcolato solo quando
+    cambia una delle chiavi di configurazione da cui dipende.
+    """
+
+    config_key = tuple(str(app.config.get(key)) for key in _SETTINGS_CONFIG_KEYS)
+    cached = app.extensions.get('calendar_settings')
+    if cached is not None and cached[0] == config_key:
+        return dict(cached[1])
+
+    settings = _build_calendar_settings(app)
+    app.extensions['calendar_settings'] = (config_key, settings)
+    return dict(settings)
+
+
+def _build_calendar_settings(app: Flask) -> dict:
+    return _settings_from_config(app.config, Path(app.instance_path))
 
+
+def _settings_from_config(config: Mapping, instance_path: Path) -> dict:
     credentials_path = Path(
-        app.config.get('GOOGLE_CALENDAR_CREDENTIALS_FILE')
-        or (Path(app.instance_path) / 'google_calendar_credentials.json')
+        config.get('GOOGLE_CALENDAR_CREDENTIALS_FILE')
+        or (instance_path / 'google_calendar_credentials.json')
     )
     token_path = Path(
-        app.config.get('GOOGLE_CALENDAR_TOKEN_FILE')
-        or (Path(app.instance_path) / 'google_calendar_token.json')
+        config.get('GOOGLE_CALENDAR_TOKEN_FILE')
+        or (instance_path / 'google_calendar_token.json')
     )
-    scopes = parse_calendar_scopes(app.config.get('GOOGLE_CALENDAR_SCOPES'))
-    calendar_id = app.config.get('GOOGLE_CALENDAR_ID') or 'primary'
+    scopes = parse_calendar_scopes(config.get('GOOGLE_CALENDAR_SCOPES'))
+    calendar_id = config.get('GOOGLE_CALENDAR_ID') or 'primary'
     return {
         'credentials_path': credentials_path,
         'token_path': token_path,
-        'scopes': scopes,
+        'scopes': tuple(scopes),
         'calendar_id': calendar_id,
     }
 
 
+def load_calendar_settings_from_env() -> dict:
+    """Legge le impostazioni del calendario senza creare l'applicazione Flask.
+
+    Segue le stesse regole di ``create_app``: valori di default, poi
+    ``instance/config.py`` e infine le variabili d'ambiente. Oltre alle chiavi
+    di :func:`resolve_calendar_settings` restituisce il percorso ``database``.
+    """
+
+    instance_path = _PROJECT_ROOT / 'instance'
+    config = Config(str(_PROJECT_ROOT), {'DATABASE': str(_PROJECT_ROOT / 'database.db')})
+    config.from_pyfile(str(instance_path / 'config.py'), silent=True)
+    for key in _SETTINGS_CONFIG_KEYS:
+        if key in os.environ:
+            config[key] = os.environ[key]
+
+    settings = _settings_from_config(config, instance_path)
+    settings['database'] = str(config['DATABASE'])
+    return settings
+
+
 def run_calendar_sync(
     *,
     db,
@@ -68,8 +125,19 @@ def run_calendar_sync(
     future_days: int = 7,
     max_results: int = 250,
     logger: Optional[logging.Logger] = None,
+    incremental: bool = False,
+    client: Optional[GoogleCalendarClient] = None,
 ) -> Tuple[dict, dict]:
-    """Scarica gli eventi dal calendario e sincronizza i clienti."""
+    """Scarica gli eventi dal calendario e sincronizza i clienti.
+
+    Con ``incremental`` viene riutilizzato il syncToken salvato dall'ultima
+    esecuzione, così da scaricare solo gli eventi modificati nel frattempo;
+    di questi sono sincronizzati solo quelli che cadono nella finestra di
+    date. Un token derivato da una lettura completa più vecchia di
+    ``SYNC_TOKEN_MAX_AGE_HOURS`` viene ignorato e la finestra riletta.
+    Chi esegue sincronizzazioni ripetute può passare il proprio ``client`` per
+    riutilizzarne credenziali e servizio.
+    """
 
     past_days = max(int(past_days), 0)
     future_days = max(int(future_days), 0)
@@ -79,25 +147,87 @@ def run_calendar_sync(
     time_min = to_rfc3339(now - timedelta(days=past_days))
     time_max = to_rfc3339(now + timedelta(days=future_days))
 
-    client = GoogleCalendarClient(oauth, calendar_id=calendar_id)
-    events = client.fetch_events(time_min=time_min, time_max=time_max, max_results=max_results)
-    candidates = client.extract_customers(events)
+    if client is None:
+        client = GoogleCalendarClient(oauth, calendar_id=calendar_id)
+    events_count = 0
+
+    def _counted(events):
+        nonlocal events_count
+        for event in events:
+            events_count += 1
+            yield event
+
+    sync_token = None
+    if incremental:
+        row = db.execute(
+            'SELECT sync_token FROM calendar_sync_state '
+            "WHERE calendar_id = ? AND full_sync_at > datetime('now', ?)",
+            (calendar_id, f'-{SYNC_TOKEN_MAX_AGE_HOURS} hours'),
+        ).fetchone()
+        sync_token = row['sync_token'] if row is not None else None
+
+    events = client.fetch_events(
+        time_min=time_min,
+        time_max=time_max,
+        max_results=max_results,
+        # orderBy non è ammesso con il syncToken: la lettura che lo produce
+        # ne fa quindi a meno.
+        order_by=None if incremental else 'startTime',
+        sync_token=sync_token,
+    )
+    candidates = client.extract_customers(_counted(events))
 
+    # I clienti sono sincronizzati a lotti mentre gli eventi vengono letti,
+    # senza tenere in memoria l'intero elenco.
     sync_service = CustomerSyncService(db, logger=logger)
-    stats = sync_service.sync_candidates(candidates)
+    stats = {'total': 0, 'created': 0, 'updated': 0, 'skipped': 0}
+    candidates_count = 0
+    while True:
+        batch = list(islice(candidates, SYNC_BATCH_SIZE))
+        if not batch:
+            break
+        candidates_count += len(batch)
+        for key, value in sync_service.sync_candidates(batch).items():
+            stats[key] += value
+
+    if incremental and client.next_sync_token:
+        # Solo un token prodotto da una lettura completa ne aggiorna la data.
+        db.execute(
+            'INSERT INTO calendar_sync_state (calendar_id, sync_token, full_sync_at) '
+            'VALUES (?, ?, CASE WHEN ? THEN NULL ELSE CURRENT_TIMESTAMP END) '
+            'ON CONFLICT(calendar_id) DO UPDATE SET '
+            'sync_token = excluded.sync_token, updated_at = CURRENT_TIMESTAMP, '
+            'full_sync_at = COALESCE(excluded.full_sync_at, calendar_sync_state.full_sync_at)',
+            (calendar_id, client.next_sync_token, client.incremental),
+        )
+        db.commit()
+    elif incremental:
+        # La lettura completa è stata troncata da max_results: senza un nuovo
+        # syncToken la prossima esecuzione ripartirà da una lettura completa.
+        (logger or LOGGER).warning(
+            'Nessun syncToken per il calendario %s: eventi oltre il limite di %s, '
+            'la prossima sincronizzazione sarà completa.',
+            calendar_id,
+            max_results,
+        )
+        db.execute('DELETE FROM calendar_sync_state WHERE calendar_id = ?', (calendar_id,))
+        db.commit()
+
     sync_details = {
         'calendar_id': calendar_id,
-        'events_count': len(events),
-        'candidates_count': len(candidates),
+        'events_count': events_count,
+        'candidates_count': candidates_count,
         'past_days': past_days,
         'future_days': future_days,
         'max_results': max_results,
+        'incremental': client.incremental,
     }
     return stats, sync_details
 
 
 __all__ = [
     'DEFAULT_CALENDAR_SCOPES',
+    'load_calendar_settings_from_env',
     'parse_calendar_scopes',
     'resolve_calendar_settings',
     'run_calendar_sync',
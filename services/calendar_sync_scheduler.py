@@ -3,7 +3,9 @@
 from __future__ import annotations
 
 import logging
+import os
 import threading
+import time
 from typing import Optional
 
 from flask import Flask
@@ -11,10 +13,30 @@ from flask import Flask
 from auth.google_calendar import GoogleCalendarOAuth
 from database import get_db
 from services.calendar_sync import resolve_calendar_settings, run_calendar_sync
+from services.google_calendar_client import GoogleCalendarClient
+
+
+LEASE_NAME = 'calendar_auto_sync'
+
+
+def is_reloader_watcher(app: Flask) -> bool:
+    """Indica se il processo corrente è solo il sorvegliante del reloader.
+
+    Con ``FLASK_DEBUG=1`` il reloader di Werkzeug importa l'applicazione anche
+    nel processo che osserva i file, il quale non serve richieste: avviarvi lo
+    scheduler aggiungerebbe un thread e una sincronizzazione inutili.
+    """
+
+    return app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
 
 
 class CalendarSyncScheduler:
-    """Esegue periodicamente la sincronizzazione clienti in un thread dedicato."""
+    """Esegue periodicamente la sincronizzazione clienti in un thread dedicato.
+
+    Con più worker ogni processo avvia il proprio scheduler: prima di
+    sincronizzare, ciascuno prova a prendere il turno nella tabella
+    ``sync_locks`` e solo il primo per intervallo contatta Google Calendar.
+    """
 
     def __init__(
         self,
@@ -36,6 +58,10 @@ class CalendarSyncScheduler:
         self._stop_event = threading.Event()
         self._thread: Optional[threading.Thread] = None
         self._lock = threading.Lock()
+        # Client riusato tra un intervallo e l'altro, finché non cambiano le
+        # impostazioni da cui è stato creato.
+        self._client_key: Optional[tuple] = None
+        self._client: Optional[GoogleCalendarClient] = None
 
     def start(self) -> None:
         if self._thread and self._thread.is_alive():
@@ -60,12 +86,42 @@ class CalendarSyncScheduler:
             self._execute_sync()
             self._stop_event.wait(self.interval_seconds)
 
+    def _acquire_lease(self, db) -> bool:
+        """Riserva l'intervallo corrente per questo processo, se ancora libero."""
+
+        now = int(time.time())
+        cursor = db.execute(
+            'INSERT INTO sync_locks (name, acquired_at) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET acquired_at = excluded.acquired_at '
+            'WHERE sync_locks.acquired_at <= ?',
+            (LEASE_NAME, now, now - self.interval_seconds),
+        )
+        db.commit()
+        return cursor.rowcount > 0
+
+    def _get_client(self, settings: dict, calendar_id: str) -> GoogleCalendarClient:
+        key = (settings['credentials_path'], settings['token_path'], settings['scopes'], calendar_id)
+        if self._client is None or self._client_key != key:
+            oauth = GoogleCalendarOAuth(
+                settings['credentials_path'],
+                settings['token_path'],
+                settings['scopes'],
+                run_console=False,
+                allow_interactive=False,
+            )
+            self._client = GoogleCalendarClient(oauth, calendar_id=calendar_id)
+            self._client_key = key
+        return self._client
+
     def _execute_sync(self) -> None:
         if not self._lock.acquire(blocking=False):
             self.logger.debug('Esecuzione di sincronizzazione già in corso, salto.')
             return
         try:
             with self.app.app_context():
+                if not self._acquire_lease(get_db()):
+                    self.logger.debug('Sincronizzazione già eseguita da un altro processo, salto.')
+                    return
                 settings = resolve_calendar_settings(self.app)
                 credentials_path = settings['credentials_path']
                 if not credentials_path.exists():
@@ -75,23 +131,19 @@ class CalendarSyncScheduler:
                     )
                     return
 
-                oauth = GoogleCalendarOAuth(
-                    credentials_path,
-                    settings['token_path'],
-                    settings['scopes'],
-                    run_console=False,
-                    allow_interactive=False,
-                )
                 calendar_id = (self.calendar_id or settings['calendar_id']).strip() or settings['calendar_id']
+                client = self._get_client(settings, calendar_id)
                 db = get_db()
                 stats, _ = run_calendar_sync(
                     db=db,
-                    oauth=oauth,
+                    oauth=client.oauth,
                     calendar_id=calendar_id,
                     past_days=self.past_days,
                     future_days=self.future_days,
                     max_results=self.max_results,
                     logger=self.logger,
+                    incremental=True,
+                    client=client,
                 )
                 self.logger.info(
                     'Sincronizzazione Google Calendar completata automaticamente: %s creati, %s aggiornati, %s invariati.',
@@ -107,4 +159,4 @@ class CalendarSyncScheduler:
             self._lock.release()
 
 
-__all__ = ['CalendarSyncScheduler']
+__all__ = ['CalendarSyncScheduler', 'is_reloader_watcher']
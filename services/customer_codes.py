@@ -9,19 +9,23 @@ CUSTOMER_CODE_LENGTH = 4
 MAX_CUSTOMER_CODES = len(CUSTOMER_CODE_ALPHABET) ** CUSTOMER_CODE_LENGTH
 
 
+# Tabelle precalcolate: valore di ogni lettera e peso di ogni posizione.
+_CHAR_VALUES = {char: index for index, char in enumerate(CUSTOMER_CODE_ALPHABET)}
+_POSITION_WEIGHTS = tuple(
+    len(CUSTOMER_CODE_ALPHABET) ** exponent for exponent in range(CUSTOMER_CODE_LENGTH - 1, -1, -1)
+)
+
+
 def customer_code_to_int(code: str) -> int:
     """Converte un codice cliente (es. ``"aaab"``) nel corrispondente valore intero."""
     normalized = (code or '').strip().lower()
     if len(normalized) != CUSTOMER_CODE_LENGTH:
         raise ValueError('Codice cliente non valido.')
 
-    value = 0
-    base = len(CUSTOMER_CODE_ALPHABET)
-    for char in normalized:
-        if char not in CUSTOMER_CODE_ALPHABET:
-            raise ValueError('Codice cliente non valido.')
-        value = value * base + (ord(char) - ord('a'))
-    return value
+    try:
+        return sum(_CHAR_VALUES[char] * weight for char, weight in zip(normalized, _POSITION_WEIGHTS))
+    except KeyError:
+        raise ValueError('Codice cliente non valido.') from None
 
 
 def int_to_customer_code(value: int) -> str:
@@ -30,11 +34,7 @@ def int_to_customer_code(value: int) -> str:
         raise ValueError('Valore codice cliente fuori intervallo.')
 
     base = len(CUSTOMER_CODE_ALPHABET)
-    chars = ['a'] * CUSTOMER_CODE_LENGTH
-    for index in range(CUSTOMER_CODE_LENGTH - 1, -1, -1):
-        chars[index] = chr(ord('a') + (value % base))
-        value //= base
-    return ''.join(chars)
+    return ''.join(CUSTOMER_CODE_ALPHABET[value // weight % base] for weight in _POSITION_WEIGHTS)
 
 
 def generate_next_customer_code(db: sqlite3.Connection) -> str:
@@ -4,16 +4,25 @@ from __future__ import annotations
 
 import logging
 import sqlite3
-from dataclasses import dataclass
-from typing import Dict, Iterable, Optional
-
-from services.customer_codes import generate_next_customer_code
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.customer_codes import (
+    customer_code_to_int,
+    generate_next_customer_code,
+    int_to_customer_code,
+)
 from services.google_calendar_client import CalendarCustomerCandidate
 
 LOGGER = logging.getLogger(__name__)
 
+_SYNC_FIELDS = ('name', 'email', 'phone', 'address')
+# Numero massimo di parametri per ogni ricerca ``IN`` (SQLite ne accetta 999
+# nelle versioni meno recenti).
+_IN_CHUNK_SIZE = 500
+
 
-@dataclass
+@dataclass(slots=True)
 class Customer:
     """Rappresenta un record cliente normalizzato."""
 
@@ -22,6 +31,14 @@ class Customer:
     phone: Optional[str] = None
     address: Optional[str] = None
     source_event_id: Optional[str] = None
+    # Chiavi di ricerca senza distinzione fra maiuscole e minuscole, calcolate
+    # una sola volta per cliente.
+    email_key: Optional[str] = field(init=False, repr=False, compare=False)
+    name_key: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.email_key = self.email.lower() if self.email else None
+        self.name_key = self.name.lower()
 
     @classmethod
     def from_candidate(cls, candidate: CalendarCustomerCandidate) -> 'Customer':
@@ -42,74 +59,165 @@ class CustomerSyncService:
         self.logger = logger or LOGGER
 
     def sync_candidates(self, candidates: Iterable[CalendarCustomerCandidate]) -> Dict[str, int]:
-        customers = [Customer.from_candidate(candidate) for candidate in candidates if candidate.name]
-        return self.sync_customers(customers)
+        # Gli eventi ripetuti dello stesso cliente producono candidati con le
+        # stesse chiavi: se ne tiene uno solo, con i dati dell'ultimo evento.
+        unique: Dict[tuple, Customer] = {}
+        for candidate in candidates:
+            if not candidate.name:
+                continue
+            customer = Customer.from_candidate(candidate)
+            unique[(customer.email_key, customer.phone, customer.name_key)] = customer
+        return self.sync_customers(unique.values())
 
     def sync_customers(self, customers: Iterable[Customer]) -> Dict[str, int]:
-        stats = {'total': 0, 'created': 0, 'updated': 0, 'skipped': 0}
-        cursor = self.connection.cursor()
+        """Confronta i clienti con il database e salva le differenze in blocco.
+
+        I clienti già presenti sono letti con una query ``IN`` per chiave
+        (email, telefono, nome) invece che uno alla volta; inserimenti e
+        aggiornamenti sono poi scritti con due ``executemany`` in un'unica
+        transazione.
+        """
+
+        customers = list(customers)
+        if not self.connection.in_transaction:
+            # La transazione prende subito il lock di scrittura: clienti letti
+            # e codici assegnati non possono cambiare prima del commit.
+            self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            stats = self._apply(customers)
+        except Exception:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+        return stats
+
+    def _apply(self, customers: List[Customer]) -> Dict[str, int]:
+        stats = {'total': len(customers), 'created': 0, 'updated': 0, 'skipped': 0}
+        by_email, by_phone, by_name = self._prefetch_existing(customers)
+
+        next_code: Optional[int] = None
+        inserts: List[dict] = []
+        updates: Dict[int, dict] = {}
 
         for customer in customers:
-            stats['total'] += 1
-            existing = self._find_existing(cursor, customer)
+            existing = (
+                (customer.email_key and by_email.get(customer.email_key))
+                or (customer.phone and by_phone.get(customer.phone))
+                or by_name.get(customer.name_key)
+            )
             if existing is None:
                 try:
-                    code = generate_next_customer_code(self.connection)
+                    if next_code is None:
+                        next_code = customer_code_to_int(generate_next_customer_code(self.connection))
+                    code = int_to_customer_code(next_code)
                 except ValueError as exc:
                     self.logger.error('Impossibile generare il codice cliente: %s', exc)
                     stats['skipped'] += 1
                     continue
-                cursor.execute(
-                    'INSERT INTO customers (code, name, email, phone, address) VALUES (?, ?, ?, ?, ?)',
-                    (code, customer.name, customer.email, customer.phone, customer.address),
-                )
+                next_code += 1
+                record = {'id': None, 'code': code}
+                record.update((column, getattr(customer, column)) for column in _SYNC_FIELDS)
+                inserts.append(record)
+                self._index(record, by_email, by_phone, by_name)
                 stats['created'] += 1
                 self.logger.info('Creato nuovo cliente "%s" (codice %s).', customer.name, code)
+                continue
+
+            # Caso più frequente nelle sincronizzazioni ripetute: valori
+            # identici, senza bisogno di normalizzarli campo per campo.
+            if (
+                existing['name'] == customer.name
+                and existing['email'] == customer.email
+                and existing['phone'] == customer.phone
+                and existing['address'] == customer.address
+            ):
+                stats['skipped'] += 1
+                continue
+
+            changed = False
+            for column in _SYNC_FIELDS:
+                new_value = getattr(customer, column)
+                if (existing[column] or '').strip() != (new_value or '').strip():
+                    existing[column] = new_value
+                    changed = True
+            if changed:
+                # I clienti appena creati in questo lotto vengono aggiornati
+                # direttamente nella riga da inserire.
+                if existing['id'] is not None:
+                    updates[existing['id']] = existing
+                self._index(existing, by_email, by_phone, by_name)
+                stats['updated'] += 1
+                self.logger.info('Aggiornato cliente "%s".', customer.name)
             else:
-                updates = {}
-                for field in ('name', 'email', 'phone', 'address'):
-                    new_value = getattr(customer, field)
-                    old_value = existing[field]
-                    normalized_old = (old_value or '').strip()
-                    normalized_new = (new_value or '').strip()
-                    if normalized_old != normalized_new:
-                        updates[field] = new_value
-                if updates:
-                    assignments = ', '.join(f"{field} = ?" for field in updates)
-                    values = list(updates.values())
-                    values.append(existing['id'])
-                    cursor.execute(
-                        f'UPDATE customers SET {assignments} WHERE id = ?',
-                        values,
-                    )
-                    stats['updated'] += 1
-                    self.logger.info('Aggiornato cliente "%s".', customer.name)
-                else:
-                    stats['skipped'] += 1
+                stats['skipped'] += 1
 
-        self.connection.commit()
+        cursor = self.connection.cursor()
+        if inserts:
+            cursor.executemany(
+                'INSERT INTO customers (code, name, email, phone, address) VALUES (?, ?, ?, ?, ?)',
+                [(row['code'], *(row[column] for column in _SYNC_FIELDS)) for row in inserts],
+            )
+        if updates:
+            cursor.executemany(
+                'UPDATE customers SET name = ?, email = ?, phone = ?, address = ? WHERE id = ?',
+                [(*(row[column] for column in _SYNC_FIELDS), row_id) for row_id, row in updates.items()],
+            )
         return stats
 
-    def _find_existing(self, cursor: sqlite3.Cursor, customer: Customer) -> Optional[sqlite3.Row]:
-        if customer.email:
-            row = cursor.execute(
-                'SELECT * FROM customers WHERE LOWER(email) = LOWER(?)',
-                (customer.email,),
-            ).fetchone()
-            if row:
-                return row
-        if customer.phone:
-            row = cursor.execute(
-                'SELECT * FROM customers WHERE phone = ?',
-                (customer.phone,),
-            ).fetchone()
-            if row:
-                return row
-        row = cursor.execute(
-            'SELECT * FROM customers WHERE LOWER(name) = LOWER(?)',
-            (customer.name,),
-        ).fetchone()
-        return row
+    def _prefetch_existing(
+        self, customers: List[Customer]
+    ) -> Tuple[Dict[str, dict], Dict[str, dict], Dict[str, dict]]:
+        """Carica i clienti esistenti che corrispondono per email, telefono o nome.
+
+        Il confronto ``COLLATE NOCASE`` usa gli indici omonimi su ``customers``.
+        """
 
+        lookups = (
+            ('email COLLATE NOCASE', {c.email_key for c in customers if c.email_key}),
+            ('phone', {c.phone for c in customers if c.phone}),
+            ('name COLLATE NOCASE', {c.name_key for c in customers}),
+        )
+        rows: Dict[int, dict] = {}
+        for expression, keys in lookups:
+            keys = list(keys)
+            for start in range(0, len(keys), _IN_CHUNK_SIZE):
+                chunk = keys[start:start + _IN_CHUNK_SIZE]
+                placeholders = ', '.join('?' * len(chunk))
+                for row in self.connection.execute(
+                    f'SELECT id, name, email, phone, address FROM customers '
+                    f'WHERE {expression} IN ({placeholders})',
+                    chunk,
+                ):
+                    rows.setdefault(row['id'], dict(row))
+
+        by_email: Dict[str, dict] = {}
+        by_phone: Dict[str, dict] = {}
+        by_name: Dict[str, dict] = {}
+        # In ordine di id, come la prima riga restituita dalle ricerche puntuali.
+        for row_id in sorted(rows):
+            row = rows[row_id]
+            if row['email']:
+                by_email.setdefault(row['email'].lower(), row)
+            if row['phone']:
+                by_phone.setdefault(row['phone'], row)
+            if row['name']:
+                by_name.setdefault(row['name'].lower(), row)
+        return by_email, by_phone, by_name
+
+    @staticmethod
+    def _index(
+        record: dict,
+        by_email: Dict[str, dict],
+        by_phone: Dict[str, dict],
+        by_name: Dict[str, dict],
+    ) -> None:
+        """Rende il record trovabile dai clienti successivi dello stesso lotto."""
+
+        if record['email']:
+            by_email.setdefault(record['email'].lower(), record)
+        if record['phone']:
+            by_phone.setdefault(record['phone'], record)
+        if record['name']:
+            by_name.setdefault(record['name'].lower(), record)
 
 __all__ = ['Customer', 'CustomerSyncService']
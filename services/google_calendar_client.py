@@ -5,22 +5,72 @@ from __future__ import annotations
 import logging
 import re
 from dataclasses import dataclass
-from typing import Iterable, List, Optional
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
 
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 from auth.google_calendar import GoogleCalendarOAuth
 
 LOGGER = logging.getLogger(__name__)
 
-_FIELD_PATTERNS = {
-    'email': re.compile(r'email\s*[:=-]\s*(?P<value>[^\n]+)', re.IGNORECASE),
-    'phone': re.compile(r'(?:telefono|tel|phone)\s*[:=-]\s*(?P<value>[^\n]+)', re.IGNORECASE),
-    'address': re.compile(r'(?:indirizzo|address)\s*[:=-]\s*(?P<value>[^\n]+)', re.IGNORECASE),
-}
+# Limite di eventi per pagina accettato da ``events.list``.
+_MAX_PAGE_SIZE = 2500
 
+# Un'unica espressione con un gruppo per campo: la descrizione viene
+# scandita una sola volta invece che una per ciascun campo. Ogni valore si
+# ferma a fine riga o prima della parola chiave successiva, così più campi
+# possono stare sulla stessa riga.
+_FIELD_VALUE = r'\s*[:=-]\s*(?P<{}>[^\n]+?)(?=\s+(?:email|telefono|tel|phone|indirizzo|address)\s*[:=-]|\s*$)'
+_FIELDS_PATTERN = re.compile(
+    r'email' + _FIELD_VALUE.format('email')
+    + r'|(?:telefono|tel|phone)' + _FIELD_VALUE.format('phone')
+    + r'|(?:indirizzo|address)' + _FIELD_VALUE.format('address'),
+    re.IGNORECASE | re.MULTILINE,
+)
+_FIELD_NAMES = ('email', 'phone', 'address')
+# Parole chiave di almeno un'alternativa: se nessuna compare nella
+# descrizione l'espressione regolare non viene nemmeno eseguita.
+_FIELD_KEYWORDS = ('email', 'tel', 'phone', 'indirizzo', 'address')
 
-@dataclass
+
+def _clean(value: Optional[str]) -> Optional[str]:
+    """Rimuove gli spazi esterni e restituisce ``None`` per le stringhe vuote."""
+
+    return (value or '').strip() or None
+
+
+def _parse_event_time(value: Optional[dict]) -> Optional[datetime]:
+    """Converte ``start``/``end`` di un evento (o un istante RFC3339) in UTC."""
+
+    raw = (value.get('dateTime') or value.get('date')) if isinstance(value, dict) else value
+    if not raw:
+        return None
+    parsed = datetime.fromisoformat(raw.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _event_in_window(
+    event: dict, window_start: Optional[datetime], window_end: Optional[datetime]
+) -> bool:
+    """Stesso criterio di ``timeMin``/``timeMax`` applicato lato client.
+
+    Gli eventi senza date (ad esempio quelli eliminati) vengono mantenuti.
+    """
+
+    start = _parse_event_time(event.get('start'))
+    if start is None:
+        return True
+    end = _parse_event_time(event.get('end')) or start
+    if window_end is not None and start >= window_end:
+        return False
+    return window_start is None or end > window_start
+
+
+@dataclass(slots=True)
 class CalendarCustomerCandidate:
     """Dati anagrafici estratti da un evento di calendario."""
 
@@ -30,7 +80,6 @@ class CalendarCustomerCandidate:
     address: Optional[str]
     notes: Optional[str]
     event_id: Optional[str]
-    raw_event: dict
 
 
 class GoogleCalendarClient:
@@ -46,6 +95,28 @@ class GoogleCalendarClient:
         self.oauth = oauth
         self.calendar_id = calendar_id
         self.application_name = application_name
+        # Valorizzati da ``fetch_events``: token per la successiva lettura
+        # incrementale (solo se tutte le pagine sono state lette) e indicazione
+        # se la lettura corrente è stata incrementale.
+        self.next_sync_token: Optional[str] = None
+        self.incremental = False
+        self._credentials = None
+        self._service = None
+
+    def _get_service(self):
+        """Restituisce il servizio Calendar, ricostruendolo solo se necessario.
+
+        Il servizio (e il documento di discovery da cui è generato) è riusato
+        finché le credenziali restano valide; alla scadenza ``authorize``
+        esegue il refresh e salva il nuovo token.
+        """
+
+        if self._service is None or not self._credentials or not self._credentials.valid:
+            self._credentials = self.oauth.authorize()
+            self._service = build(
+                'calendar', 'v3', credentials=self._credentials, cache_discovery=False
+            )
+        return self._service
 
     def fetch_events(
         self,
@@ -54,77 +125,131 @@ class GoogleCalendarClient:
         time_max: Optional[str] = None,
         max_results: int = 250,
         single_events: bool = True,
-        order_by: str = 'startTime',
+        order_by: Optional[str] = 'startTime',
         query: Optional[str] = None,
-    ) -> List[dict]:
-        credentials = self.oauth.authorize()
-        service = build('calendar', 'v3', credentials=credentials, cache_discovery=False)
-        kwargs = {
+        sync_token: Optional[str] = None,
+    ) -> Iterator[dict]:
+        """Restituisce gli eventi una pagina alla volta, fino a ``max_results``.
+
+        Le pagine successive sono richieste tramite ``pageToken`` solo quando
+        il chiamante ha consumato quelle precedenti, così in memoria resta al
+        più una pagina di eventi.
+
+        Con ``sync_token`` vengono restituiti solo gli eventi modificati dalla
+        lettura che lo ha prodotto; se Google lo considera scaduto (HTTP 410)
+        si ripiega sull'intervallo ``time_min``/``time_max``. Le letture
+        incrementali ignorano ``max_results`` e seguono tutte le pagine: Google
+        fornisce il nuovo syncToken solo sull'ultima. Una lettura completa
+        troncata da ``max_results`` lascia invece ``next_sync_token`` a ``None``.
+        """
+
+        service = self._get_service()
+        full_kwargs = {
             'calendarId': self.calendar_id,
-            'maxResults': max_results,
+            'maxResults': min(max_results, _MAX_PAGE_SIZE),
             'singleEvents': single_events,
-            'orderBy': order_by,
         }
+        if order_by:
+            full_kwargs['orderBy'] = order_by
         if time_min:
-            kwargs['timeMin'] = time_min
+            full_kwargs['timeMin'] = time_min
         if time_max:
-            kwargs['timeMax'] = time_max
+            full_kwargs['timeMax'] = time_max
         if query:
-            kwargs['q'] = query
+            full_kwargs['q'] = query
+
+        self.next_sync_token = None
+        self.incremental = bool(sync_token)
+        if sync_token:
+            # Google non accetta filtri e ordinamento insieme al syncToken.
+            kwargs = {
+                'calendarId': self.calendar_id,
+                'maxResults': _MAX_PAGE_SIZE,
+                'singleEvents': single_events,
+                'syncToken': sync_token,
+            }
+        else:
+            kwargs = dict(full_kwargs)
 
         LOGGER.debug('Richiesta eventi calendario %s con parametri %s', self.calendar_id, kwargs)
-        events_result = service.events().list(**kwargs).execute()
-        items = events_result.get('items', [])
-        LOGGER.info('Recuperati %s eventi dal calendario %s', len(items), self.calendar_id)
-        return items
+        window_start = _parse_event_time(time_min)
+        window_end = _parse_event_time(time_max)
+        remaining = max_results
+        fetched = 0
+        while self.incremental or remaining > 0:
+            try:
+                events_result = service.events().list(**kwargs).execute()
+            except HttpError as exc:
+                if not self.incremental or fetched or exc.resp.status != 410:
+                    raise
+                LOGGER.info(
+                    'syncToken scaduto per il calendario %s: lettura completa.', self.calendar_id
+                )
+                self.incremental = False
+                kwargs = dict(full_kwargs)
+                continue
+            items = events_result.get('items', [])
+            if self.incremental:
+                # Il syncToken ignora timeMin/timeMax: la finestra è applicata qui.
+                items = [item for item in items if _event_in_window(item, window_start, window_end)]
+            else:
+                items = items[:remaining]
+                remaining -= len(items)
+            fetched += len(items)
+            yield from items
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                self.next_sync_token = events_result.get('nextSyncToken')
+                break
+            if not items and not self.incremental:
+                break
+            kwargs['pageToken'] = page_token
+            if not self.incremental:
+                kwargs['maxResults'] = min(remaining, _MAX_PAGE_SIZE)
+        LOGGER.info('Recuperati %s eventi dal calendario %s', fetched, self.calendar_id)
+
+    def extract_customers(self, events: Iterable[dict]) -> Iterator[CalendarCustomerCandidate]:
+        """Converte gli eventi in potenziali clienti man mano che vengono letti."""
 
-    def extract_customers(self, events: Iterable[dict]) -> List[CalendarCustomerCandidate]:
-        candidates: List[CalendarCustomerCandidate] = []
+        count = 0
         for event in events:
             candidate = self._event_to_candidate(event)
             if candidate:
-                candidates.append(candidate)
-        LOGGER.info('Estratti %s potenziali clienti dagli eventi.', len(candidates))
-        return candidates
+                count += 1
+                yield candidate
+        LOGGER.info('Estratti %s potenziali clienti dagli eventi.', count)
 
     def _event_to_candidate(self, event: dict) -> Optional[CalendarCustomerCandidate]:
-        summary = (event.get('summary') or '').strip()
-        attendees = event.get('attendees') or []
-        description = (event.get('description') or '').strip()
-        location = (event.get('location') or '').strip()
+        if event.get('status') == 'cancelled':
+            # Le letture incrementali riportano anche gli eventi eliminati.
+            return None
+        name = _clean(event.get('summary'))
+        description = _clean(event.get('description'))
+        location = _clean(event.get('location'))
 
         email = None
-        name = summary
-        if attendees:
-            for attendee in attendees:
-                if attendee.get('resource'):
-                    continue
-                email = email or attendee.get('email')
-                display_name = (attendee.get('displayName') or '').strip()
-                if not name and display_name:
-                    name = display_name
-                if email and name:
-                    break
+        for attendee in event.get('attendees') or ():
+            if attendee.get('resource'):
+                continue
+            email = email or _clean(attendee.get('email'))
+            if not name:
+                name = _clean(attendee.get('displayName'))
+            if email and name:
+                break
 
         if not name:
             LOGGER.debug('Evento %s ignorato: nome assente.', event.get('id'))
             return None
 
-        parsed_fields = self._parse_description(description)
-        email = email or parsed_fields.get('email')
-        phone = parsed_fields.get('phone')
-        address = parsed_fields.get('address') or location
-
-        notes = description or None
-
+        # I valori estratti dalla descrizione sono già privi di spazi esterni.
+        parsed_fields = self._parse_description(description) if description else {}
         return CalendarCustomerCandidate(
-            name=name.strip(),
-            email=(email or '').strip() or None,
-            phone=(phone or '').strip() or None,
-            address=(address or '').strip() or None,
-            notes=notes,
+            name=name,
+            email=email or parsed_fields.get('email'),
+            phone=parsed_fields.get('phone'),
+            address=parsed_fields.get('address') or location,
+            notes=description,
             event_id=event.get('id'),
-            raw_event=event,
         )
 
     @staticmethod
@@ -132,13 +257,18 @@ class GoogleCalendarClient:
         parsed: dict = {}
         if not description:
             return parsed
-        for field, pattern in _FIELD_PATTERNS.items():
-            match = pattern.search(description)
-            if match:
-                value = (match.group('value') or '').strip()
-                if value:
-                    parsed[field] = value
+        lowered = description.lower()
+        if not any(keyword in lowered for keyword in _FIELD_KEYWORDS):
+            return parsed
+        for match in _FIELDS_PATTERN.finditer(description):
+            field = match.lastgroup
+            if field in parsed:
+                continue
+            value = (match.group(field) or '').strip()
+            if value:
+                parsed[field] = value
+                if len(parsed) == len(_FIELD_NAMES):
+                    break
         return parsed
 
-
 __all__ = ['GoogleCalendarClient', 'CalendarCustomerCandidate']
@@ -16,6 +16,44 @@
         return field ? field.value : '';
     }
 
+    // Legge gli eventi SSE di /ai/suggest mostrando il testo man mano che arriva.
+    async function readEventStream(response, suggestionBox) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let partial = '';
+        let result = {};
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary = buffer.indexOf('\n\n');
+            while (boundary !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                boundary = buffer.indexOf('\n\n');
+
+                let eventName = 'message';
+                let dataLine = '';
+                rawEvent.split('\n').forEach((line) => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    if (line.startsWith('data:')) dataLine += line.slice(5).trim();
+                });
+                const eventData = dataLine ? JSON.parse(dataLine) : {};
+
+                if (eventName === 'message' && eventData.delta) {
+                    partial += eventData.delta;
+                    suggestionBox.textContent = partial;
+                } else if (eventName === 'done' || eventName === 'error') {
+                    result = eventData;
+                }
+            }
+        }
+        return result;
+    }
+
     async function handleClick(event) {
         const button = event.currentTarget;
         const helperWrapper = button.closest(config.helperWrapperSelector || '.ai-helper');
@@ -45,11 +83,15 @@
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream, application/json',
                 },
                 body: JSON.stringify(payload),
             });
 
-            const data = await response.json().catch(() => ({}));
+            const contentType = response.headers.get('Content-Type') || '';
+            const data = response.ok && contentType.startsWith('text/event-stream')
+                ? await readEventStream(response, suggestionBox)
+                : await response.json().catch(() => ({}));
 
             if (!response.ok || !data.suggestion) {
                 const message = data.error || data.message || 'Impossibile ottenere un suggerimento in questo momento.';
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import shutil
 import sys
 from pathlib import Path
 
@@ -14,22 +15,34 @@ from app import create_app  # noqa: E402
 from database import get_db, init_db  # noqa: E402
 
 
-@pytest.fixture
-def app(tmp_path):
-    db_path = tmp_path / 'test.db'
-    upload_path = tmp_path / 'uploads'
-    credentials_path = tmp_path / 'google_credentials.json'
-    token_path = tmp_path / 'google_token.json'
-
-    app = create_app(
-        {
-            'TESTING': True,
-            'DATABASE': str(db_path),
-            'UPLOAD_FOLDER': str(upload_path),
-            'GOOGLE_CALENDAR_CREDENTIALS_FILE': str(credentials_path),
-            'GOOGLE_CALENDAR_TOKEN_FILE': str(token_path),
-        }
-    )
+# Una sola iterazione PBKDF2: gli utenti di test non hanno bisogno di hash
+# robusti e ogni login dei test ne verifica uno.
+_ADMIN_PASSWORD_HASH = generate_password_hash('adminpass', method='pbkdf2:sha256:1')
+_USER_PASSWORD_HASH = generate_password_hash('userpass', method='pbkdf2:sha256:1')
+
+
+def _test_config(tmp_path: Path, db_path: Path) -> dict:
+    return {
+        'TESTING': True,
+        'DATABASE': str(db_path),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'JINJA_BYTECODE_CACHE_DIR': str(tmp_path / 'jinja_cache'),
+        'GOOGLE_CALENDAR_CREDENTIALS_FILE': str(tmp_path / 'google_credentials.json'),
+        'GOOGLE_CALENDAR_TOKEN_FILE': str(tmp_path / 'google_token.json'),
+    }
+
+
+@pytest.fixture(scope='session')
+def template_db(tmp_path_factory):
+    """Database inizializzato (schema e utenti) una sola volta per sessione.
+
+    Ogni test ne riceve una copia: schema e hash delle password non vengono
+    ricalcolati a ogni test.
+    """
+
+    tmp_path = tmp_path_factory.mktemp('template')
+    db_path = tmp_path / 'template.db'
+    app = create_app(_test_config(tmp_path, db_path))
 
     # Assicura che il database di test sia inizializzato e contenga un admin
     with app.app_context():
@@ -37,14 +50,24 @@ def app(tmp_path):
         db = get_db()
         db.execute(
             'INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
-            ('admin', generate_password_hash('adminpass'), 'admin'),
+            ('admin', _ADMIN_PASSWORD_HASH, 'admin'),
         )
         db.execute(
             'INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
-            ('user', generate_password_hash('userpass'), 'user'),
+            ('user', _USER_PASSWORD_HASH, 'user'),
         )
         db.commit()
 
+    # Chiudendo le connessioni il WAL viene riportato nel file principale.
+    app.extensions['db_pool'].close()
+    return db_path
+
+
+@pytest.fixture
+def app(tmp_path, template_db):
+    db_path = tmp_path / 'test.db'
+    shutil.copyfile(template_db, db_path)
+    app = create_app(_test_config(tmp_path, db_path))
     yield app
 
 
@@ -0,0 +1,395 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+
+import pytest
+import requests
+from flask import g
+
+from app import DEFAULT_AI_SYSTEM_PROMPT, _resolve_ai_system_prompt
+from database import get_db
+from services.ai_concurrency import SingleFlight
+from services.ai_suggestion_cache import SQLiteSuggestionCache
+
+
+class _FakeResponse:
+    def __init__(self, payload, status_code: int = 200):
+        self._payload = payload
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code} error')
+
+    @property
+    def content(self):
+        return json.dumps(self._payload).encode('utf-8')
+
+    def iter_lines(self, decode_unicode=False):
+        yield from self._payload
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_ai_post(app, monkeypatch):
+    calls = []
+    responses = []
+
+    def _post(url, **kwargs):
+        calls.append({'url': url, **kwargs})
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(app.extensions['ai_http'], 'post', _post)
+    return calls, responses
+
+
+def _suggest(client, **payload):
+    data = {'target': 'issue_description', 'subject': 'Lavatrice che non centrifuga', **payload}
+    return client.post('/ai/suggest', json=data)
+
+
+def test_ai_suggest_openai_returns_suggestion(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_PROVIDER='openai', AI_SUGGESTION_TOKEN='sk-test')
+    responses.append(
+        _FakeResponse({'choices': [{'message': {'content': ' Controllare la pompa. '}}]})
+    )
+
+    login('user', 'userpass')
+    response = _suggest(client, product='AEG L6', issue_description='Non scarica')
+
+    assert response.status_code == 200
+    assert response.get_json() == {'suggestion': 'Controllare la pompa.', 'from_cache': False}
+    assert calls[0]['url'] == 'https://api.openai.com/v1/chat/completions'
+    assert calls[0]['headers']['Authorization'] == 'Bearer sk-test'
+    assert calls[0]['timeout'] == (5, 15)
+    messages = calls[0]['json']['messages']
+    assert messages[0]['role'] == 'system'
+    assert 'Prodotto: AEG L6' in messages[1]['content']
+    assert 'Problema segnalato: Non scarica' in messages[1]['content']
+
+
+def test_ai_system_prompt_is_identical_across_tickets(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_PROVIDER='openai', AI_SUGGESTION_TOKEN='sk-test')
+    for _ in range(2):
+        responses.append(_FakeResponse({'choices': [{'message': {'content': 'Ok'}}]}))
+
+    login('user', 'userpass')
+    _suggest(client, product='AEG L6', issue_description='Non scarica')
+    _suggest(client, subject='Forno', description='Non scalda il ripiano inferiore')
+
+    first, second = (call['json']['messages'] for call in calls)
+    assert first[0] == second[0]
+    assert 'AEG L6' not in first[0]['content']
+    assert 'Forno' in second[1]['content']
+
+
+def test_ai_suggest_deepseek_uses_configured_endpoint(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(
+        AI_SUGGESTION_PROVIDER='deepseek',
+        AI_SUGGESTION_TOKEN='sk-test',
+        AI_SUGGESTION_DEEPSEEK_ENDPOINT='https://deepseek.example.com/chat',
+    )
+    responses.append(_FakeResponse({'error': {'message': ''}}))
+
+    login('user', 'userpass')
+    response = _suggest(client)
+
+    assert response.status_code == 502
+    assert response.get_json() == {'error': 'Errore dal servizio DeepSeek.'}
+    assert calls[0]['url'] == 'https://deepseek.example.com/chat'
+    assert calls[0]['json']['model'] == 'deepseek-chat'
+
+
+def test_ai_suggest_generic_endpoint(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_ENDPOINT='https://ai.example.com/suggest')
+    responses.append(_FakeResponse({'suggestion': 'Verificare i driver.'}))
+
+    login('user', 'userpass')
+    response = _suggest(client, description='Schermo nero')
+
+    assert response.get_json() == {'suggestion': 'Verificare i driver.', 'from_cache': False}
+    assert calls[0]['json']['requested_by'] == 'user'
+    assert calls[0]['json']['description'] == 'Schermo nero'
+
+
+def test_ai_suggest_reports_upstream_errors(app, client, login, fake_ai_post):
+    _calls, responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_PROVIDER='deepseek', AI_SUGGESTION_TOKEN='sk-test')
+    responses.append(requests.exceptions.Timeout())
+    responses.append(_FakeResponse({'error': {'message': 'quota esaurita'}}))
+
+    login('user', 'userpass')
+    response = _suggest(client)
+    assert response.status_code == 504
+
+    response = _suggest(client)
+    assert response.status_code == 502
+    assert response.get_json() == {'error': 'quota esaurita'}
+
+
+def test_ai_suggest_rejects_short_input_without_calling_provider(app, client, login, fake_ai_post):
+    calls, _responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_ENDPOINT='https://ai.example.com/suggest')
+
+    login('user', 'userpass')
+    response = client.post('/ai/suggest', json={'target': 'issue_description', 'subject': 'Forno'})
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Fornire più dettagli prima di richiedere un suggerimento.'}
+    assert calls == []
+
+
+def test_ai_suggest_requires_configuration(client, login):
+    login('user', 'userpass')
+    response = _suggest(client)
+    assert response.status_code == 503
+
+
+def test_ai_suggest_batch_returns_indexed_results(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(
+        AI_SUGGESTION_ENDPOINT='https://ai.example.com/suggest',
+        AI_SUGGESTION_BATCH_LIMIT=3,
+    )
+    responses.append(_FakeResponse({'suggestion': 'Prima'}))
+    responses.append(_FakeResponse({}))
+
+    login('user', 'userpass')
+    response = client.post(
+        '/ai/suggest',
+        json={
+            'target': 'issue_description',
+            'batch': [{'subject': 'Forno che non scalda'}, {}, {'product': 'Frigo che non raffredda'}],
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'results': [
+            {'index': 0, 'text': 'Prima', 'from_cache': False},
+            {'index': 1, 'error': 'Fornire almeno un dettaglio per generare un suggerimento.'},
+            {'index': 2, 'error': 'Nessun suggerimento disponibile dal servizio AI.'},
+        ]
+    }
+    assert [call['json']['subject'] for call in calls] == ['Forno che non scalda', '']
+
+    response = client.post(
+        '/ai/suggest',
+        json={'target': 'issue_description', 'batch': [{'subject': 'x'}] * 4},
+    )
+    assert response.status_code == 400
+
+
+def test_ai_suggest_reuses_cached_suggestions(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_ENDPOINT='https://ai.example.com/suggest')
+    responses.append(_FakeResponse({'suggestion': 'Sostituire la resistenza.'}))
+    responses.append(_FakeResponse({'suggestion': 'Controllare il termostato.'}))
+
+    login('user', 'userpass')
+    first = _suggest(client, product='Forno')
+    second = _suggest(client, product='Forno')
+
+    assert first.get_json() == {'suggestion': 'Sostituire la resistenza.', 'from_cache': False}
+    assert second.get_json() == {'suggestion': 'Sostituire la resistenza.', 'from_cache': True}
+    assert len(calls) == 1
+
+    refreshed = client.post(
+        '/ai/suggest?no_cache=1',
+        json={'target': 'issue_description', 'subject': 'Lavatrice che non centrifuga', 'product': 'Forno'},
+    )
+    assert refreshed.get_json() == {'suggestion': 'Controllare il termostato.', 'from_cache': False}
+    assert len(calls) == 2
+    assert _suggest(client, product='Forno').get_json()['suggestion'] == 'Controllare il termostato.'
+
+
+def test_ai_suggestion_cache_is_stored_in_database(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_ENDPOINT='https://ai.example.com/suggest')
+    responses.append(_FakeResponse({'suggestion': 'Pulire il filtro.'}))
+
+    login('user', 'userpass')
+    _suggest(client, product='Lavastoviglie')
+
+    with app.app_context():
+        rows = get_db().execute('SELECT suggestion FROM ai_suggestion_cache').fetchall()
+    assert [row['suggestion'] for row in rows] == ['Pulire il filtro.']
+
+    # Un nuovo worker (nuova cache in memoria) riusa il valore salvato.
+    app.extensions['ai_cache'] = SQLiteSuggestionCache(ttl=3600)
+    assert _suggest(client, product='Lavastoviglie').get_json()['from_cache'] is True
+    assert len(calls) == 1
+
+
+def test_ai_suggest_streams_provider_deltas(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_PROVIDER='openai', AI_SUGGESTION_TOKEN='sk-test')
+    responses.append(
+        _FakeResponse(
+            [
+                'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+                '',
+                'data: {"choices": [{"delta": {"content": "Verificare "}}]}',
+                'data: {"choices": [{"delta": {"content": "la pompa."}}]}',
+                'data: [DONE]',
+            ]
+        )
+    )
+
+    login('user', 'userpass')
+    response = client.post(
+        '/ai/suggest',
+        json={'target': 'issue_description', 'product': 'Lavatrice che perde acqua'},
+        headers={'Accept': 'text/event-stream'},
+    )
+
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert body.split('\n\n')[:3] == [
+        'data: {"delta": "Verificare "}',
+        'data: {"delta": "la pompa."}',
+        'event: done\ndata: {"suggestion": "Verificare la pompa."}',
+    ]
+    assert calls[0]['json']['stream'] is True
+    assert calls[0]['stream'] is True
+
+    cached = client.post(
+        '/ai/suggest',
+        json={'target': 'issue_description', 'product': 'Lavatrice che perde acqua'},
+        headers={'Accept': 'text/event-stream'},
+    )
+    assert cached.get_json() == {'suggestion': 'Verificare la pompa.', 'from_cache': True}
+    assert len(calls) == 1
+
+
+def test_ai_suggest_stream_holds_slot_and_shares_identical_requests(app, client, login, fake_ai_post):
+    calls, responses = fake_ai_post
+    app.config.update(AI_SUGGESTION_PROVIDER='openai', AI_SUGGESTION_TOKEN='sk-test')
+    responses.append(
+        _FakeResponse(
+            [
+                'data: {"choices": [{"delta": {"content": "Verificare la pompa."}}]}',
+                'data: [DONE]',
+            ]
+        )
+    )
+    payload = {'target': 'issue_description', 'product': 'Lavatrice che perde acqua'}
+    semaphore = app.extensions['ai_inflight']._semaphore
+
+    login('user', 'userpass')
+    follower_client = app.test_client()
+    follower_client.post('/auth/login', data={'username': 'user', 'password': 'userpass'})
+    leader = client.post('/ai/suggest', json=payload, headers={'Accept': 'text/event-stream'})
+    # Lo slot del leader resta occupato per tutto l'inoltro dello stream.
+    assert semaphore._value == app.extensions['ai_inflight'].max_concurrency - 1
+    results = []
+    follower = threading.Thread(
+        target=lambda: results.append(
+            follower_client.post('/ai/suggest', json=payload, headers={'Accept': 'text/event-stream'})
+        )
+    )
+    follower.start()
+    follower.join(timeout=0.2)
+    assert follower.is_alive()
+
+    assert 'event: done' in leader.get_data(as_text=True)
+    follower.join(timeout=5)
+
+    assert results[0].get_json() == {'suggestion': 'Verificare la pompa.', 'from_cache': False}
+    assert len(calls) == 1
+    assert semaphore._value == app.extensions['ai_inflight'].max_concurrency
+
+
+def test_ai_suggest_follower_waits_for_retrying_leader(app, client, login, monkeypatch):
+    # Un singolo tentativo scade in 0,1 s: il leader ne consuma tre prima di
+    # rispondere, come farebbe l'adapter ripetendo la chiamata.
+    app.config.update(
+        AI_SUGGESTION_PROVIDER='openai',
+        AI_SUGGESTION_TOKEN='sk-test',
+        AI_SUGGESTION_TIMEOUT=0.05,
+    )
+    started = threading.Event()
+    calls = []
+
+    def _post(url, **kwargs):
+        calls.append(url)
+        started.set()
+        time.sleep(0.3)
+        return _FakeResponse({'choices': [{'message': {'content': 'Controllare la pompa.'}}]})
+
+    monkeypatch.setattr(app.extensions['ai_http'], 'post', _post)
+
+    login('user', 'userpass')
+    follower_client = app.test_client()
+    follower_client.post('/auth/login', data={'username': 'user', 'password': 'userpass'})
+    results = []
+    leader = threading.Thread(target=lambda: results.append(_suggest(client, product='AEG L6')))
+    leader.start()
+    started.wait(timeout=5)
+    follower = _suggest(follower_client, product='AEG L6')
+    leader.join(timeout=5)
+
+    assert follower.status_code == 200
+    assert follower.get_json() == {'suggestion': 'Controllare la pompa.', 'from_cache': False}
+    assert results[0].status_code == 200
+    assert len(calls) == 1
+
+
+def test_single_flight_shares_identical_inflight_calls():
+    flight = SingleFlight(max_concurrency=2)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def _slow_call():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return 'Verificare la pompa.'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.run('k', _slow_call, timeout=5)))
+    leader.start()
+    started.wait(timeout=5)
+    follower = threading.Thread(target=lambda: results.append(flight.run('k', _slow_call, timeout=5)))
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [('Verificare la pompa.', False), ('Verificare la pompa.', True)]
+
+
+def test_ai_suggest_releases_db_connection_during_provider_call(app, client, login, monkeypatch):
+    app.config.update(AI_SUGGESTION_PROVIDER='openai', AI_SUGGESTION_TOKEN='sk-test')
+    held = []
+
+    def _post(url, **kwargs):
+        held.append('db' in g)
+        return _FakeResponse({'choices': [{'message': {'content': 'Controllare la pompa.'}}]})
+
+    monkeypatch.setattr(app.extensions['ai_http'], 'post', _post)
+
+    login('user', 'userpass')
+    response = _suggest(client, product='AEG L6')
+
+    assert response.status_code == 200
+    assert held == [False]
+
+
+def test_configured_system_prompt_is_used_verbatim():
+    assert _resolve_ai_system_prompt('  Prompt personalizzato\n') == '  Prompt personalizzato\n'
+    assert _resolve_ai_system_prompt('') == DEFAULT_AI_SYSTEM_PROMPT
+    assert _resolve_ai_system_prompt(None) == DEFAULT_AI_SYSTEM_PROMPT
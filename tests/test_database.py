@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import pytest
+
+import app as app_module
+import database
+from database import SCHEMA_VERSION, get_db, init_db
+from services.customer_codes import MAX_CUSTOMER_CODES, customer_code_to_int, int_to_customer_code
+
+
+def test_connections_are_reused_across_app_contexts(app):
+    with app.app_context():
+        first = get_db()
+        first.execute('INSERT INTO customers (name, code) VALUES (?, ?)', ('Da annullare', 'zzzz'))
+
+    with app.app_context():
+        second = get_db()
+        assert second is first
+        assert not second.in_transaction
+        count = second.execute("SELECT COUNT(*) FROM customers WHERE code = 'zzzz'").fetchone()[0]
+        assert count == 0
+
+
+def test_init_db_is_skipped_once_schema_is_current(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+        db.execute('DROP INDEX idx_inventory_items_name')
+        db.commit()
+
+        init_db()
+        index = db.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'idx_inventory_items_name'"
+        ).fetchone()
+        assert index is None
+
+
+def test_init_db_skips_inventory_fts_on_old_sqlite(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'INVENTORY_FTS_SUPPORTED', False)
+    monkeypatch.setattr(app_module, 'INVENTORY_FTS_SUPPORTED', False)
+    db = database.connect(str(tmp_path / 'old.db'))
+
+    init_db(db)
+    db.execute("INSERT INTO inventory_items (code, name) VALUES ('X1', 'Pompa scarico')")
+
+    fts_objects = db.execute("SELECT name FROM sqlite_master WHERE name LIKE '%fts%'").fetchall()
+    assert fts_objects == []
+    assert app_module._inventory_fts_query('pompa') is None
+    db.close()
+
+
+def test_customer_codes_round_trip():
+    assert int_to_customer_code(0) == 'aaaa'
+    assert int_to_customer_code(27) == 'aabb'
+    assert int_to_customer_code(MAX_CUSTOMER_CODES - 1) == 'zzzz'
+    for value in (0, 1, 25, 26, 675, 676, 17576, MAX_CUSTOMER_CODES - 1):
+        assert customer_code_to_int(int_to_customer_code(value)) == value
+    assert customer_code_to_int(' AABB ') == 27
+
+    for invalid in ('aaa', 'aa1a', 'abcde'):
+        with pytest.raises(ValueError):
+            customer_code_to_int(invalid)
+    with pytest.raises(ValueError):
+        int_to_customer_code(MAX_CUSTOMER_CODES)
@@ -0,0 +1,447 @@
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from auth.google_calendar import GoogleCalendarOAuth
+from database import get_db
+from services import calendar_sync, calendar_sync_scheduler, google_calendar_client
+from services.calendar_sync import (
+    load_calendar_settings_from_env,
+    resolve_calendar_settings,
+    run_calendar_sync,
+    to_rfc3339,
+)
+from services.calendar_sync_scheduler import CalendarSyncScheduler, is_reloader_watcher
+from services.customer_sync import Customer, CustomerSyncService
+from services.google_calendar_client import CalendarCustomerCandidate
+
+
+def _write_token(path, refresh_token: str, mtime_ns: int) -> None:
+    path.write_text(
+        json.dumps(
+            {
+                'client_id': 'client-id',
+                'client_secret': 'client-secret',
+                'refresh_token': refresh_token,
+            }
+        ),
+        encoding='utf-8',
+    )
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_saved_credentials_are_reloaded_when_token_changes(tmp_path):
+    token_path = tmp_path / 'token.json'
+    oauth = GoogleCalendarOAuth(tmp_path / 'credentials.json', token_path, allow_interactive=False)
+    assert oauth.load_saved_credentials() is None
+
+    _write_token(token_path, 'primo', 1_000_000_000)
+    first = oauth.load_saved_credentials()
+    second = oauth.load_saved_credentials()
+    assert first.refresh_token == second.refresh_token == 'primo'
+    assert first is not second
+
+    _write_token(token_path, 'secondo', 2_000_000_000)
+    assert oauth.load_saved_credentials().refresh_token == 'secondo'
+
+
+def test_calendar_settings_follow_config_changes(app):
+    settings = resolve_calendar_settings(app)
+    assert settings['calendar_id'] == 'primary'
+    assert resolve_calendar_settings(app) == settings
+
+    app.config['GOOGLE_CALENDAR_ID'] = 'officina'
+    assert resolve_calendar_settings(app)['calendar_id'] == 'officina'
+
+
+def test_scheduler_lease_allows_one_process_per_interval(app, monkeypatch):
+    first = CalendarSyncScheduler(app, interval_seconds=600)
+    second = CalendarSyncScheduler(app, interval_seconds=600)
+
+    with app.app_context():
+        db = get_db()
+        monkeypatch.setattr(calendar_sync_scheduler.time, 'time', lambda: 10_000)
+        assert first._acquire_lease(db)
+        assert not second._acquire_lease(db)
+
+        monkeypatch.setattr(calendar_sync_scheduler.time, 'time', lambda: 10_600)
+        assert second._acquire_lease(db)
+        assert not first._acquire_lease(db)
+
+
+def test_customer_sync_batches_new_and_existing_customers(app):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO customers (code, name, email, phone) VALUES ('aaaa', 'Rossi', 'rossi@example.com', NULL)"
+        )
+        db.commit()
+
+        stats = CustomerSyncService(db).sync_customers(
+            [
+                Customer(name='Mario Rossi', email='ROSSI@example.com'),
+                Customer(name='Bianchi', phone='123'),
+                Customer(name='Bianchi', phone='123', address='Via Roma 1'),
+                Customer(name='Verdi'),
+                Customer(name='verdi'),
+            ]
+        )
+
+        assert stats == {'total': 5, 'created': 2, 'updated': 3, 'skipped': 0}
+        rows = db.execute('SELECT code, name, email, phone, address FROM customers ORDER BY code').fetchall()
+        assert [tuple(row) for row in rows] == [
+            ('aaaa', 'Mario Rossi', 'ROSSI@example.com', None, None),
+            ('aaab', 'Bianchi', None, '123', 'Via Roma 1'),
+            ('aaac', 'verdi', None, None, None),
+        ]
+
+
+def test_calendar_sync_streams_event_pages(app, monkeypatch):
+    pages = {
+        None: {'items': [{'id': '1', 'summary': 'Rossi'}, {'id': '2'}], 'nextPageToken': 'p2'},
+        'p2': {'items': [{'id': '3', 'summary': 'Bianchi'}, {'id': '4', 'summary': 'Verdi'}]},
+    }
+    requested = []
+
+    class _Events:
+        def list(self, **kwargs):
+            requested.append(kwargs.get('pageToken'))
+            return type('Request', (), {'execute': lambda _self: pages[kwargs.get('pageToken')]})()
+
+    class _Service:
+        def events(self):
+            return _Events()
+
+    class _OAuth:
+        def authorize(self):
+            return None
+
+    monkeypatch.setattr(google_calendar_client, 'build', lambda *args, **kwargs: _Service())
+    monkeypatch.setattr(calendar_sync, 'SYNC_BATCH_SIZE', 2)
+
+    with app.app_context():
+        stats, details = run_calendar_sync(db=get_db(), oauth=_OAuth(), calendar_id='primary')
+        names = [row['name'] for row in get_db().execute('SELECT name FROM customers ORDER BY code')]
+
+    assert requested == [None, 'p2']
+    assert details['events_count'] == 4
+    assert details['candidates_count'] == 3
+    assert stats == {'total': 3, 'created': 3, 'updated': 0, 'skipped': 0}
+    assert names == ['Rossi', 'Bianchi', 'Verdi']
+
+
+def test_scheduler_skips_reloader_watcher_process(app, monkeypatch):
+    monkeypatch.delenv('WERKZEUG_RUN_MAIN', raising=False)
+    assert not is_reloader_watcher(app)
+
+    app.debug = True
+    assert is_reloader_watcher(app)
+
+    monkeypatch.setenv('WERKZEUG_RUN_MAIN', 'true')
+    assert not is_reloader_watcher(app)
+
+
+def test_cli_settings_are_read_without_flask_app(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOOGLE_CALENDAR_TOKEN_FILE', str(tmp_path / 'token.json'))
+    monkeypatch.setenv('GOOGLE_CALENDAR_ID', 'officina')
+    monkeypatch.delenv('GOOGLE_CALENDAR_SCOPES', raising=False)
+
+    settings = load_calendar_settings_from_env()
+
+    assert settings['token_path'] == tmp_path / 'token.json'
+    assert settings['calendar_id'] == 'officina'
+    assert settings['scopes'] == ('https://www.googleapis.com/auth/calendar.readonly',)
+    assert settings['database'].endswith('database.db')
+
+
+def test_to_rfc3339_formats_utc_with_z_suffix():
+    rome = timezone(timedelta(hours=2))
+
+    assert to_rfc3339(datetime(2024, 5, 1, 10, 30, 15, 123456)) == '2024-05-01T10:30:15Z'
+    assert to_rfc3339(datetime(2024, 5, 1, 12, 30, 15, tzinfo=rome)) == '2024-05-01T10:30:15Z'
+
+
+def test_scheduled_sync_reuses_calendar_sync_token(app, monkeypatch):
+    requests = []
+    responses = {
+        None: {'items': [{'id': '1', 'summary': 'Rossi'}], 'nextSyncToken': 'tok1'},
+        'tok1': {'items': [{'id': '1', 'status': 'cancelled'}], 'nextSyncToken': 'tok2'},
+    }
+
+    class _Events:
+        def list(self, **kwargs):
+            requests.append(kwargs)
+            token = kwargs.get('syncToken')
+            if token == 'scaduto':
+                error = HttpError(httplib2.Response({'status': 410}), b'gone')
+                return type('Request', (), {'execute': lambda _self: (_ for _ in ()).throw(error)})()
+            return type('Request', (), {'execute': lambda _self: responses[token]})()
+
+    class _Service:
+        def events(self):
+            return _Events()
+
+    class _OAuth:
+        def authorize(self):
+            return None
+
+    monkeypatch.setattr(google_calendar_client, 'build', lambda *args, **kwargs: _Service())
+
+    def _stored_token(db):
+        return db.execute('SELECT sync_token FROM calendar_sync_state').fetchone()[0]
+
+    with app.app_context():
+        db = get_db()
+        stats, details = run_calendar_sync(db=db, oauth=_OAuth(), calendar_id='primary', incremental=True)
+        assert stats['created'] == 1 and not details['incremental']
+        assert 'timeMin' in requests[-1] and 'orderBy' not in requests[-1]
+        assert _stored_token(db) == 'tok1'
+
+        stats, details = run_calendar_sync(db=db, oauth=_OAuth(), calendar_id='primary', incremental=True)
+        assert details['incremental'] and details['events_count'] == 1
+        assert stats['total'] == 0
+        assert requests[-1]['syncToken'] == 'tok1' and 'timeMin' not in requests[-1]
+        assert _stored_token(db) == 'tok2'
+
+        db.execute("UPDATE calendar_sync_state SET sync_token = 'scaduto'")
+        db.commit()
+        stats, details = run_calendar_sync(db=db, oauth=_OAuth(), calendar_id='primary', incremental=True)
+        assert not details['incremental'] and stats['skipped'] == 1
+        assert _stored_token(db) == 'tok1'
+
+
+def test_capped_incremental_sync_follows_pages_to_new_token(app, monkeypatch, caplog):
+    requests = []
+    responses = {
+        (None, None): {'items': [{'id': '1', 'summary': 'Rossi'}], 'nextPageToken': 'p2'},
+        (None, 'p2'): {'items': [{'id': '2', 'summary': 'Bianchi'}], 'nextSyncToken': 'tok1'},
+        ('tok1', None): {'items': [{'id': '3', 'summary': 'Verdi'}], 'nextPageToken': 'p2'},
+        ('tok1', 'p2'): {'items': [{'id': '4', 'summary': 'Neri'}], 'nextSyncToken': 'tok2'},
+    }
+
+    class _Events:
+        def list(self, **kwargs):
+            requests.append(kwargs)
+            token = kwargs.get('syncToken')
+            if token == 'scaduto':
+                error = HttpError(httplib2.Response({'status': 410}), b'gone')
+                return type('Request', (), {'execute': lambda _self: (_ for _ in ()).throw(error)})()
+            response = responses[token, kwargs.get('pageToken')]
+            return type('Request', (), {'execute': lambda _self: response})()
+
+    class _Service:
+        def events(self):
+            return _Events()
+
+    class _OAuth:
+        def authorize(self):
+            return None
+
+    monkeypatch.setattr(google_calendar_client, 'build', lambda *args, **kwargs: _Service())
+
+    def _stored_tokens(db):
+        return [row[0] for row in db.execute('SELECT sync_token FROM calendar_sync_state')]
+
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            'INSERT INTO calendar_sync_state (calendar_id, sync_token, full_sync_at) '
+            "VALUES ('primary', 'tok1', CURRENT_TIMESTAMP)"
+        )
+        db.commit()
+
+        # La lettura incrementale non si ferma a max_results: il nuovo token
+        # arriva solo con l'ultima pagina.
+        stats, details = run_calendar_sync(
+            db=db, oauth=_OAuth(), calendar_id='primary', incremental=True, max_results=1
+        )
+        assert details['incremental'] and details['events_count'] == 2
+        assert stats['created'] == 2
+        assert requests[-1]['pageToken'] == 'p2' and requests[-1]['syncToken'] == 'tok1'
+        assert _stored_tokens(db) == ['tok2']
+
+        # Una lettura completa troncata non produce token: quello scaduto
+        # viene rimosso invece di essere riproposto a ogni esecuzione.
+        db.execute("UPDATE calendar_sync_state SET sync_token = 'scaduto'")
+        db.commit()
+        stats, details = run_calendar_sync(
+            db=db, oauth=_OAuth(), calendar_id='primary', incremental=True, max_results=1
+        )
+        assert not details['incremental'] and details['events_count'] == 1
+        assert _stored_tokens(db) == []
+        assert 'Nessun syncToken per il calendario primary' in caplog.text
+
+
+def test_incremental_sync_keeps_the_date_window(app, monkeypatch):
+    now = datetime.now(timezone.utc)
+
+    def _event(event_id, name, days):
+        day = (now + timedelta(days=days)).strftime('%Y-%m-%d')
+        return {'id': event_id, 'summary': name, 'start': {'date': day}, 'end': {'date': day}}
+
+    requests = []
+    responses = {
+        None: {'items': [], 'nextSyncToken': 'tok1'},
+        # Modifiche a eventi lontani nel passato e nel futuro: fuori finestra.
+        'tok1': {
+            'items': [_event('1', 'Rossi', -400), _event('2', 'Bianchi', 400), _event('3', 'Verdi', 1)],
+            'nextSyncToken': 'tok2',
+        },
+    }
+
+    class _Events:
+        def list(self, **kwargs):
+            requests.append(kwargs)
+            response = responses[kwargs.get('syncToken')]
+            return type('Request', (), {'execute': lambda _self: response})()
+
+    class _Service:
+        def events(self):
+            return _Events()
+
+    class _OAuth:
+        def authorize(self):
+            return None
+
+    monkeypatch.setattr(google_calendar_client, 'build', lambda *args, **kwargs: _Service())
+
+    with app.app_context():
+        db = get_db()
+        run_calendar_sync(db=db, oauth=_OAuth(), calendar_id='primary', incremental=True)
+        stats, details = run_calendar_sync(db=db, oauth=_OAuth(), calendar_id='primary', incremental=True)
+        assert details['incremental'] and details['events_count'] == 1
+        assert [row['name'] for row in db.execute('SELECT name FROM customers')] == ['Verdi']
+
+        # Un evento mai modificato che entra nella finestra arriva con la
+        # lettura completa che sostituisce il token ormai vecchio.
+        responses[None] = {'items': [_event('4', 'Neri', 2)], 'nextSyncToken': 'tok3'}
+        db.execute("UPDATE calendar_sync_state SET full_sync_at = datetime('now', '-2 days')")
+        db.commit()
+        stats, details = run_calendar_sync(db=db, oauth=_OAuth(), calendar_id='primary', incremental=True)
+        assert not details['incremental'] and stats['created'] == 1
+        assert 'timeMin' in requests[-1] and 'syncToken' not in requests[-1]
+        row = db.execute(
+            "SELECT sync_token, full_sync_at > datetime('now', '-1 hour') AS fresh FROM calendar_sync_state"
+        ).fetchone()
+        assert tuple(row) == ('tok3', 1)
+
+
+def test_description_fields_are_parsed_in_one_pass():
+    parsed = google_calendar_client.GoogleCalendarClient._parse_description(
+        'Lavatrice\nTel - 333 1234\nEMAIL: rossi@example.com\nIndirizzo = Via Roma 1\ntelefono: 999'
+    )
+
+    assert parsed == {'email': 'rossi@example.com', 'phone': '333 1234', 'address': 'Via Roma 1'}
+
+
+def test_description_fields_on_the_same_line_are_split():
+    parsed = google_calendar_client.GoogleCalendarClient._parse_description(
+        'Email: a@b.it Tel: 333 123 indirizzo = Via Roma 1'
+    )
+
+    assert parsed == {'email': 'a@b.it', 'phone': '333 123', 'address': 'Via Roma 1'}
+
+
+def test_scheduler_reuses_calendar_client_and_service(app, monkeypatch, tmp_path):
+    built = []
+
+    class _Credentials:
+        valid = True
+
+    class _Events:
+        def list(self, **kwargs):
+            return type('Request', (), {'execute': lambda _self: {'items': []}})()
+
+    class _Service:
+        def events(self):
+            return _Events()
+
+    def _build(*args, **kwargs):
+        built.append(kwargs['credentials'])
+        return _Service()
+
+    monkeypatch.setattr(google_calendar_client, 'build', _build)
+    monkeypatch.setattr(GoogleCalendarOAuth, 'authorize', lambda self, **kwargs: _Credentials())
+    (tmp_path / 'google_credentials.json').write_text('{}', encoding='utf-8')
+
+    scheduler = CalendarSyncScheduler(app, interval_seconds=600)
+    monkeypatch.setattr(calendar_sync_scheduler.time, 'time', lambda: 10_000)
+    scheduler._execute_sync()
+    client = scheduler._client
+    monkeypatch.setattr(calendar_sync_scheduler.time, 'time', lambda: 10_600)
+    scheduler._execute_sync()
+
+    assert scheduler._client is client
+    assert len(built) == 1
+
+
+def test_customer_sync_rolls_back_on_error(app, monkeypatch):
+    with app.app_context():
+        db = get_db()
+        service = CustomerSyncService(db)
+
+        def _fail(customers):
+            db.execute("INSERT INTO customers (code, name) VALUES ('zzzz', 'Parziale')")
+            raise RuntimeError('errore')
+
+        monkeypatch.setattr(service, '_prefetch_existing', _fail)
+        try:
+            service.sync_customers([Customer(name='Rossi')])
+        except RuntimeError:
+            pass
+
+        assert not db.in_transaction
+        assert db.execute('SELECT COUNT(*) FROM customers').fetchone()[0] == 0
+
+
+def test_description_without_field_keywords_skips_parsing():
+    parse = google_calendar_client.GoogleCalendarClient._parse_description
+
+    assert parse('Sostituzione pompa di scarico, cliente richiamerà') == {}
+    assert parse('TELEFONO: 0212345') == {'phone': '0212345'}
+
+
+def test_sync_candidates_merges_repeated_events(app):
+    def _candidate(name, address, event_id):
+        return CalendarCustomerCandidate(
+            name=name, email='rossi@example.com', phone=None, address=address, notes=None, event_id=event_id
+        )
+
+    with app.app_context():
+        db = get_db()
+        stats = CustomerSyncService(db).sync_candidates(
+            [_candidate('Rossi', 'Via Roma 1', '1'), _candidate('ROSSI', 'Via Milano 2', '2')]
+        )
+
+        assert stats == {'total': 1, 'created': 1, 'updated': 0, 'skipped': 0}
+        row = db.execute('SELECT name, address FROM customers').fetchone()
+        assert tuple(row) == ('ROSSI', 'Via Milano 2')
+
+
+def test_event_to_candidate_normalizes_fields():
+    client = google_calendar_client.GoogleCalendarClient(None)
+    candidate = client._event_to_candidate(
+        {
+            'id': 'evt',
+            'summary': '  ',
+            'location': ' Via Roma 1 ',
+            'description': 'Tel: 333 1234 ',
+            'attendees': [
+                {'resource': True, 'email': 'sala@example.com'},
+                {'email': ' rossi@example.com ', 'displayName': ' Mario Rossi '},
+            ],
+        }
+    )
+
+    assert (candidate.name, candidate.email, candidate.phone, candidate.address) == (
+        'Mario Rossi',
+        'rossi@example.com',
+        '333 1234',
+        'Via Roma 1',
+    )
+    assert client._event_to_candidate({'id': 'vuoto', 'summary': ' '}) is None
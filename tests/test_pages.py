@@ -1,26 +1,147 @@
 from __future__ import annotations
 
+import io
 import json
+import re
 from pathlib import Path
+from urllib.parse import urlsplit
 
+import pytest
 from flask import Response
 from werkzeug.security import generate_password_hash
 
 from database import get_db
 
 
-def test_magazzino_requires_authentication(client):
-    response: Response = client.get('/magazzino')
-    assert response.status_code == 302
-    assert '/auth/login' in response.headers.get('Location', '')
+def _create_ticket(app, *, subject: str = 'Lavatrice', product: str | None = None) -> int:
+    with app.app_context():
+        db = get_db()
+        customer_id = db.execute(
+            'INSERT INTO customers (code, name) VALUES (?, ?)',
+            ('aaaa', 'Mario Rossi'),
+        ).lastrowid
+        ticket_id = db.execute(
+            'INSERT INTO tickets (customer_id, subject, product) VALUES (?, ?, ?)',
+            (customer_id, subject, product),
+        ).lastrowid
+        db.commit()
+    return ticket_id
+
+
+@pytest.mark.parametrize(
+    ('path', 'user', 'status', 'location', 'contents'),
+    [
+        ('/magazzino', None, 302, '/auth/login', ()),
+        ('/magazzino', ('admin', 'adminpass'), 200, None, (b'Magazzino', b'Nuovo articolo')),
+        ('/admin/calendar-sync', ('user', 'userpass'), 302, '/', ()),
+        (
+            '/admin/calendar-sync',
+            ('admin', 'adminpass'),
+            200,
+            None,
+            (b'Sincronizzazione clienti da Google Calendar',),
+        ),
+    ],
+)
+def test_route_access(client, login, path, user, status, location, contents):
+    if user is not None:
+        login(*user)
+    response: Response = client.get(path)
+    assert response.status_code == status
+    if location is not None:
+        assert urlsplit(response.headers.get('Location', '')).path == location
+    for content in contents:
+        assert content in response.data
+
+
+def test_magazzino_search_uses_full_text_index(client, app, login):
+    login('admin', 'adminpass')
 
+    html = client.get('/magazzino?q=215284').get_data(as_text=True)
+    assert '<td>00215284</td>' in html
+    assert '<td>00215223</td>' not in html
 
-def test_magazzino_available_for_admin(client, login):
-    login('admin', 'adminpass')
-    response: Response = client.get('/magazzino')
+    html = client.get('/magazzino?q=scarico+ardo').get_data(as_text=True)
+    assert '<td>00215214</td>' in html
+    assert '<td>00215299</td>' not in html
+
+    html = client.get('/magazzino?q=SG').get_data(as_text=True)
+    assert '<td>00215213</td>' in html
+
+    response = client.get('/magazzino?q=pompa"+OR')
     assert response.status_code == 200
-    assert b'Magazzino' in response.data
-    assert b'Nuovo articolo' in response.data
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE inventory_items SET name = 'Resistenza forno' WHERE code = '00215284'")
+        db.execute("DELETE FROM inventory_items WHERE code = '00215223'")
+        db.commit()
+
+    html = client.get('/magazzino?q=resistenza').get_data(as_text=True)
+    assert '<td>00215284</td>' in html
+    html = client.get('/magazzino?q=00215223').get_data(as_text=True)
+    assert '<td>00215223</td>' not in html
+
+
+def test_magazzino_summary_counts_filtered_items(client, app, login):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE inventory_items SET minimum_quantity = 3 WHERE code = 'PMP010AC'")
+        db.execute("UPDATE inventory_items SET minimum_quantity = 3 WHERE code = 'PMP006AC'")
+        db.commit()
+
+    login('admin', 'adminpass')
+    html = client.get('/magazzino?q=ASC').get_data(as_text=True)
+    assert '<strong>Quantità complessiva:</strong> 6' in html
+    assert '<strong>Articoli sotto scorta:</strong> 1' in html
+    assert html.count('badge-low-stock">Sotto scorta') == 1
+
+    html = client.get('/magazzino?q=nessun-articolo').get_data(as_text=True)
+    assert '<strong>Quantità complessiva:</strong> 0' in html
+    assert 'Articoli sotto scorta' not in html
+
+
+def test_magazzino_update_reports_missing_item(client, app, login):
+    with app.app_context():
+        item_id = get_db().execute(
+            "SELECT id FROM inventory_items WHERE code = 'PMP006AC'"
+        ).fetchone()['id']
+
+    login('admin', 'adminpass')
+    form = {'action': 'update', 'code': 'PMP006AC', 'name': 'Pompa ASC nera', 'quantity': '3'}
+    html = client.post(
+        '/magazzino', data={**form, 'item_id': str(item_id)}, follow_redirects=True
+    ).get_data(as_text=True)
+    assert 'Articolo di magazzino aggiornato correttamente.' in html
+    assert 'Pompa ASC nera' in html
+
+    html = client.post(
+        '/magazzino', data={**form, 'item_id': '999999'}, follow_redirects=True
+    ).get_data(as_text=True)
+    assert 'Articolo di magazzino non trovato.' in html
+
+
+def test_magazzino_is_paginated_with_totals_for_all_items(client, app, login):
+    app.config['INVENTORY_PAGE_SIZE'] = 2
+
+    login('admin', 'adminpass')
+    html = client.get('/magazzino?q=ASC').get_data(as_text=True)
+    assert '<strong>Articoli totali:</strong> 2' in html
+    assert 'Pagina successiva' not in html
+
+    html = client.get('/magazzino?q=ARDO').get_data(as_text=True)
+    assert '<strong>Articoli totali:</strong> 5' in html
+    assert '<strong>Quantità complessiva:</strong> 5' in html
+    assert html.count('<td>002') == 2
+    assert 'Pagina 1 di 3' in html
+    assert 'href="/magazzino?q=ARDO&amp;page=2"' in html
+
+    html = client.get('/magazzino?q=ARDO&page=3').get_data(as_text=True)
+    assert html.count('<td>002') == 1
+    assert 'Pagina precedente' in html
+
+    response = client.get('/magazzino?q=ARDO&page=9')
+    assert response.status_code == 302
 
 
 def test_navigation_shows_magazzino_and_calendar_links(client):
@@ -33,20 +154,6 @@ def test_navigation_shows_magazzino_and_calendar_links(client):
     assert 'Sync Google Calendar' in html
 
 
-def test_calendar_sync_requires_admin_role(client, login):
-    login('user', 'userpass')
-    response: Response = client.get('/admin/calendar-sync')
-    assert response.status_code == 302
-    assert response.headers.get('Location', '').endswith('/')
-
-
-def test_calendar_sync_available_for_admin(client, login):
-    login('admin', 'adminpass')
-    response: Response = client.get('/admin/calendar-sync')
-    assert response.status_code == 200
-    assert b'Sincronizzazione clienti da Google Calendar' in response.data
-
-
 def test_admin_can_upload_calendar_credentials_and_token(client, app, login):
     login('admin', 'adminpass')
 
@@ -159,3 +266,566 @@ def test_legacy_admin_role_is_normalized(client, app):
 
     calendar_response: Response = client.get('/admin/calendar-sync')
     assert calendar_response.status_code == 200
+
+
+def test_ticket_attachment_is_stored_with_uuid_name(client, app, login):
+    ticket_id = _create_ticket(app)
+
+    login('admin', 'adminpass')
+    response = client.post(
+        f'/tickets/{ticket_id}',
+        data={
+            'form_name': 'attachments',
+            'attachments': [
+                (io.BytesIO(b'foto'), 'Foto guasto.JPG'),
+                (io.BytesIO(b'dati'), 'report.tar.g$z'),
+            ],
+        },
+        content_type='multipart/form-data',
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+    with app.app_context():
+        rows = get_db().execute(
+            'SELECT original_filename, stored_filename, file_size FROM ticket_attachments '
+            'WHERE ticket_id = ? ORDER BY id',
+            (ticket_id,),
+        ).fetchall()
+
+    assert [row['original_filename'] for row in rows] == ['Foto guasto.JPG', 'report.tar.g$z']
+    assert rows[0]['stored_filename'].endswith('.jpg')
+    assert [row['file_size'] for row in rows] == [4, 4]
+    assert '.' not in rows[1]['stored_filename']
+    ticket_folder = Path(app.config['UPLOAD_FOLDER']) / str(ticket_id)
+    assert (ticket_folder / rows[0]['stored_filename']).read_bytes() == b'foto'
+    assert sorted(path.name for path in ticket_folder.iterdir()) == sorted(
+        row['stored_filename'] for row in rows
+    )
+
+
+def test_ticket_update_records_history_for_changed_fields(client, app, login):
+    ticket_id = _create_ticket(app, product='Lavatrice AEG')
+
+    login('admin', 'adminpass')
+    response = client.post(
+        f'/tickets/{ticket_id}',
+        data={
+            'status': 'in_progress',
+            'product': 'Lavatrice AEG',
+            'issue_description': 'Non scarica',
+            'repair_status': 'accettazione',
+        },
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    assert 'Ticket aggiornato con successo.' in response.get_data(as_text=True)
+
+    with app.app_context():
+        db = get_db()
+        ticket = db.execute(
+            'SELECT status, issue_description FROM tickets WHERE id = ?',
+            (ticket_id,),
+        ).fetchone()
+        history = db.execute(
+            'SELECT field, old_value, new_value FROM ticket_history '
+            'WHERE ticket_id = ? ORDER BY field',
+            (ticket_id,),
+        ).fetchall()
+
+    assert ticket['status'] == 'in_progress'
+    assert ticket['issue_description'] == 'Non scarica'
+    assert [tuple(row) for row in history] == [
+        ('issue_description', None, 'Non scarica'),
+        ('status', 'Aperto', 'In lavorazione'),
+    ]
+
+    response = client.post(
+        f'/tickets/{ticket_id}',
+        data={
+            'status': 'in_progress',
+            'product': 'Lavatrice AEG',
+            'issue_description': 'Non scarica',
+            'repair_status': 'accettazione',
+        },
+        follow_redirects=True,
+    )
+    assert 'Nessuna modifica rilevata.' in response.get_data(as_text=True)
+
+
+def test_attachment_download_supports_conditional_requests(client, app, login):
+    ticket_id = _create_ticket(app)
+
+    login('admin', 'adminpass')
+    client.post(
+        f'/tickets/{ticket_id}',
+        data={
+            'form_name': 'attachments',
+            'attachments': [(io.BytesIO(b'0123456789'), 'scontrino.pdf')],
+        },
+        content_type='multipart/form-data',
+    )
+    with app.app_context():
+        attachment_id = get_db().execute(
+            'SELECT id FROM ticket_attachments WHERE ticket_id = ?',
+            (ticket_id,),
+        ).fetchone()['id']
+
+    url = f'/tickets/{ticket_id}/attachments/{attachment_id}/download'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == b'0123456789'
+    assert 'scontrino.pdf' in response.headers['Content-Disposition']
+    etag = response.headers['ETag']
+    response.close()
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.get(url, headers={'Range': 'bytes=2-4'})
+    assert response.status_code == 206
+    assert response.data == b'234'
+    response.close()
+
+
+def test_tickets_list_filters_by_status(client, app, login):
+    ticket_id = _create_ticket(app, subject='Forno ventilato')
+
+    login('user', 'userpass')
+    html = client.get('/tickets').get_data(as_text=True)
+    assert 'Forno ventilato' in html
+    assert 'AAAA - Mario Rossi' in html
+
+    html = client.get('/tickets?status=open').get_data(as_text=True)
+    assert f'/tickets/{ticket_id}' in html
+
+    html = client.get('/tickets?status=closed').get_data(as_text=True)
+    assert 'Forno ventilato' not in html
+
+    html = client.get('/tickets?status=bogus').get_data(as_text=True)
+    assert 'Forno ventilato' in html
+
+
+def test_repairs_list_renders_filtered_rows(client, app, login):
+    ticket_id = _create_ticket(app, subject='Asciugatrice', product='Bosch Serie 6')
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            'UPDATE tickets SET repair_status = ?, payment_info = ?, date_received = ? WHERE id = ?',
+            ('diagnosticato', 'Contanti', '2024-05-10', ticket_id),
+        )
+        db.commit()
+
+    login('user', 'userpass')
+    html = client.get('/repairs').get_data(as_text=True)
+    assert 'Asciugatrice' in html
+    assert 'AAAA - Mario Rossi' in html
+    assert 'Contanti' in html
+    assert 'Bosch Serie 6' in html
+
+    html = client.get('/repairs?status=diagnosticato&from_date=2024-05-01').get_data(as_text=True)
+    assert 'Asciugatrice' in html
+
+    html = client.get('/repairs?status=accettazione').get_data(as_text=True)
+    assert 'Asciugatrice' not in html
+
+    html = client.get('/repairs?to_date=2024-05-01').get_data(as_text=True)
+    assert 'Asciugatrice' not in html
+
+    response = client.get('/repairs?from_date=2024-13-45')
+    assert response.status_code == 200
+    assert 'Asciugatrice' in response.get_data(as_text=True)
+
+
+def test_repairs_list_is_paginated_with_cursor(client, app, login):
+    app.config['REPAIRS_PAGE_SIZE'] = 2
+    with app.app_context():
+        db = get_db()
+        customer_id = db.execute(
+            'INSERT INTO customers (code, name) VALUES (?, ?)',
+            ('aaaa', 'Mario Rossi'),
+        ).lastrowid
+        for day in range(1, 6):
+            db.execute(
+                'INSERT INTO tickets (customer_id, subject, product, date_returned) '
+                'VALUES (?, ?, ?, ?)',
+                (customer_id, f'Riparazione {day}', 'Forno', f'2024-05-0{day}'),
+            )
+        db.commit()
+
+    login('user', 'userpass')
+    seen = []
+    url = '/repairs'
+    while url:
+        html = client.get(url).get_data(as_text=True)
+        seen.extend(int(day) for day in re.findall(r'Riparazione (\d)<', html))
+        match = re.search(r'href="(/repairs\?cursor=[^"]+)"', html)
+        url = match.group(1).replace('&amp;', '&') if match else None
+
+    assert seen == [5, 4, 3, 2, 1]
+
+
+def test_repairs_stream_consumes_flash_messages(client, app, login):
+    ticket_id = _create_ticket(app, subject='Frigorifero', product='Whirlpool')
+
+    login('admin', 'adminpass')
+    response = client.post(f'/repairs/{ticket_id}/delete', follow_redirects=True)
+    assert response.is_streamed
+    assert 'eliminato con successo' in response.get_data(as_text=True)
+
+    html = client.get('/repairs').get_data(as_text=True)
+    assert 'eliminato con successo' not in html
+
+
+def test_delete_repair_keeps_only_known_filters(client, app, login):
+    ticket_id = _create_ticket(app, subject='Lavastoviglie', product='Miele')
+
+    login('admin', 'adminpass')
+    response = client.post(
+        f'/repairs/{ticket_id}/delete',
+        data={'filter_status': 'diagnosticato', 'filter_to_date': '', 'filter_other': 'x'},
+    )
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/repairs?status=diagnosticato'
+
+
+def test_not_found_page_is_rendered_for_anonymous_and_logged_users(client, login):
+    response = client.get('/pagina-inesistente')
+    assert response.status_code == 404
+    assert 'Pagina non trovata' in response.get_data(as_text=True)
+    assert client.get('/altra-pagina-inesistente').data == response.data
+
+    login('user', 'userpass')
+    html = client.get('/pagina-inesistente').get_data(as_text=True)
+    assert 'Pagina non trovata' in html
+    assert 'Logout' in html
+
+
+def test_dashboard_shows_counts(client, app, login):
+    ticket_id = _create_ticket(app, subject='Con riparazione', product='Forno')
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            'INSERT INTO tickets (customer_id, subject) '
+            'SELECT customer_id, ? FROM tickets WHERE id = ?',
+            ('Senza riparazione', ticket_id),
+        )
+        db.commit()
+
+    login('user', 'userpass')
+    html = client.get('/').get_data(as_text=True)
+    assert 'Ticket totali: <strong>2</strong>' in html
+    assert 'Clienti registrati: <strong>1</strong>' in html
+    assert 'Ticket con dati di riparazione: <strong>1</strong>' in html
+
+
+def test_ticket_detail_shows_last_change_per_field(client, app, login):
+    ticket_id = _create_ticket(app, product='Forno')
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO ticket_history (ticket_id, field, old_value, new_value, changed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [
+                (ticket_id, 'repair_status', 'accettazione', 'diagnosticato', '2024-05-01 10:00:00'),
+                (ticket_id, 'repair_status', 'diagnosticato', 'preventivo_pronto', '2024-05-02 10:00:00'),
+                (ticket_id, 'status', 'aperto', 'in_lavorazione', '2024-05-01 09:00:00'),
+            ],
+        )
+        db.commit()
+
+    login('user', 'userpass')
+    html = client.get(f'/tickets/{ticket_id}').get_data(as_text=True)
+    assert 'Ultimo cambio: 2024-05-01 09:00:00' in html
+    assert 'Ultimo cambio: 2024-05-02 10:00:00' in html
+    assert 'Ultimo cambio: 2024-05-01 10:00:00' not in html
+
+
+def test_lists_show_latest_status_change(client, app, login):
+    ticket_id = _create_ticket(app, product='Forno')
+    with app.app_context():
+        db = get_db()
+        admin_id = db.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()['id']
+        db.executemany(
+            'INSERT INTO ticket_history (ticket_id, field, old_value, new_value, changed_by, changed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (ticket_id, 'status', 'aperto', 'in_lavorazione', None, '2024-05-01 09:00:00'),
+                (ticket_id, 'status', 'in_lavorazione', 'chiuso', admin_id, '2024-05-03 09:00:00'),
+                (ticket_id, 'repair_status', 'accettazione', 'diagnosticato', admin_id, '2024-05-02 10:00:00'),
+            ],
+        )
+        db.commit()
+
+    login('user', 'userpass')
+    tickets_html = client.get('/tickets').get_data(as_text=True)
+    assert 'Aggiornato il 2024-05-03 09:00:00 da admin' in tickets_html
+
+    repairs_html = client.get('/repairs').get_data(as_text=True)
+    assert 'Aggiornato il 2024-05-02 10:00:00 da admin' in repairs_html
+
+
+def test_attachment_download_delegates_to_nginx_when_configured(client, app, login):
+    ticket_id = _create_ticket(app)
+    app.config['ATTACHMENT_X_ACCEL_PREFIX'] = '/_protected/'
+
+    login('admin', 'adminpass')
+    client.post(
+        f'/tickets/{ticket_id}',
+        data={
+            'form_name': 'attachments',
+            'attachments': [(io.BytesIO(b'0123456789'), 'scontrino.pdf')],
+        },
+        content_type='multipart/form-data',
+    )
+    with app.app_context():
+        attachment = get_db().execute(
+            'SELECT id, stored_filename FROM ticket_attachments WHERE ticket_id = ?',
+            (ticket_id,),
+        ).fetchone()
+
+    response = client.get(f"/tickets/{ticket_id}/attachments/{attachment['id']}/download")
+    assert response.status_code == 200
+    assert response.data == b''
+    assert 'X-Sendfile' not in response.headers
+    assert response.headers['X-Accel-Redirect'] == (
+        f"/_protected/{ticket_id}/{attachment['stored_filename']}"
+    )
+    assert 'scontrino.pdf' in response.headers['Content-Disposition']
+    etag = response.headers['ETag']
+
+    response = client.get(
+        f"/tickets/{ticket_id}/attachments/{attachment['id']}/download",
+        headers={'If-None-Match': etag},
+    )
+    assert response.status_code == 304
+    assert 'X-Accel-Redirect' not in response.headers
+
+
+def test_delete_ticket_cascades_history_and_attachments(client, app, login):
+    ticket_id = _create_ticket(app)
+
+    login('admin', 'adminpass')
+    client.post(
+        f'/tickets/{ticket_id}',
+        data={
+            'form_name': 'attachments',
+            'attachments': [(io.BytesIO(b'0123456789'), 'scontrino.pdf')],
+        },
+        content_type='multipart/form-data',
+    )
+    client.post(f'/tickets/{ticket_id}', data={'status': 'closed'})
+    ticket_folder = Path(app.config['UPLOAD_FOLDER']) / str(ticket_id)
+    assert ticket_folder.is_dir()
+
+    response = client.post(f'/tickets/{ticket_id}/delete', follow_redirects=True)
+    assert 'eliminato con successo' in response.get_data(as_text=True)
+
+    with app.app_context():
+        db = get_db()
+        for table in ('ticket_history', 'ticket_attachments'):
+            count = db.execute(
+                f'SELECT COUNT(*) FROM {table} WHERE ticket_id = ?', (ticket_id,)
+            ).fetchone()[0]
+            assert count == 0
+    assert not ticket_folder.exists()
+
+
+def test_new_ticket_form_reloads_customers_after_changes(client, app, login):
+    _create_ticket(app)
+
+    login('user', 'userpass')
+    assert 'Mario Rossi' in client.get('/tickets/new').get_data(as_text=True)
+    cached_version, _ = app.extensions['customer_choices']
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE customers SET name = 'Luigi Bianchi' WHERE code = 'aaaa'")
+        db.commit()
+
+    html = client.get('/tickets/new').get_data(as_text=True)
+    assert 'Luigi Bianchi' in html
+    assert 'Mario Rossi' not in html
+    assert app.extensions['customer_choices'][0] > cached_version
+
+
+def test_tickets_table_cache_is_refreshed_after_changes(client, app, login):
+    ticket_id = _create_ticket(app, subject='Forno rumoroso')
+
+    login('admin', 'adminpass')
+    html = client.get('/tickets').get_data(as_text=True)
+    assert 'Forno rumoroso' in html
+    assert (None, True, 1) in app.extensions['tickets_table_cache']
+    assert client.get('/tickets').get_data(as_text=True) == html
+
+    client.post(f'/tickets/{ticket_id}', data={'status': 'closed'})
+    html = client.get('/tickets').get_data(as_text=True)
+    assert '<span class="badge badge-closed">Chiuso</span>' in html
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE customers SET name = 'Luigi Bianchi' WHERE code = 'aaaa'")
+        db.commit()
+    assert 'Luigi Bianchi' in client.get('/tickets').get_data(as_text=True)
+
+
+def test_tickets_list_is_paginated(client, app, login):
+    app.config['TICKETS_PAGE_SIZE'] = 2
+    ticket_id = _create_ticket(app, subject='Ticket 0')
+    with app.app_context():
+        db = get_db()
+        customer_id = db.execute('SELECT customer_id FROM tickets WHERE id = ?', (ticket_id,)).fetchone()[0]
+        db.executemany(
+            'INSERT INTO tickets (customer_id, subject) VALUES (?, ?)',
+            [(customer_id, f'Ticket {index}') for index in range(1, 5)],
+        )
+        db.commit()
+
+    login('user', 'userpass')
+    html = client.get('/tickets').get_data(as_text=True)
+    assert 'Pagina 1 di 3' in html
+    assert re.findall(r'<td>(Ticket \d)</td>', html) == ['Ticket 4', 'Ticket 3']
+
+    html = client.get('/tickets?page=3').get_data(as_text=True)
+    assert re.findall(r'<td>(Ticket \d)</td>', html) == ['Ticket 0']
+
+    response = client.get('/tickets?page=9')
+    assert response.status_code == 302
+
+
+def test_login_checks_a_hash_even_for_unknown_users(client, monkeypatch):
+    import auth
+
+    checked = []
+    real_check = auth.check_password_hash
+
+    def _check(password_hash, password):
+        checked.append(password_hash)
+        return real_check(password_hash, password)
+
+    monkeypatch.setattr(auth, 'check_password_hash', _check)
+
+    response = client.post(
+        '/auth/login',
+        data={'username': 'sconosciuto', 'password': 'adminpass'},
+        follow_redirects=True,
+    )
+
+    assert 'Credenziali non valide.' in response.get_data(as_text=True)
+    assert checked == [auth._dummy_password_hash()]
+
+
+def test_register_rejects_duplicate_username(client, app):
+    response = client.post(
+        '/auth/register',
+        data={'username': 'nuovo', 'password': 'segreta'},
+        follow_redirects=True,
+    )
+    assert 'Utente registrato con successo.' in response.get_data(as_text=True)
+
+    response = client.post(
+        '/auth/register',
+        data={'username': 'admin', 'password': 'segreta'},
+        follow_redirects=True,
+    )
+    assert 'Il nome utente è già in uso.' in response.get_data(as_text=True)
+
+    with app.app_context():
+        rows = get_db().execute(
+            "SELECT username, role FROM users WHERE username IN ('admin', 'nuovo') ORDER BY username"
+        ).fetchall()
+    assert [tuple(row) for row in rows] == [('admin', 'admin'), ('nuovo', 'user')]
+
+
+def test_bumping_token_version_invalidates_sessions(client, app, login):
+    login('user', 'userpass')
+    assert client.get('/tickets').status_code == 200
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE users SET token_version = token_version + 1 WHERE username = 'user'")
+        db.commit()
+
+    response = client.get('/tickets')
+    assert response.status_code == 302
+    assert '/auth/login' in response.headers['Location']
+
+
+def test_admin_can_revoke_user_sessions(client, app, login):
+    user_client = app.test_client()
+    user_client.post('/auth/login', data={'username': 'user', 'password': 'userpass'})
+    assert user_client.get('/tickets').status_code == 200
+
+    login('admin', 'adminpass')
+    with app.app_context():
+        user_id = get_db().execute("SELECT id FROM users WHERE username = 'user'").fetchone()['id']
+    response = client.post(f'/admin/users/{user_id}/revoke-sessions', follow_redirects=True)
+    assert 'Sessioni dell&#39;utente &#34;user&#34; revocate.' in response.get_data(as_text=True)
+
+    response = user_client.get('/tickets')
+    assert response.status_code == 302
+    assert '/auth/login' in response.headers['Location']
+    assert client.get('/tickets').status_code == 200
+
+
+def test_promotion_closes_existing_sessions_of_the_user(client, app, login):
+    user_client = app.test_client()
+    user_client.post('/auth/login', data={'username': 'user', 'password': 'userpass'})
+
+    login('admin', 'adminpass')
+    with app.app_context():
+        user_id = get_db().execute("SELECT id FROM users WHERE username = 'user'").fetchone()['id']
+    client.post(f'/admin/users/{user_id}/promote')
+
+    assert user_client.get('/tickets').status_code == 302
+
+
+def test_sessions_without_version_stay_valid_until_revoked(client, app):
+    with app.app_context():
+        db = get_db()
+        user_id = db.execute("SELECT id FROM users WHERE username = 'user'").fetchone()['id']
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    assert client.get('/tickets').status_code == 200
+
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE users SET token_version = token_version + 1 WHERE id = ?', (user_id,))
+        db.commit()
+    assert client.get('/tickets').status_code == 302
+
+
+def test_register_remembers_that_an_admin_exists(client, app):
+    app.extensions.pop('admin_exists', None)
+    assert client.get('/auth/register').status_code == 200
+    assert app.extensions['admin_exists'] is True
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE users SET role = 'user'")
+        db.commit()
+
+    response = client.post(
+        '/auth/register',
+        data={'username': 'nuovo', 'password': 'segreta'},
+        follow_redirects=True,
+    )
+    assert 'Utente registrato con successo.' in response.get_data(as_text=True)
+    with app.app_context():
+        role = get_db().execute("SELECT role FROM users WHERE username = 'nuovo'").fetchone()[0]
+    assert role == 'user'
+
+
+def test_admin_pages_require_login_then_admin_role(client, login):
+    response = client.get('/admin/users')
+    assert response.status_code == 302
+    assert '/auth/login' in response.headers['Location']
+
+    login('user', 'userpass')
+    response = client.get('/admin/users', follow_redirects=True)
+    assert 'Non hai i permessi necessari' in response.get_data(as_text=True)
+
+    client.get('/auth/logout')
+    login('admin', 'adminpass')
+    assert client.get('/admin/users').status_code == 200